@@ -15,9 +15,11 @@
 """
 <plugin key="SDM630-MCT_M_V2" name="Eastron SDM630 MCT Modbus V2 Energy Meter" author="Filip Demaertelaere and adapted by Filip Sobstel" version="1.0.0">
     <params>
-        <param field="SerialPort" label="Serial Port" width="120px" required="true"/>
-        <param field="Mode1" label="Slave Unit ID" width="120px" required="true" default="1"/>
-        <param field="Mode2" label="Baudrate" width="120px" required="true">
+        <param field="SerialPort" label="Serial Port" width="120px" required="false"/>
+        <param field="Address" label="Gateway IP Address (TCP)" width="120px" required="false"/>
+        <param field="Port" label="Gateway Port (TCP)" width="60px" required="false" default="502"/>
+        <param field="Mode1" label="Slave Unit ID(s), comma separated" width="120px" required="true" default="1"/>
+        <param field="Mode2" label="Baudrate (of the RS485 bus)" width="120px" required="true">
             <options>
                 <option label="1200" value="1200"/>
                 <option label="2400" value="2400"/>
@@ -34,9 +36,11 @@
                 <option label="StopBits 2 / ByteSize 8 / Parity: None" value="S2B8PN"/>
                 <option label="StopBits 2 / ByteSize 8 / Parity: Even" value="S2B8PE"/>
                 <option label="StopBits 2 / ByteSize 8 / Parity: Odd" value="S2B8PO"/>
+                <option label="Modbus TCP gateway (IP Address, Port)" value="TCP"/>
+                <option label="RTU over TCP gateway (IP Address, Port)" value="RTUTCP"/>
             </options>
         </param>
-        <param field="Mode4" label="Offset Total Active Energy (kWh)" width="120px" required="true" default="0"/>
+        <param field="Mode4" label="Offset Total Active Energy (kWh), per meter" width="120px" required="true" default="0"/>
         <param field="Mode5" label="Minutes between update" width="120px" required="true" default="1"/>
         <param field="Mode6" label="Debug" width="120px">
             <options>
@@ -51,12 +55,24 @@
 #IMPORTS
 import Domoticz
 import subprocess
-import sys
-import pymodbus
-sys.path.append('/usr/local/lib/python3.7/dist-packages')
-from pymodbus.client.sync import ModbusSerialClient 	# RTU
-from pymodbus.payload import BinaryPayloadDecoder	
-from pymodbus.constants import Endian
+import os
+import time
+import threading
+import queue
+import collections
+import struct
+import math
+import socket
+import select
+import array
+import sqlite3
+import csv
+import json
+import http.client
+try:
+    import serial                                       # pyserial, for the built-in RTU client
+except ImportError:
+    serial = None
 
 #DEVICES TO CREATE
 _UNIT_VOLTAGE_L1 = 1
@@ -77,9 +93,9 @@ _UNIT_REACTIVEPOWER_L1 = 12
 _UNIT_REACTIVEPOWER_L2 = 13
 _UNIT_REACTIVEPOWER_L3 = 14
 
-#_UNIT_POWERFACTOR_L1 = 15
-#_UNIT_POWERFACTOR_L2 = 16
-#_UNIT_POWERFACTOR_L3 = 17
+_UNIT_POWERFACTOR_L1 = 15
+_UNIT_POWERFACTOR_L2 = 16
+_UNIT_POWERFACTOR_L3 = 17
 
 _UNIT_FREQUENCY = 18
 
@@ -94,34 +110,62 @@ _UNIT_NET_KWH = 23
 _UNIT_IMPORTENERGY = 24
 _UNIT_EXPORTENERGY = 25
 
-#_UNIT_APPARENTPOWER_L1 = 26
-#_UNIT_APPARENTPOWER_L2 = 27
-#_UNIT_APPARENTPOWER_L3 = 28
+_UNIT_APPARENTPOWER_L1 = 26
+_UNIT_APPARENTPOWER_L2 = 27
+_UNIT_APPARENTPOWER_L3 = 28
 
-#_UNIT_AVERAGELINETONEUTRALVOLTS = 29
-#_UNIT_AVERAGELINECURRENT = 30
-#_UNIT_SUMOFLINECURRENTS = 31
+_UNIT_AVERAGELINETONEUTRALVOLTS = 29
+_UNIT_AVERAGELINECURRENT = 30
+_UNIT_SUMOFLINECURRENTS = 31
 
-#_UNIT_TOTALSYSTEMVOLTAMPS = 32
-#_UNIT_TOTALSYSTEMPOWERFACTOR = 33
+_UNIT_TOTALSYSTEMVOLTAMPS = 32
+_UNIT_TOTALSYSTEMPOWERFACTOR = 33
 
-#_UNIT_L1TOL2VOLTS = 34
-#_UNIT_L2TOL3VOLTS = 35
-#_UNIT_L3TOL1VOLTS = 36
-#_UNIT_AVERAGELINETOLINEVOLTS = 37
+_UNIT_L1TOL2VOLTS = 34
+_UNIT_L2TOL3VOLTS = 35
+_UNIT_L3TOL1VOLTS = 36
+_UNIT_AVERAGELINETOLINEVOLTS = 37
 
-#_UNIT_NEUTRALCURRENT = 38
+_UNIT_NEUTRALCURRENT = 38
 
-#_UNIT_RESETTABLETOTALACTIVEENERGY = 39
-#_UNIT_RESETTABLEIMPORTACTIVEENERGY = 40
-#_UNIT_RESETTABLEEXPORTACTIVEENERGY = 41
+_UNIT_RESETTABLETOTALACTIVEENERGY = 39
+_UNIT_RESETTABLEIMPORTACTIVEENERGY = 40
+_UNIT_RESETTABLEEXPORTACTIVEENERGY = 41
+
+_UNIT_TOTALSYSTEMPOWER_MIN = 42
+_UNIT_TOTALSYSTEMPOWER_MAX = 43
+
+_UNIT_CURRENT_L1_MAX = 44
+_UNIT_CURRENT_L2_MAX = 45
+_UNIT_CURRENT_L3_MAX = 46
+
+_UNIT_VOLTAGE_L1_MIN = 47
+_UNIT_VOLTAGE_L2_MIN = 48
+_UNIT_VOLTAGE_L3_MIN = 49
+
+#SEVERAL METERS ON ONE BUS: THE METER IN BLOCK N USES UNITS N*_METER_UNITS + _UNIT_*
+#A slave ID keeps its block (see MeterBlocks) when the list of slave IDs is reordered or shortened.
+_METER_UNITS = 50
+_MAX_METERS = 5         # Domoticz allows 255 units per hardware entry
+_METER_BLOCKS = "meters.json"   # Block of every slave ID per hardware entry, in the plugin folder
+
+#POLL STATISTICS DEVICES (NOT USED BY DEFAULT), AFTER THE UNITS OF THE METERS
+_UNIT_POLLCYCLETIME = 251
+_UNIT_REQUESTLATENCY = 252
+_UNIT_BUSERRORS = 253
+_UNIT_RETRIES = 254
 
 #DEFAULT IMAGE
 _NO_IMAGE_UPDATE = -1
 _IMAGE = "SDM120"
 
 #THE HAERTBEAT IS EVERY 10s
-_MINUTE = 6
+_HEARTBEAT = 10
+_MINUTE = 60
+
+#BACKGROUND POLLING
+_SNAPSHOT_QUEUE = 4     # Decoded snapshots waiting for the heartbeat; when full the oldest is folded into the next one
+_POLLER_JOIN = 10       # Seconds onStop waits for the poller to finish its current request
 
 #VALUE TO INDICATE THAT THE DEVICE TIMED-OUT
 _TIMEDOUT = 1
@@ -130,6 +174,244 @@ _TIMEDOUT = 1
 _DEBUG_OFF = 0
 _DEBUG_ON = 1
 
+#POLL STATISTICS
+_METRICS_INTERVAL = 300                                     # Seconds between two dumps to the log and updates of the statistics devices
+_LATENCY_BUCKETS = [10, 20, 50, 100, 200, 500, 1000, 2000]   # Upper bounds (ms) of the request latency histogram
+
+#SETTINGS WITHOUT A FIELD ON THE HARDWARE PAGE: A JSON FILE IN THE PLUGIN FOLDER, NOT PART OF THE REPOSITORY
+#Each key overrides the constant it names below, e.g. {"History": true}; see LoadSettings.
+_SETTINGS = "settings.json"             # "" = none, as for the tools, which must not take the settings of the plugin in Domoticz
+_SETTING_NAMES = {
+    "History": "_HISTORY",
+    "HistoryDays": "_HISTORY_DAYS",
+    "HistoryMaxBytes": "_HISTORY_MAX_BYTES",
+    "Export": "_EXPORT",
+    "ExportHost": "_EXPORT_HOST",
+    "ExportPort": "_EXPORT_PORT",
+    "ExportTopic": "_EXPORT_TOPIC",
+    "ExportPath": "_EXPORT_PATH",
+    "ExportToken": "_EXPORT_TOKEN",
+    "ExportMeasurement": "_EXPORT_MEASUREMENT",
+    "Trace": "_TRACE",
+    "TraceMaxBytes": "_TRACE_MAX_BYTES",
+    "Replay": "_REPLAY",
+    "ReplayRealtime": "_REPLAY_REALTIME",
+}
+
+#HISTORY STORE: EVERY DECODED VALUE IN ONE SQLITE FILE PER DAY IN THE PLUGIN FOLDER (OFF BY DEFAULT)
+_HISTORY = False
+_HISTORY_FOLDER = "history"
+_HISTORY_DAYS = 31                      # Day files older than this are deleted
+_HISTORY_MAX_BYTES = 256*1024*1024      # The oldest day files are deleted while all files together are larger
+_HISTORY_FLUSH = 60                     # Seconds between two commits (each commit is one write burst to the SD card)
+_HISTORY_BATCH = 10000                  # Values that force a commit before _HISTORY_FLUSH
+_HISTORY_QUEUE = 300                    # Snapshots waiting for the writer; new ones are dropped when full
+_HISTORY_ROTATE = 3600                  # Seconds between two checks of the age and size limits
+
+#EXPORT OF EVERY POLL CYCLE TO OTHER SYSTEMS (OFF BY DEFAULT)
+_EXPORT = ""                            # "" (off), "mqtt" (JSON), "influx-http" or "influx-udp" (line protocol)
+_EXPORT_HOST = "127.0.0.1"
+_EXPORT_PORT = 1883                     # 1883 for MQTT, 8086 for InfluxDB (HTTP and UDP)
+_EXPORT_TOPIC = "domoticz/sdm630"       # MQTT topic
+_EXPORT_PATH = "/write?db=energy"       # InfluxDB 1 write path; InfluxDB 2: "/api/v2/write?org=...&bucket=..."
+_EXPORT_TOKEN = ""                      # InfluxDB 2 API token
+_EXPORT_MEASUREMENT = "sdm630"          # InfluxDB measurement, one line per meter with the slave ID as tag
+_EXPORT_BATCH = 30                      # Poll cycles sent at most per flush
+_EXPORT_FLUSH = 10                      # Seconds between two flushes
+_EXPORT_BUFFER = 1000                   # Poll cycles kept while the sink is down; the oldest are dropped
+_UDP_PAYLOAD = 1400                     # Bytes per datagram, below the usual MTU
+_MQTT_KEEPALIVE = 60
+
+#RECORD AND REPLAY OF THE MODBUS TRAFFIC
+_TRACE = ""                             # Trace file (in the plugin folder) to record every request and response to, "" = off
+_TRACE_MAX_BYTES = 64*1024*1024         # Recording stops when the trace file reaches this size
+_REPLAY = ""                            # Trace file (in the plugin folder) to read the meters from instead of the bus (see tools/replay.py)
+_REPLAY_REALTIME = False                # Replay at the recorded speed instead of as fast as possible
+
+#TRACE FILE: _TRACE_MAGIC, THEN RECORDS OF _TRACE_RECORD (TIME, LATENCY, STATUS, FRAME BYTES) AND THE FRAMES
+#A request record holds the request frame (8 bytes) and the response frame as RTU frames with CRC; a cycle record
+#marks the start of a poll cycle and holds the polling tiers that were due.
+_TRACE_MAGIC = b"SDM630T1"
+_TRACE_RECORD = struct.Struct(">dfBH")
+_TRACE_OK = 0
+_TRACE_EXCEPTION = 1
+_TRACE_TIMEOUT = 2
+_TRACE_CRC = 3
+_TRACE_LINK = 4                         # The port or connection failed, no response
+_TRACE_CYCLE = 255
+_TRACE_UNKNOWN = (b"\x7f\xc0", b"\x00\x00")   # A register that was not recorded replays as a float NaN
+
+#MODBUS REQUEST PLANNING
+_MAX_REGISTERS = 80     # SDM630 answers at most 40 parameters (80 registers) per request
+_MAX_GAP = 32           # Unused registers the planner may read through to save a request (0 = contiguous only)
+_REQUEST_BYTES = 8      # Slave ID, function, address (2), count (2), CRC (2)
+_RESPONSE_BYTES = 5     # Slave ID, function, byte count, CRC (2) + 2 bytes per register
+
+#POLLING TIERS: EACH VALUE IS READ EVERY _TIER_PERIODS[TIER] SECONDS, BUT AT LEAST EVERY "MINUTES BETWEEN UPDATE"
+_TIER_FAST = 0          # Power and current
+_TIER_MEDIUM = 1        # Voltage and frequency
+_TIER_SLOW = 2          # Energy counters
+_TIER_SAMPLE = 3        # Sampled values (see _SAMPLED_UNITS), also read in their own tier
+_TIER_PERIODS = {_TIER_FAST: 5, _TIER_MEDIUM: 30, _TIER_SLOW: 300, _TIER_SAMPLE: 2}
+
+#DEVICE WRITES PER POLLING TIER: (MINIMUM, MAXIMUM) SECONDS BETWEEN TWO WRITES OF A DEVICE
+#A value is written when it leaves the deadband of the device, but not sooner than the minimum interval;
+#after the maximum interval it is written anyway, so the device does not look dead in Domoticz.
+_WRITE_INTERVALS = {_TIER_FAST: (0, 300), _TIER_MEDIUM: (30, 300), _TIER_SLOW: (60, 900)}
+
+#SERIAL CONNECTION HEALTH
+_LINK_CLOSED = 0
+_LINK_OK = 1
+_LINK_FAILED = 2
+_RECONNECT_MIN = 10     # Seconds before the first reconnect attempt after a serial error
+_RECONNECT_MAX = 600    # Reconnect attempts back off (doubling) up to this many seconds
+
+#TCP GATEWAYS (PORT SETTINGS "TCP" AND "RTUTCP"): FRAMING ON THE CONNECTION AND TCP KEEPALIVE
+_FRAMING_TCP = 0        # Modbus TCP: MBAP header with a transaction ID, requests to several meters are pipelined
+_FRAMING_RTU = 1        # RTU frames (with CRC) over TCP, one request at a time
+_GATEWAYS = {"TCP": _FRAMING_TCP, "RTUTCP": _FRAMING_RTU}
+_KEEPALIVE_IDLE = 60    # Seconds without traffic before the first keepalive probe
+_KEEPALIVE_INTERVAL = 10
+_KEEPALIVE_COUNT = 3    # Unanswered probes before the connection is declared dead
+_GATEWAY_EXCEPTIONS = (0x0A, 0x0B)  # Gateway path unavailable, gateway target failed to respond: the meter did not answer
+
+#SERIAL CLIENT: THE BUILT-IN RTU CLIENT (PYSERIAL ONLY), OR PYMODBUS AS BEFORE WHEN FALSE
+_NATIVE_RTU = True
+
+#REQUEST TIMEOUTS: TIME ON THE WIRE AT THE BAUDRATE + SMOOTHED METER TURNAROUND + 4 X ITS DEVIATION
+_TURNAROUND = 0.1       # Initial guess of the meter turnaround (seconds), adjusted with every response
+_TIMEOUT_MIN = 0.05
+_TIMEOUT_MAX = 3.0
+_SERIAL_TIMEOUT = 0.01  # Fixed timeout of one read of the serial port; a response is read until the request timeout
+
+#CIRCUIT BREAKER PER METER
+_METER_ONLINE = 0
+_METER_OFFLINE = 1      # Not polled until the next probe
+_METER_PROBING = 2      # One request to check whether it answers again
+_BREAKER_FAILURES = 3   # Consecutive failed requests before a meter is taken offline
+_PROBE_MIN = 30         # Seconds before the first probe of an offline meter
+_PROBE_MAX = 600        # Probes back off (doubling) up to this many seconds
+
+#HIGH-RATE SAMPLING: THESE VALUES ARE READ EVERY _TIER_PERIODS[_TIER_SAMPLE] SECONDS INTO A RING BUFFER,
+#WHICH IS AGGREGATED (MIN, MAX, MEAN, LAST) EVERY "MINUTES BETWEEN UPDATE" FOR THE STATISTIC DEVICES
+#Only while a statistic device of the value is used, or the history store or the export keeps every value read.
+_SAMPLED_UNITS = [_UNIT_VOLTAGE_L1, _UNIT_VOLTAGE_L2, _UNIT_VOLTAGE_L3, _UNIT_CURRENT_L1, _UNIT_CURRENT_L2, _UNIT_CURRENT_L3,
+                  _UNIT_TOTALSYSTEMPOWER, _UNIT_ACTIVEPOWER_L1, _UNIT_ACTIVEPOWER_L2, _UNIT_ACTIVEPOWER_L3]
+_AGGREGATE_MIN = 0
+_AGGREGATE_MAX = 1
+_AGGREGATE_MEAN = 2
+_AGGREGATE_LAST = 3
+
+#DEVICE TYPES
+_DEVICE_VOLTAGE = 0     # General/Voltage device
+_DEVICE_CUSTOM = 1      # Custom sensor with the SDM120 image
+
+#DATA TYPES (STRUCT FORMAT, BIG ENDIAN): ALL SDM630 INPUT REGISTERS ARE 32 BIT FLOATS IN 2 REGISTERS
+_FLOAT32 = "f"
+
+#REGISTER MAP: DRIVES THE DEVICE CREATION, THE POLLING AND THE DECODING
+#Scale is applied to the decoded value; Measure is the unit of measure shown by Domoticz.
+#Registers are only read when their device is set as used (Setup-Devices).
+#A new value is only written to the device when it differs from the last written one by more than
+#Deadband (absolute) and Relative (fraction of the last written value), see _WRITE_INTERVALS.
+Register = collections.namedtuple("Register", "Unit Name StrData Address Type Scale Measure Kind Used Tier Deadband Relative")
+_REGISTERS = [
+    #        Unit                                 Name                                StrData                             Address  Type       Scale  Measure    Kind              Used  Tier           Deadband  Relative
+    Register(_UNIT_VOLTAGE_L1,                    "Voltage L1",                       "Voltage_L1",                       0x0000,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  1,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_VOLTAGE_L2,                    "Voltage L2",                       "Voltage_L2",                       0x0002,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  1,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_VOLTAGE_L3,                    "Voltage L3",                       "Voltage_L3",                       0x0004,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  1,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_CURRENT_L1,                    "Current L1",                       "Current_L1",                       0x0006,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_CURRENT_L2,                    "Current L2",                       "Current_L2",                       0x0008,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_CURRENT_L3,                    "Current L3",                       "Current_L3",                       0x000A,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_TOTALSYSTEMPOWER,              "Total System Power",               "Total_System_Power",               0x0034,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_ACTIVEPOWER_L1,                "Active Power L1",                  "Active_Power_L1",                  0x000C,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_ACTIVEPOWER_L2,                "Active Power L2",                  "Active_Power_L2",                  0x000E,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_ACTIVEPOWER_L3,                "Active Power L3",                  "Active_Power_L3",                  0x0010,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_TOTALREACTIVEPOWER,            "Total Reactive Power",             "Total_Reactive_Power",             0x003C,  _FLOAT32,  1,     "KVar",    _DEVICE_CUSTOM,   1,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_REACTIVEPOWER_L1,              "Reactive Power L1",                "Reactive_Power_L1",                0x0018,  _FLOAT32,  1,     "Var",     _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_REACTIVEPOWER_L2,              "Reactive Power L2",                "Reactive_Power_L2",                0x001A,  _FLOAT32,  1,     "Var",     _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_REACTIVEPOWER_L3,              "Reactive Power L3",                "Reactive_Power_L3",                0x001C,  _FLOAT32,  1,     "Var",     _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_POWERFACTOR_L1,                "Power factor L1",                  "Power_Factor_L1",                  0x001E,  _FLOAT32,  1,     "",        _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.01,     0),
+    Register(_UNIT_POWERFACTOR_L2,                "Power factor L2",                  "Power_Factor_L2",                  0x0020,  _FLOAT32,  1,     "",        _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.01,     0),
+    Register(_UNIT_POWERFACTOR_L3,                "Power factor L3",                  "Power_Factor_L3",                  0x0022,  _FLOAT32,  1,     "",        _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.01,     0),
+    Register(_UNIT_FREQUENCY,                     "Frequency",                        "Frequency",                        0x0046,  _FLOAT32,  1,     "Hz",      _DEVICE_CUSTOM,   1,    _TIER_MEDIUM,  0.02,     0),
+    Register(_UNIT_TOTALACTIVEENERGY,             "Total Active Energy",              "TotalActiveEnergy",                0x0156,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   1,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_TOTALREACTIVEENERGY,           "Total Reactive Energy",            "TotalReactiveEnergy",              0x0158,  _FLOAT32,  1,     " kVArh",  _DEVICE_CUSTOM,   0,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_TOTALIMPORTACTIVEENERGY,       "Total Import Active Energy",       "TotalImportActiveEnergy",          0x0500,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_TOTALEXPORTACTIVEENERGY,       "Total Export Active Energy",       "TotalExportActiveEnergy",          0x0502,  _FLOAT32,  1,     "W",       _DEVICE_CUSTOM,   1,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_NET_KWH,                       "Net Kwh Import-Export",            "NetkWh",                           0x018C,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   0,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_IMPORTENERGY,                  "Import Energy",                    "ImportEnergy",                     0x0048,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   1,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_EXPORTENERGY,                  "Export Energy",                    "ExportEnergy",                     0x004A,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   1,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_APPARENTPOWER_L1,              "Apparent Power L1",                "Apparent_Power_L1",                0x0012,  _FLOAT32,  1,     "VA",      _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_APPARENTPOWER_L2,              "Apparent Power L2",                "Apparent_Power_L2",                0x0014,  _FLOAT32,  1,     "VA",      _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_APPARENTPOWER_L3,              "Apparent Power L3",                "Apparent_Power_L3",                0x0016,  _FLOAT32,  1,     "VA",      _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_AVERAGELINETONEUTRALVOLTS,     "Average Line to neutral Volts",    "Average_line_to_neutral_volts",    0x002A,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  0,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_AVERAGELINECURRENT,            "Average Line Current",             "Average_line_current",             0x002E,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_SUMOFLINECURRENTS,             "Sum of line currents",             "Sum_of_line_currents",             0x0030,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_TOTALSYSTEMVOLTAMPS,           "Total system Volt Amps",           "Total_system_Volt_Amps",           0x0038,  _FLOAT32,  1,     "VA",      _DEVICE_CUSTOM,   0,    _TIER_FAST,    5,        0.01),
+    Register(_UNIT_TOTALSYSTEMPOWERFACTOR,        "Total system Power Factor",        "Total_system_Power_Factor",        0x003E,  _FLOAT32,  1,     "",        _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.01,     0),
+    Register(_UNIT_L1TOL2VOLTS,                   "L1 to L2 Voltage",                 "L1_to_L2_Voltage",                 0x00C8,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  0,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_L2TOL3VOLTS,                   "L2 to L3 Voltage",                 "L2_to_L3_Voltage",                 0x00CA,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  0,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_L3TOL1VOLTS,                   "L3 to L1 Voltage",                 "L3_to_L1_Voltage",                 0x00CC,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  0,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_AVERAGELINETOLINEVOLTS,        "Average line to Line Voltage",     "Average_line_to_Line_Voltage",     0x00CE,  _FLOAT32,  1,     "V",       _DEVICE_VOLTAGE,  0,    _TIER_MEDIUM,  0.5,      0),
+    Register(_UNIT_NEUTRALCURRENT,                "Neutral Current",                  "Neutral_Current",                  0x00E0,  _FLOAT32,  1,     "A",       _DEVICE_CUSTOM,   0,    _TIER_FAST,    0.05,     0),
+    Register(_UNIT_RESETTABLETOTALACTIVEENERGY,   "Ressetable Total Active Energy",   "Ressetable_Total_Active_Energy",   0x0180,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   0,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_RESETTABLEIMPORTACTIVEENERGY,  "Ressetable Import Active Energy",  "Ressetable_Import_Active_Energy",  0x0184,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   0,    _TIER_SLOW,    0.01,     0),
+    Register(_UNIT_RESETTABLEEXPORTACTIVEENERGY,  "Ressetable Export Active Energy",  "Ressetable_Export_Active_Energy",  0x0186,  _FLOAT32,  1,     "kWh",     _DEVICE_CUSTOM,   0,    _TIER_SLOW,    0.01,     0),
+]
+
+#DERIVED VALUES: COMPUTED FROM OTHER REGISTERS INSTEAD OF READ FROM THE METER (FALSE: READ THEM ALL FROM THE METER)
+#When the device of a derived register is used, its sources are read instead (in the tier of the derived register)
+#and the value is computed by the poller from the latest value of each source. A source may itself be derived,
+#as long as it comes earlier in the list. Line to line voltages and the neutral current need the phase angles,
+#which the meter does not give, so they are always read.
+_DERIVE = True
+
+def Product(Values):
+    return Values[0]*Values[1]
+
+#POWER FACTOR: ACTIVE / APPARENT POWER, NEGATIVE WHEN EXPORTING
+def PowerFactor(Values):
+    if not Values[1]:
+        return 0.0
+    return min(max(Values[0]/Values[1], -1.0), 1.0)
+
+def Mean(Values):
+    return sum(Values)/len(Values)
+
+Derived = collections.namedtuple("Derived", "Address Function Sources")
+_DERIVED = [
+    #       Address  Function      Sources
+    Derived(0x0012,  Product,      (0x0000, 0x0006)),           # Apparent power L1 = voltage L1 x current L1
+    Derived(0x0014,  Product,      (0x0002, 0x0008)),           # Apparent power L2
+    Derived(0x0016,  Product,      (0x0004, 0x000A)),           # Apparent power L3
+    Derived(0x001E,  PowerFactor,  (0x000C, 0x0012)),           # Power factor L1 = active power L1 / apparent power L1
+    Derived(0x0020,  PowerFactor,  (0x000E, 0x0014)),           # Power factor L2
+    Derived(0x0022,  PowerFactor,  (0x0010, 0x0016)),           # Power factor L3
+    Derived(0x002A,  Mean,         (0x0000, 0x0002, 0x0004)),   # Average line to neutral volts
+    Derived(0x002E,  Mean,         (0x0006, 0x0008, 0x000A)),   # Average line current
+    Derived(0x0030,  sum,          (0x0006, 0x0008, 0x000A)),   # Sum of line currents
+    Derived(0x0038,  sum,          (0x0012, 0x0014, 0x0016)),   # Total system volt amps
+    Derived(0x003E,  PowerFactor,  (0x0034, 0x0038)),           # Total system power factor = total power / total volt amps
+]
+
+#STATISTIC DEVICES (NOT USED BY DEFAULT): AN AGGREGATE OF THE SAMPLES OF A REGISTER OVER THE UPDATE INTERVAL
+#The device gets the type and unit of measure of the register; the register must be in _SAMPLED_UNITS.
+#Only the side that shows a problem is offered per phase (current peaks, voltage dips): all min and max devices of
+#voltage, current and power would need 61 units per meter, and _MAX_METERS x _METER_UNITS must stay below the metrics
+#units. To watch another aggregate, change an entry here (the unit keeps its device, so delete that device first).
+Statistic = collections.namedtuple("Statistic", "Unit Name Address Aggregate")
+_STATISTICS = [
+    Statistic(_UNIT_TOTALSYSTEMPOWER_MIN,  "Total System Power Min",  0x0034,  _AGGREGATE_MIN),
+    Statistic(_UNIT_TOTALSYSTEMPOWER_MAX,  "Total System Power Max",  0x0034,  _AGGREGATE_MAX),
+    Statistic(_UNIT_CURRENT_L1_MAX,        "Current L1 Max",          0x0006,  _AGGREGATE_MAX),
+    Statistic(_UNIT_CURRENT_L2_MAX,        "Current L2 Max",          0x0008,  _AGGREGATE_MAX),
+    Statistic(_UNIT_CURRENT_L3_MAX,        "Current L3 Max",          0x000A,  _AGGREGATE_MAX),
+    Statistic(_UNIT_VOLTAGE_L1_MIN,        "Voltage L1 Min",          0x0000,  _AGGREGATE_MIN),
+    Statistic(_UNIT_VOLTAGE_L2_MIN,        "Voltage L2 Min",          0x0002,  _AGGREGATE_MIN),
+    Statistic(_UNIT_VOLTAGE_L3_MIN,        "Voltage L3 Min",          0x0004,  _AGGREGATE_MIN),
+]
+
 
 ################################################################################
 # Start Plugin
@@ -139,11 +421,25 @@ class BasePlugin:
 
     def __init__(self):
         self.debug = _DEBUG_OFF
-        self.runAgain = 0
         self.StopBits = 1
         self.ByteSize = 8
         self.Parity = "N"
-        self.Offset = 0
+        self.Offsets = {}
+        self.Configured = []
+        self.Slaves = []
+        self.Bases = {}
+        self.Registers = {}
+        self.Wanted = {}
+        self.Writes = None
+        self.Metrics = None
+        self.NextMetrics = 0
+        self.Samples = None
+        self.Interval = _MINUTE
+        self.NextAggregate = 0
+        self.History = None
+        self.Exporter = None
+        self.Link = None
+        self.Poller = None
         return
 
     def onStart(self):
@@ -156,6 +452,9 @@ class BasePlugin:
             self.debug = _DEBUG_OFF
         Domoticz.Debugging(self.debug)
 
+        # Optional settings, kept out of plugin.py (see _SETTINGS)
+        LoadSettings()
+
         # Serial settings
         if (Parameters["Mode3"] == "S1B8PN"): self.StopBits, self.ByteSize, self.Parity = 1, 8, "N"
         if (Parameters["Mode3"] == "S1B8PE"): self.StopBits, self.ByteSize, self.Parity = 1, 8, "E"
@@ -164,28 +463,81 @@ class BasePlugin:
         if (Parameters["Mode3"] == "S2B8PE"): self.StopBits, self.ByteSize, self.Parity = 2, 8, "E"
         if (Parameters["Mode3"] == "S2B8PO"): self.StopBits, self.ByteSize, self.Parity = 2, 8, "O"
 
+        # Meters on the bus, each in the block of device units it had before
+        self.Configured = ParseSlaves(Parameters["Mode1"])
+        self.Bases = dict((Slave, MeterBase(Block)) for Slave, Block in MeterBlocks(self.Configured).items())
+        self.Slaves = [Slave for Slave in self.Configured if Slave in self.Bases]
+
         # Get Offset (kWh already consumed)
-        self.Offset = float(Parameters["Mode4"])
+        self.Offsets = dict(zip(self.Configured, ParseOffsets(Parameters["Mode4"], len(self.Configured))))
 
         # Check if images are in database
         if _IMAGE not in Images:
             Domoticz.Image("SDM630MCT_v2.zip").Create()
         Domoticz.Debug("Images created.")
 
-        # Create devices (USED BY DEFAULT)
-        CreateDevicesUsed()
+        # Create devices (the common ones as used, the others as not used)
+        for Slave in self.Slaves:
+            CreateDevices(self.Bases[Slave], MeterPrefix(self.Bases[Slave], Slave))
 
-        # Create devices (NOT USED BY DEFAULT)
-        CreateDevicesNotUsed()
+        # Poll statistics devices
+        CreateMetricsDevices()
 
         # Set all devices as timed out
         TimeoutDevice(All=True)
+        self.Writes = WriteFilter()
+
+        # Registers to read per meter and polling tier; no tier is read less often than the update interval in the settings
+        self.Registers = dict((Register.Address, Register) for Register in _REGISTERS)
+        for Slave in self.Slaves:
+            self.Wanted[Slave] = WantedRegisters(self.Bases[Slave], bool(_HISTORY or _EXPORT))
+            LogPlan(Slave, self.Wanted[Slave])
+        self.Interval = max(_MINUTE*int(Parameters["Mode5"]), _HEARTBEAT)
+        Periods = dict((Tier, min(_TIER_PERIODS[Tier], self.Interval)) for Tier in _TIER_PERIODS)
+
+        # Ring buffers for the samples of one update interval (plus a heartbeat of slack)
+        self.Samples = SampleStore(int((self.Interval + _HEARTBEAT)/Periods[_TIER_SAMPLE]) + 1)
+        self.NextAggregate = time.time() + self.Interval
+
+        # Optional history of every value read, written in batches by its own thread
+        Sinks = [self.Samples]
+        if _HISTORY:
+            self.History = HistoryWriter(os.path.join(Parameters["HomeFolder"], _HISTORY_FOLDER))
+            self.History.start()
+            Sinks.append(self.History)
+
+        # Optional export of every poll cycle to MQTT or InfluxDB, sent in batches by its own thread
+        if _EXPORT:
+            try:
+                self.Exporter = Exporter(CreateSink(_EXPORT))
+            except ValueError as Error:
+                Domoticz.Error("Export disabled: " + str(Error) + " (use \"mqtt\", \"influx-http\" or \"influx-udp\").")
+            else:
+                self.Exporter.start()
+                Sinks.append(self.Exporter)
+
+        # Start polling in the background; the poller opens the ModBus interface and keeps it open until the plugin stops
+        self.Link = CreateLink(Parameters, self.StopBits, self.ByteSize, self.Parity)
+        if _TRACE:
+            self.Link.Trace = TraceWriter(os.path.join(Parameters["HomeFolder"], _TRACE))
+        self.Metrics = PollMetrics()
+        self.NextMetrics = time.time() + _METRICS_INTERVAL
+        self.Poller = ModbusPoller(self.Link, self.Registers, Periods, self.Wanted, self.Metrics, Sinks)
+        self.Poller.start()
 
         # Global settings
         DumpConfigToLog()
 
     def onStop(self):
         Domoticz.Debug("onStop called")
+        if self.Poller is not None:
+            self.Poller.Stop()
+        if self.Link is not None and self.Link.Trace is not None:
+            self.Link.Trace.Close()
+        if self.History is not None:
+            self.History.Stop()
+        if self.Exporter is not None:
+            self.Exporter.Stop()
 
     def onConnect(self, Connection, Status, Description):
         Domoticz.Debug("onConnect called")
@@ -194,91 +546,53 @@ class BasePlugin:
         Domoticz.Debug("onMessage called")
 
     def onCommand(self, Unit, Command, Level, Hue):
-        Domoticz.Debug("onCommand called for Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level))
+        LogDebug("onCommand called for Unit %s: Parameter '%s', Level: %s", Unit, Command, Level)
 
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
-        Domoticz.Debug("Notification: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
+        LogDebug("Notification: %s,%s,%s,%s,%s,%s,%s", Name, Subject, Text, Status, Priority, Sound, ImageFile)
 
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
 
     def onHeartbeat(self):
         Domoticz.Debug("onHeartbeat called")
-        self.runAgain -= 1
-        if self.runAgain <= 0:
 
-            # Get Offset (kWh already consumed)
-            self.Offset = float(Parameters["Mode4"])
+        # Devices set as used or unused in Setup-Devices change the registers to read
+        for Slave in self.Slaves:
+            Tiers = WantedRegisters(self.Bases[Slave], bool(_HISTORY or _EXPORT))
+            if Tiers != self.Wanted[Slave]:
+                self.Wanted[Slave] = Tiers
+                LogPlan(Slave, Tiers)
+                self.Poller.Configure(Slave, Tiers)
+
+        # Poll statistics: to the log and the statistics devices, then start a new interval
+        if time.time() >= self.NextMetrics:
+            self.NextMetrics = time.time() + _METRICS_INTERVAL
+            UpdateMetrics(self.Metrics.Collect())
+
+        # Samples of the last update interval: min, max, mean and last value to the statistic devices
+        if time.time() >= self.NextAggregate:
+            self.NextAggregate += self.Interval
+            if self.NextAggregate <= time.time():
+                self.NextAggregate = time.time() + self.Interval
+            for Slave in self.Slaves:
+                UpdateStatistics(Slave, self.Samples.Aggregate(Slave), self.Registers, self.Bases[Slave])
+
+        # Only the latest snapshot of the poller matters, the bus I/O never runs on the heartbeat
+        Snapshot = self.Poller.Latest()
+        if Snapshot is None:
+            return
 
-            # Open the ModBus interface
-            try:
-                client = ModbusSerialClient(method='rtu', port=Parameters["SerialPort"], stopbits=self.StopBits, bytesize=self.ByteSize, parity=self.Parity, baudrate=int(Parameters["Mode2"]), timeout=1, retries=2)
-                Domoticz.Debug("Serial interface RTU opened successfully!")
-            except:
-                Domoticz.Log("Error opening Serial interface on " + Parameters["SerialPort"])
-                TimeoutDevice(All=True)
-
-            # Read the Sinotimer_3F energy information from the ModBus slave
-            ReadModbus(client, "Voltage_L1",              0x0000, _UNIT_VOLTAGE_L1)                            #Volts
-            ReadModbus(client, "Voltage_L2",              0x0002, _UNIT_VOLTAGE_L2)                            #Volts
-            ReadModbus(client, "Voltage_L3",              0x0004, _UNIT_VOLTAGE_L3)                            #Volts
-            
-            ReadModbus(client, "Current_L1",              0x0006, _UNIT_CURRENT_L1)                            #Amps
-            ReadModbus(client, "Current_L2",              0x0008, _UNIT_CURRENT_L2)                            #Amps
-            ReadModbus(client, "Current_L3",              0x000A, _UNIT_CURRENT_L3)                            #Amps
-            
-            ReadModbus(client, "Total_System_Power",      0x0034, _UNIT_TOTALSYSTEMPOWER)                      #Watts
-            
-            ReadModbus(client, "Active_Power_L1",      	  0x000C, _UNIT_ACTIVEPOWER_L1)                        #Watts
-            ReadModbus(client, "Active_Power_L2",      	  0x000E, _UNIT_ACTIVEPOWER_L2)                        #Watts
-            ReadModbus(client, "Active_Power_L2",      	  0x0010, _UNIT_ACTIVEPOWER_L3)                        #Watts
-            
-            #ReadModbus(client, "Apparent_Power_L1",       0x0012, _UNIT_APPARENTPOWER_L1)                      #VA
-            #ReadModbus(client, "Apparent_Power_L2",       0x0014, _UNIT_APPARENTPOWER_L2)                      #VA
-            #ReadModbus(client, "Apparent_Power_L3",       0x0016, _UNIT_APPARENTPOWER_L3)                      #VA
-            
-            ReadModbus(client, "Total_Reactive_Power",    0x003C, _UNIT_TOTALREACTIVEPOWER)                    #KVAr
-            
-            ReadModbus(client, "Reactive_Power_L1",       0x0018, _UNIT_REACTIVEPOWER_L1)                      #VAr
-            ReadModbus(client, "Reactive_Power_L2",       0x001A, _UNIT_REACTIVEPOWER_L2)                      #VAr
-            ReadModbus(client, "Reactive_Power_L3",       0x001C, _UNIT_REACTIVEPOWER_L3)                      #VAr
-            
-            #ReadModbus(client, "Power_Factor_L1",         0x001E, _UNIT_POWERFACTOR_L1)                        #-
-            #ReadModbus(client, "Power_Factor_L2",         0x0020, _UNIT_POWERFACTOR_L2)                        #-
-            #ReadModbus(client, "Power_Factor_L3",         0x0022, _UNIT_POWERFACTOR_L3)                        #-
-
-            ReadModbus(client, "Frequency",            	  0x0046, _UNIT_FREQUENCY)                             #Hz
-
-            ReadModbus(client, "TotalActiveEnergy",    0x0156, _UNIT_TOTALACTIVEENERGY, self.Offset)     	    #kWh
-            ReadModbus(client, "TotalReactiveEnergy",  0x0158, _UNIT_TOTALREACTIVEENERGY)                	    #kvarh
-            ReadModbus(client, "TotalImportActiveEnergy",  0x0500, _UNIT_TOTALIMPORTACTIVEENERGY)               #Watts
-            ReadModbus(client, "TotalExportActiveEnergy",  0x0502, _UNIT_TOTALEXPORTACTIVEENERGY)               #Watts
-            ReadModbus(client, "NetkWh", 0x018C, _UNIT_NET_KWH)                                                 #kWh
-            ReadModbus(client, "ImportEnergy", 0x0048, _UNIT_IMPORTENERGY)                                      #kWh
-            ReadModbus(client, "ExportEnergy", 0x004A, _UNIT_EXPORTENERGY)                                      #kWh
-            
-            #ReadModbus(client, "Average line to neutral volts", 0x002A, _UNIT_AVERAGELINETONEUTRALVOLTS)        #V
-            #ReadModbus(client, "Average line current", 0x002E, _UNIT_AVERAGELINECURRENT)                        #A
-            #ReadModbus(client, "Sum of line currents", 0x0030, _UNIT_SUMOFLINECURRENTS)                         #A
-            
-            #ReadModbus(client, "Total_system_Volt_Amps", 0x0038, _UNIT_TOTALSYSTEMVOLTAMPS)                     #VA
-            #ReadModbus(client, "Total_system_Power_Factor", 0x003E, _UNIT_TOTALSYSTEMPOWERFACTOR)               #None
-            
-            #ReadModbus(client, "L1_to_L2_Voltage", 0x00C8, _UNIT_L1TOL2VOLTS)                                   #V
-            #ReadModbus(client, "L2_to_L3_Voltage", 0x00CA, _UNIT_L2TOL3VOLTS)                                   #V
-            #ReadModbus(client, "L3_to_L1_Voltage", 0x00CC, _UNIT_L3TOL1VOLTS)                                   #V
-            #ReadModbus(client, "Average_line_to_Line_Voltage", 0x00CE, _UNIT_AVERAGELINETOLINEVOLTS)            #V
-            
-            #ReadModbus(client, "Neutral_Current", 0x00E0, _UNIT_NEUTRALCURRENT)                                 #A
-            
-            #ReadModbus(client, "Ressetable_Total_Active_Energy", 0x0180, _UNIT_RESETTABLETOTALACTIVEENERGY)     #kWh
-            #ReadModbus(client, "Ressetable_Import_Active_Energy", 0x0184, _UNIT_RESETTABLEIMPORTACTIVEENERGY)   #kWh
-            #ReadModbus(client, "Ressetable_Export_Active_Energy", 0x0186, _UNIT_RESETTABLEEXPORTACTIVEENERGY)   #kWh
-            
-            # Run again following the period in the settings
-            self.runAgain = _MINUTE*int(Parameters["Mode5"])
+        # Get Offset (kWh already consumed)
+        self.Offsets = dict(zip(self.Configured, ParseOffsets(Parameters["Mode4"], len(self.Configured))))
+
+        # Update the devices with the Sinotimer_3F energy information read from the ModBus slaves
+        if Snapshot["Link"]:
+            for Slave in self.Slaves:
+                UpdateDevices(Snapshot["Meters"][Slave], self.Registers, self.Writes, self.Bases[Slave], {_UNIT_TOTALACTIVEENERGY: self.Offsets[Slave]})
         else:
-            Domoticz.Debug("onHeartbeat called, run again in "+str(self.runAgain)+" heartbeats.")
+            TimeoutDevice(All=True)
+            self.Writes.Clear()
 
 global _plugin
 _plugin = BasePlugin()
@@ -321,6 +635,8 @@ def onHeartbeat():
 
 #DUMP THE PARAMETER
 def DumpConfigToLog():
+    if not DebugOn():
+        return
     for x in Parameters:
         if Parameters[x] != "":
             Domoticz.Debug("'" + x + "':'" + str(Parameters[x]) + "'")
@@ -333,6 +649,14 @@ def DumpConfigToLog():
         Domoticz.Debug("Device sValue:   '" + Devices[x].sValue + "'")
         Domoticz.Debug("Device LastLevel: " + str(Devices[x].LastLevel))
 
+#DEBUG MESSAGE, ONLY FORMATTED WHEN DEBUGGING IS ON
+def LogDebug(Format, *Args):
+    if _plugin.debug == _DEBUG_ON:
+        Domoticz.Debug(Format % Args)
+
+def DebugOn():
+    return _plugin.debug == _DEBUG_ON
+
 #UPDATE THE DEVICE
 def UpdateDevice(Unit, nValue, sValue, Image=_NO_IMAGE_UPDATE, TimedOut=0, AlwaysUpdate=False):
     if Unit in Devices:
@@ -341,7 +665,7 @@ def UpdateDevice(Unit, nValue, sValue, Image=_NO_IMAGE_UPDATE, TimedOut=0, Alway
                 Devices[Unit].Update(nValue=int(nValue), sValue=str(sValue), Image=Image, TimedOut=TimedOut)
             else:
                 Devices[Unit].Update(nValue=int(nValue), sValue=str(sValue), TimedOut=TimedOut)
-            Domoticz.Debug("Update " + Devices[Unit].Name + ": " + str(nValue) + " - '" + str(sValue) + "'")
+            LogDebug("Update %s: %s - '%s'", Devices[Unit].Name, nValue, sValue)
 
 #SET DEVICE ON TIMED-OUT (OR ALL DEVICES)
 def TimeoutDevice(All, Unit=0):
@@ -351,123 +675,1740 @@ def TimeoutDevice(All, Unit=0):
     else:
         UpdateDevice(Unit, Devices[Unit].nValue, Devices[Unit].sValue, TimedOut=_TIMEDOUT)
 
-#CREATE ALL THE DEVICES (USED)
-def CreateDevicesUsed():
-    if (_UNIT_VOLTAGE_L1 not in Devices):
-        Domoticz.Device(Name="Voltage L1", Unit=_UNIT_VOLTAGE_L1, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=1).Create()
-    if (_UNIT_VOLTAGE_L2 not in Devices):
-        Domoticz.Device(Name="Voltage L2", Unit=_UNIT_VOLTAGE_L2, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=1).Create()
-    if (_UNIT_VOLTAGE_L3 not in Devices):
-        Domoticz.Device(Name="Voltage L3", Unit=_UNIT_VOLTAGE_L3, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=1).Create()
-
-    if (_UNIT_CURRENT_L1 not in Devices):
-        Domoticz.Device(Name="Current L1", Unit=_UNIT_CURRENT_L1, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_CURRENT_L2 not in Devices):
-        Domoticz.Device(Name="Current L2", Unit=_UNIT_CURRENT_L2, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_CURRENT_L3 not in Devices):
-        Domoticz.Device(Name="Current L3", Unit=_UNIT_CURRENT_L3, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-    if (_UNIT_TOTALSYSTEMPOWER not in Devices):
-        Domoticz.Device(Name="Total System Power", Unit=_UNIT_TOTALSYSTEMPOWER, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_ACTIVEPOWER_L1 not in Devices):
-        Domoticz.Device(Name="Active Power L1", Unit=_UNIT_ACTIVEPOWER_L1, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_ACTIVEPOWER_L2 not in Devices):
-        Domoticz.Device(Name="Active Power L2", Unit=_UNIT_ACTIVEPOWER_L2, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_ACTIVEPOWER_L3 not in Devices):
-        Domoticz.Device(Name="Active Power L3", Unit=_UNIT_ACTIVEPOWER_L3, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-    if (_UNIT_FREQUENCY not in Devices):
-        Domoticz.Device(Name="Frequency", Unit=_UNIT_FREQUENCY, TypeName="Custom", Options={"Custom": "0;Hz"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-    if (_UNIT_TOTALACTIVEENERGY not in Devices):
-        Domoticz.Device(Name="Total Active Energy", Unit=_UNIT_TOTALACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=1).Create()
-        
-    if (_UNIT_TOTALIMPORTACTIVEENERGY not in Devices):
-        Domoticz.Device(Name="Total Import Active Energy", Unit=_UNIT_TOTALIMPORTACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-    if (_UNIT_TOTALEXPORTACTIVEENERGY not in Devices):
-        Domoticz.Device(Name="Total Export Active Energy", Unit=_UNIT_TOTALEXPORTACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;W"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    
-    if (_UNIT_NET_KWH not in Devices):
-        Domoticz.Device(Name="Net Kwh Import-Export", Unit=_UNIT_NET_KWH, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-    if (_UNIT_IMPORTENERGY not in Devices):
-        Domoticz.Device(Name="Import Energy", Unit=_UNIT_IMPORTENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=1).Create()
-    if (_UNIT_EXPORTENERGY not in Devices):
-        Domoticz.Device(Name="Export Energy", Unit=_UNIT_EXPORTENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-#CREATE ALL THE DEVICES (NOT USED)
-def CreateDevicesNotUsed():
-    #if (_UNIT_APPARENTPOWER_L1 not in Devices):
-    #    Domoticz.Device(Name="Apparent Power L1", Unit=_UNIT_APPARENTPOWER_L1, TypeName="Custom", Options={"Custom": "0;VA"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_APPARENTPOWER_L2 not in Devices):
-    #    Domoticz.Device(Name="Apparent Power L2", Unit=_UNIT_APPARENTPOWER_L2, TypeName="Custom", Options={"Custom": "0;VA"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_APPARENTPOWER_L3 not in Devices):
-    #    Domoticz.Device(Name="Apparent Power L3", Unit=_UNIT_APPARENTPOWER_L3, TypeName="Custom", Options={"Custom": "0;VA"}, Image=Images[_IMAGE].ID, Used=0).Create()
-
-    if (_UNIT_TOTALREACTIVEPOWER not in Devices):
-        Domoticz.Device(Name="Total Reactive Power", Unit=_UNIT_TOTALREACTIVEPOWER, TypeName="Custom", Options={"Custom": "0;KVar"}, Image=Images[_IMAGE].ID, Used=1).Create()
-
-    if (_UNIT_REACTIVEPOWER_L1 not in Devices):
-        Domoticz.Device(Name="Reactive Power L1", Unit=_UNIT_REACTIVEPOWER_L1, TypeName="Custom", Options={"Custom": "0;Var"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    if (_UNIT_REACTIVEPOWER_L2 not in Devices):
-        Domoticz.Device(Name="Reactive Power L2", Unit=_UNIT_REACTIVEPOWER_L2, TypeName="Custom", Options={"Custom": "0;Var"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    if (_UNIT_REACTIVEPOWER_L3 not in Devices):
-        Domoticz.Device(Name="Reactive Power L3", Unit=_UNIT_REACTIVEPOWER_L3, TypeName="Custom", Options={"Custom": "0;Var"}, Image=Images[_IMAGE].ID, Used=0).Create()
-
-    if (_UNIT_TOTALREACTIVEENERGY not in Devices):
-        Domoticz.Device(Name="Total Reactive Energy", Unit=_UNIT_TOTALREACTIVEENERGY, TypeName="Custom", Options={"Custom": "0; kVArh"}, Image=Images[_IMAGE].ID, Used=0).Create()
-
-    #if (_UNIT_POWERFACTOR_L1 not in Devices):
-    #    Domoticz.Device(Name="Power factor L1", Unit=_UNIT_POWERFACTOR_L1, TypeName="Custom", Options={"Custom": "0;"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_POWERFACTOR_L2 not in Devices):
-    #    Domoticz.Device(Name="Power factor L2", Unit=_UNIT_POWERFACTOR_L2, TypeName="Custom", Options={"Custom": "0;"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_POWERFACTOR_L3 not in Devices):
-    #    Domoticz.Device(Name="Power factor L3", Unit=_UNIT_POWERFACTOR_L3, TypeName="Custom", Options={"Custom": "0;"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-    #if (_UNIT_AVERAGELINETONEUTRALVOLTS not in Devices):
-    #    Domoticz.Device(Name="Average Line to neutral Volts", Unit=_UNIT_AVERAGELINETONEUTRALVOLTS, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=0).Create()
-    #if (_UNIT_AVERAGELINECURRENT not in Devices):
-    #    Domoticz.Device(Name="Average Line Current", Unit=_UNIT_AVERAGELINECURRENT, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_SUMOFLINECURRENTS not in Devices):
-    #    Domoticz.Device(Name="Sum of line currents", Unit=_UNIT_SUMOFLINECURRENTS, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-    #if (_UNIT_TOTALSYSTEMVOLTAMPS not in Devices):
-    #    Domoticz.Device(Name="Total system Volt Amps", Unit=_UNIT_TOTALSYSTEMVOLTAMPS, TypeName="Custom", Options={"Custom": "0;VA"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_TOTALSYSTEMPOWERFACTOR not in Devices):
-    #    Domoticz.Device(Name="Total system Power Factor", Unit=_UNIT_TOTALSYSTEMPOWERFACTOR, TypeName="Custom", Options={"Custom": "0;"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-    #if (_UNIT_L1TOL2VOLTS not in Devices):
-    #    Domoticz.Device(Name="L1 to L2 Voltage", Unit=_UNIT_L1TOL2VOLTS, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=0).Create()
-    #if (_UNIT_L2TOL3VOLTS not in Devices):
-    #    Domoticz.Device(Name="L2 to L3 Voltage", Unit=_UNIT_L2TOL3VOLTS, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=0).Create()
-    #if (_UNIT_L3TOL1VOLTS not in Devices):
-    #    Domoticz.Device(Name="L3 to L1 Voltage", Unit=_UNIT_L3TOL1VOLTS, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=0).Create()
-    #if (_UNIT_AVERAGELINETOLINEVOLTS not in Devices):
-    #    Domoticz.Device(Name="Average line to Line Voltage", Unit=_UNIT_AVERAGELINETOLINEVOLTS, Type=0xF3,Subtype=0x8,Options={"Custom": "0;V"},Used=0).Create()
-        
-    #if (_UNIT_NEUTRALCURRENT not in Devices):
-    #    Domoticz.Device(Name="Neutral Current", Unit=_UNIT_NEUTRALCURRENT, TypeName="Custom", Options={"Custom": "0;A"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-    #if (_UNIT_RESETTABLETOTALACTIVEENERGY not in Devices):
-    #    Domoticz.Device(Name="Ressetable Total Active Energy", Unit=_UNIT_RESETTABLETOTALACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_RESETTABLEIMPORTACTIVEENERGY not in Devices):
-    #    Domoticz.Device(Name="Ressetable Import Active Energy", Unit=_UNIT_RESETTABLEIMPORTACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=0).Create()
-    #if (_UNIT_RESETTABLEEXPORTACTIVEENERGY not in Devices):
-    #    Domoticz.Device(Name="Ressetable Export Active Energy", Unit=_UNIT_RESETTABLEEXPORTACTIVEENERGY, TypeName="Custom", Options={"Custom": "0;kWh"}, Image=Images[_IMAGE].ID, Used=0).Create()
-        
-        
-#READ THE MODBUS INFORMATION
-def ReadModbus(client, StrData, Address, Unit, Offset=0): 
+#SLAVE IDS OF THE METERS ON THE BUS, FROM A COMMA SEPARATED LIST ("1" OR "1,2,3")
+def ParseSlaves(Text):
+    Slaves = []
+    for Item in Text.replace(";", ",").split(","):
+        if Item.strip() == "":
+            continue
+        Slave = int(Item)
+        if Slave < 1 or Slave > 247:
+            Domoticz.Error("Invalid slave unit ID " + str(Slave) + " ignored.")
+        elif Slave not in Slaves:
+            Slaves.append(Slave)
+    if len(Slaves) > _MAX_METERS:
+        Domoticz.Error("Only " + str(_MAX_METERS) + " meters per hardware entry, ignoring slave unit IDs " + str(Slaves[_MAX_METERS:]) + ".")
+        Slaves = Slaves[:_MAX_METERS]
+    if not Slaves:
+        Domoticz.Error("No valid slave unit ID in '" + Text + "', using 1.")
+        Slaves = [1]
+    return Slaves
+
+#OFFSET (KWH ALREADY CONSUMED) PER METER, FROM A COMMA SEPARATED LIST; MISSING OFFSETS ARE 0
+def ParseOffsets(Text, Count):
+    Offsets = [float(Item) for Item in Text.replace(";", ",").split(",") if Item.strip() != ""]
+    return (Offsets + [0.0]*Count)[:Count]
+
+#FIRST UNIT (MINUS ONE) OF THE DEVICES OF A METER BLOCK
+def MeterBase(Block):
+    return Block*_METER_UNITS
+
+#THE METER IN THE FIRST BLOCK KEEPS THE PLAIN DEVICE NAMES, THE OTHERS ARE PREFIXED WITH THEIR SLAVE ID
+def MeterPrefix(Base, Slave):
+    if Base == 0:
+        return ""
+    return "Meter " + str(Slave) + " "
+
+#BLOCK OF DEVICE UNITS OF EVERY SLAVE ID: {SLAVE ID: BLOCK}, KEPT IN _METER_BLOCKS PER HARDWARE ENTRY
+#A slave ID keeps its block, so its devices (and their history) never get the values of another meter when the
+#slave IDs are reordered or one is removed. The block of a removed meter stays reserved until its devices are
+#deleted; a new slave ID gets the first free block. Without a saved assignment (before this file existed) the
+#blocks are in the order of the slave IDs, as they always were. A slave ID that finds no free block is not polled.
+#A hardware entry with one meter that gets another slave ID (the meter was readdressed or replaced) keeps its devices.
+def MeterBlocks(Slaves):
+    Path = os.path.join(Parameters["HomeFolder"], _METER_BLOCKS)
+    Hardware = str(Parameters["HardwareID"])
+    try:
+        with open(Path) as File:
+            Saved = json.load(File)
+    except (IOError, ValueError):
+        Saved = {}
+    Known = dict((int(Slave), Block) for Slave, Block in Saved.get(Hardware, {}).items())
+    Blocks = dict((Slave, Block) for Slave, Block in Known.items() if Block < _MAX_METERS and MeterDevices(Block))
+    if Hardware not in Saved:
+        Blocks.update((Slave, Block) for Block, Slave in enumerate(Slaves))
+    Removed = sorted(Other for Other in Blocks if Other not in Slaves)
+    if len(Slaves) == 1 and len(Blocks) == 1 and Removed:
+        Domoticz.Log("Slave unit ID changed from " + str(Removed[0]) + " to " + str(Slaves[0]) + ", the devices of units " + str(MeterBase(Blocks[Removed[0]])+1) + "-" + str(MeterBase(Blocks[Removed[0]])+_METER_UNITS) + " are kept.")
+        Blocks = {Slaves[0]: Blocks[Removed[0]]}
+        Removed = []
+    for Slave in Slaves:
+        if Slave in Blocks:
+            continue
+        Free = [Block for Block in range(_MAX_METERS) if Block not in Blocks.values()]
+        if not Free:
+            Domoticz.Error("No free devices for slave unit ID " + str(Slave) + ", not polled: delete the devices of the removed meter(s) " + str(Removed) + " first.")
+            continue
+        Blocks[Slave] = Free[0]
+        if MeterDevices(Free[0]):
+            Domoticz.Log("Slave unit ID " + str(Slave) + " takes over the existing devices of units " + str(MeterBase(Free[0])+1) + "-" + str(MeterBase(Free[0])+_METER_UNITS) + ".")
+        elif Removed:
+            Domoticz.Log("Slave unit ID " + str(Slave) + " gets new devices (units " + str(MeterBase(Free[0])+1) + "-" + str(MeterBase(Free[0])+_METER_UNITS) + "); the devices of the removed meter(s) " + str(Removed) + " are kept until they are deleted.")
+    if Blocks != Known:
+        Saved[Hardware] = dict((str(Slave), Block) for Slave, Block in Blocks.items())
+        try:
+            with open(Path, "w") as File:
+                json.dump(Saved, File, indent=1, sort_keys=True)
+        except IOError as Error:
+            Domoticz.Error("Cannot save the device units of the meters to " + Path + ": " + str(Error))
+    for Slave, Block in sorted(Blocks.items()):
+        if Slave in Slaves:
+            LogDebug("Slave unit ID %d: devices of units %d-%d", Slave, MeterBase(Block)+1, MeterBase(Block)+_METER_UNITS)
+    return dict((Slave, Block) for Slave, Block in Blocks.items() if Slave in Slaves)
+
+#TRUE WHEN A METER BLOCK STILL HAS DEVICES
+def MeterDevices(Block):
+    return any(MeterBase(Block)+Unit in Devices for Unit in range(1, _METER_UNITS+1))
+
+#APPLY THE SETTINGS OF _SETTINGS (IN THE PLUGIN FOLDER) TO THE CONSTANTS THEY OVERRIDE (SEE _SETTING_NAMES)
+#The file stays untouched by an update of the plugin (git pull). Without it the constants keep their defaults;
+#an unknown key or a value of the wrong type is logged and ignored.
+def LoadSettings():
+    if not _SETTINGS:
+        return
+    Path = os.path.join(Parameters["HomeFolder"], _SETTINGS)
     try:
-        data = client.read_input_registers(address=Address, count=2, unit=int(Parameters["Mode1"]))
-        if data.isError():
-            data = client.read_input_registers(address=Address, count=2, unit=int(Parameters["Mode1"]))
-        decoder = BinaryPayloadDecoder.fromRegisters(data.registers, byteorder=Endian.Big, wordorder=Endian.Big)
-        value = round(decoder.decode_32bit_float(), 4) 
-        Domoticz.Debug('%s: %.4f' % (StrData, value))
-        UpdateDevice(Unit, nValue=value+Offset, sValue='%.4f'%(value+Offset), AlwaysUpdate=False)
-    except:
-        Domoticz.Error("Error reading data (%s)." % (StrData))
-        TimeoutDevice(All=False, Unit=Unit)
+        with open(Path) as File:
+            Settings = json.load(File)
+    except IOError:
+        return
+    except ValueError as Error:
+        Domoticz.Error("Settings in " + Path + " ignored: " + str(Error))
+        return
+    if not isinstance(Settings, dict):
+        Domoticz.Error("Settings in " + Path + " ignored: not a JSON object.")
+        return
+    for Key, value in sorted(Settings.items()):
+        Name = _SETTING_NAMES.get(Key)
+        if Name is None:
+            Domoticz.Error("Unknown setting '" + Key + "' in " + Path + " ignored.")
+        elif type(value) is not type(globals()[Name]):
+            Domoticz.Error("Setting '" + Key + "' in " + Path + " ignored: " + type(globals()[Name]).__name__ + " expected.")
+        else:
+            globals()[Name] = value
+            Domoticz.Log("Setting " + Key + ": " + json.dumps(value))
+
+#CREATE THE DEVICES OF ONE METER (UNITS FROM BASE ON) FROM THE REGISTER MAP
+def CreateDevices(Base=0, Prefix=""):
+    for Register in _REGISTERS:
+        if (Base+Register.Unit in Devices):
+            continue
+        if Register.Kind == _DEVICE_VOLTAGE:
+            Domoticz.Device(Name=Prefix+Register.Name, Unit=Base+Register.Unit, Type=0xF3,Subtype=0x8,Options={"Custom": "0;"+Register.Measure},Used=Register.Used).Create()
+        else:
+            Domoticz.Device(Name=Prefix+Register.Name, Unit=Base+Register.Unit, TypeName="Custom", Options={"Custom": "0;"+Register.Measure}, Image=Images[_IMAGE].ID, Used=Register.Used).Create()
+    Registers = dict((Register.Address, Register) for Register in _REGISTERS)
+    for Item in _STATISTICS:
+        if (Base+Item.Unit in Devices):
+            continue
+        Register = Registers[Item.Address]
+        if Register.Kind == _DEVICE_VOLTAGE:
+            Domoticz.Device(Name=Prefix+Item.Name, Unit=Base+Item.Unit, Type=0xF3,Subtype=0x8,Options={"Custom": "0;"+Register.Measure},Used=0).Create()
+        else:
+            Domoticz.Device(Name=Prefix+Item.Name, Unit=Base+Item.Unit, TypeName="Custom", Options={"Custom": "0;"+Register.Measure}, Image=Images[_IMAGE].ID, Used=0).Create()
+
+#REGISTERS TO READ FOR ONE METER, PER POLLING TIER: ONLY THOSE WITH A DEVICE SET AS USED
+#A derived register is replaced by its sources (see _DERIVED).
+#A sampled register is also in the sample tier when one of its statistic devices is used, or when its device is
+#used and every value read is kept (Sampled: the history store or the export is on).
+def WantedRegisters(Base=0, Sampled=False):
+    Tiers = {}
+    for Register in _REGISTERS:
+        if (Base+Register.Unit in Devices) and Devices[Base+Register.Unit].Used:
+            for Address in (DerivedSources(Register.Address) if _DERIVE else [Register.Address]):
+                if Address not in Tiers.get(Register.Tier, []):
+                    Tiers.setdefault(Register.Tier, []).append(Address)
+            if Sampled and Register.Unit in _SAMPLED_UNITS:
+                Tiers.setdefault(_TIER_SAMPLE, []).append(Register.Address)
+    for Item in _STATISTICS:
+        if (Base+Item.Unit in Devices) and Devices[Base+Item.Unit].Used and Item.Address not in Tiers.get(_TIER_SAMPLE, []):
+            Tiers.setdefault(_TIER_SAMPLE, []).append(Item.Address)
+    return Tiers
+
+#REGISTERS TO READ FOR ONE REGISTER: ITSELF, OR THE SOURCES OF A DERIVED ONE (RECURSIVELY)
+def DerivedSources(Address):
+    for Item in _DERIVED:
+        if Item.Address == Address:
+            return [Register for Source in Item.Sources for Register in DerivedSources(Source)]
+    return [Address]
+
+#ADD THE DERIVED VALUES TO THE SNAPSHOT OF ONE METER
+#Known keeps the latest value of every register of the meter, as the sources may be read in different tiers.
+#A derived value is computed when one of its sources is new; it is in error when one of its sources is.
+def DeriveValues(Meter, Known):
+    for Address in Meter["Errors"]:
+        Known.pop(Address, None)
+    Known.update(Meter["Values"])
+    for Item in _DERIVED:
+        if Item.Address in Meter["Values"]:
+            continue
+        if any(Source in Meter["Errors"] for Source in Item.Sources):
+            Meter["Errors"].append(Item.Address)
+            Known.pop(Item.Address, None)
+        elif any(Source in Meter["Values"] for Source in Item.Sources) and all(Source in Known for Source in Item.Sources):
+            Meter["Values"][Item.Address] = Known[Item.Address] = round(Item.Function([Known[Source] for Source in Item.Sources]), 4)
+
+#LOG THE BLOCK READS OF A METER PER POLLING TIER
+def LogPlan(Slave, Tiers):
+    for Tier in sorted(Tiers):
+        Plan = PlanBlocks(Tiers[Tier])
+        Frames, Bytes = PlanCost(Plan)
+        LogDebug("Read plan meter %s tier %s: %s requests, %s bytes (%s)", Slave, Tier, Frames, Bytes, ", ".join("0x%04X+%d" % (Start, Count) for Start, Count, Addresses in Plan))
+
+################################################################################
+# Modbus interface
+################################################################################
+
+#MODBUS CONNECTION (SERIAL PORT OR TCP GATEWAY), OPENED ONCE AND REOPENED WITH BACKOFF AFTER ERRORS
+#The transports below only implement Open, Close and the request itself; a request goes through Send and Receive,
+#so a transport that can pipeline (Modbus TCP) sends the requests of all meters before reading the responses.
+class ModbusLink:
+
+    Pipelining = False
+
+    def __init__(self, Name, BaudRate, StopBits, ByteSize, Parity):
+        self.Port = Name
+        self.BaudRate = BaudRate
+        self.StopBits = StopBits
+        self.ByteSize = ByteSize
+        self.Parity = Parity
+        self.CharTime = (1 + ByteSize + (0 if Parity == "N" else 1) + StopBits) / float(BaudRate)
+        self.State = _LINK_CLOSED
+        self.Backoff = _RECONNECT_MIN
+        self.NextAttempt = 0
+        self.Errors = 0
+        self.Trace = None
+
+    def Open(self):
+        try:
+            self.Connect()
+        except Exception as Error:
+            self.Failed("Error opening " + self.Kind + " on " + self.Port + ": " + str(Error))
+            return False
+        if self.State == _LINK_FAILED:
+            Domoticz.Log(self.Kind + " on " + self.Port + " reconnected.")
+        Domoticz.Debug(self.Kind + " on " + self.Port + " opened successfully!")
+        self.State = _LINK_OK
+        self.Backoff = _RECONNECT_MIN
+        self.Errors = 0
+        return True
+
+    def Close(self):
+        try:
+            self.Disconnect()
+        except:
+            pass
+        self.State = _LINK_CLOSED
+
+    #CLOSE THE PORT AND SCHEDULE THE NEXT RECONNECT, DOUBLING THE WAIT AFTER EACH FAILURE
+    def Failed(self, Message):
+        self.Close()
+        self.State = _LINK_FAILED
+        self.Errors += 1
+        self.NextAttempt = time.time() + self.Backoff
+        Domoticz.Error(Message + " (retry in " + str(self.Backoff) + "s)")
+        self.Backoff = min(self.Backoff*2, _RECONNECT_MAX)
+
+    #TRUE WHEN THE PORT IS OPEN, RECONNECTING FIRST IF THE BACKOFF HAS EXPIRED
+    def Ready(self):
+        if self.State == _LINK_OK:
+            return True
+        if time.time() < self.NextAttempt:
+            return False
+        return self.Open()
+
+    #START A REQUEST; WITHOUT PIPELINING IT IS ONLY SENT BY RECEIVE
+    def Send(self, Request):
+        return Request
+
+    #THE RESPONSE OF A REQUEST (AN ERROR RESPONSE ON TIMEOUTS AND BAD FRAMES), RAISES WHEN THE CONNECTION FAILS
+    #Request.Elapsed is set to the time the meter (or the gateway) took to answer.
+    def Receive(self, Request):
+        Started = time.time()
+        Response = self.ReadInputRegisters(Request.Address, Request.Count, Request.Slave, Request.Timeout)
+        Request.Elapsed = time.time() - Started
+        return Response
+
+    #ONE REQUEST, WITHOUT RETRIES: THE CALLER DECIDES WHETHER TO RETRY
+    def ReadInputRegisters(self, Address, Count, Slave, Timeout=_TIMEOUT_MAX):
+        if self.State != _LINK_OK:
+            raise IOError(self.Kind + " on " + self.Port + " is not open")
+        try:
+            return self.Transfer(Address, Count, Slave, Timeout)
+        except Exception as Error:
+            self.Failed(self.Kind + " error on " + self.Port + ": " + str(Error))
+            raise
+
+#SERIAL MODBUS RTU, BUILT IN: FUNCTION 04 FRAMES STRAIGHT TO AND FROM PYSERIAL
+#The request frame of each block is built once and kept; the response is read in two parts sized to what the
+#meter sends (header, then the rest), so no time is spent waiting for bytes that cannot come.
+#The port keeps one short timeout (_SERIAL_TIMEOUT), as changing it reconfigures the port; the reads are repeated
+#until the bytes are in or the timeout of the request passed.
+class RtuLink(ModbusLink):
+
+    Kind = "Serial interface"
+
+    def __init__(self, Port, BaudRate, StopBits, ByteSize, Parity):
+        ModbusLink.__init__(self, Port, BaudRate, StopBits, ByteSize, Parity)
+        self.Serial = None
+        self.Frames = {}
+        self.Silence = 3.5*self.CharTime
+        self.LastFrame = 0
+
+    def Connect(self):
+        self.Serial = serial.Serial(port=self.Port, baudrate=self.BaudRate, bytesize=self.ByteSize, parity=self.Parity, stopbits=self.StopBits, timeout=_SERIAL_TIMEOUT)
+
+    def Disconnect(self):
+        if self.Serial is not None:
+            self.Serial.close()
+        self.Serial = None
+
+    def Transfer(self, Address, Count, Slave, Timeout):
+        Key = (Slave, Address, Count)
+        if Key not in self.Frames:
+            self.Frames[Key] = RtuRequest(Slave, Address, Count)
+        # RTU frames are separated by 3.5 characters of silence
+        Wait = self.LastFrame + self.Silence - time.time()
+        if Wait > 0:
+            time.sleep(Wait)
+        self.Serial.reset_input_buffer()
+        self.Serial.write(self.Frames[Key])
+        Deadline = time.time() + Timeout
+        try:
+            Header = self.Read(3, Deadline)
+            if len(Header) < 3:
+                return ErrorResponse("no response from slave %d (timeout)" % Slave, "Timeouts")
+            Length = 5 if bytearray(Header)[1] & 0x80 else 5 + bytearray(Header)[2]
+            Frame = Header + self.Read(Length - 3, Deadline)
+        finally:
+            self.LastFrame = time.time()
+        if len(Frame) < Length:
+            return ErrorResponse("incomplete response from slave %d (timeout)" % Slave, "Timeouts", Frame)
+        if Crc16(Frame[:-2]) != Frame[-2:]:
+            return ErrorResponse("invalid response from slave %d: CRC error" % Slave, "CrcErrors", Frame)
+        if bytearray(Frame)[0] != Slave:
+            return ErrorResponse("invalid response: slave %d answered for slave %d" % (bytearray(Frame)[0], Slave), "CrcErrors", Frame)
+        return DecodeResponse(Frame[1:-2], Count)
+
+    #READ COUNT BYTES, OR LESS WHEN THE DEADLINE PASSES
+    def Read(self, Count, Deadline):
+        Data = b""
+        while len(Data) < Count and time.time() < Deadline:
+            Data += self.Serial.read(Count - len(Data))
+        return Data
+
+#SERIAL MODBUS RTU THROUGH PYMODBUS (_NATIVE_RTU = False)
+class SerialLink(ModbusLink):
+
+    Kind = "Serial interface"
+
+    def __init__(self, Port, BaudRate, StopBits, ByteSize, Parity):
+        ModbusLink.__init__(self, Port, BaudRate, StopBits, ByteSize, Parity)
+        self.client = None
+
+    def Connect(self):
+        from pymodbus.client.sync import ModbusSerialClient
+        self.client = ModbusSerialClient(method='rtu', port=self.Port, stopbits=self.StopBits, bytesize=self.ByteSize, parity=self.Parity, baudrate=self.BaudRate, timeout=_TIMEOUT_MAX, retries=1)
+        if not self.client.connect():
+            raise IOError("port not available")
+
+    def Disconnect(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+
+    def Transfer(self, Address, Count, Slave, Timeout):
+        self.client.timeout = Timeout
+        if getattr(self.client, "socket", None) is not None:
+            self.client.socket.timeout = Timeout
+        return self.client.read_input_registers(address=Address, count=Count, unit=Slave)
+
+#RS485 GATEWAY ON TCP: MODBUS TCP (MBAP HEADER, PIPELINED) OR PLAIN RTU FRAMES OVER TCP (ONE REQUEST AT A TIME)
+#One persistent connection carries the requests of all meters behind the gateway. TCP keepalive detects a dead
+#gateway, and a connection the gateway closed while idle is reopened at once before the backoff kicks in.
+#The baudrate and port settings are those of the RS485 bus behind the gateway (for the timeouts).
+class TcpLink(ModbusLink):
+
+    Kind = "Gateway connection"
+
+    def __init__(self, Host, Port, BaudRate, StopBits, ByteSize, Parity, Framing=_FRAMING_TCP):
+        ModbusLink.__init__(self, Host + ":" + str(Port), BaudRate, StopBits, ByteSize, Parity)
+        self.Host = Host
+        self.TcpPort = Port
+        self.Framing = Framing
+        self.Pipelining = (Framing == _FRAMING_TCP)
+        self.Socket = None
+        self.Buffer = b""
+        self.Transaction = 0
+        self.Pending = {}
+        self.Arrived = {}
+        self.LastArrival = 0
+
+    def Connect(self):
+        self.Socket = socket.create_connection((self.Host, self.TcpPort), _TIMEOUT_MAX)
+        self.Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for Option, value in (("TCP_KEEPIDLE", _KEEPALIVE_IDLE), ("TCP_KEEPINTVL", _KEEPALIVE_INTERVAL), ("TCP_KEEPCNT", _KEEPALIVE_COUNT)):
+            if hasattr(socket, Option):
+                self.Socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, Option), value)
+        self.Buffer = b""
+        self.Pending.clear()
+        self.Arrived.clear()
+
+    def Disconnect(self):
+        if self.Socket is not None:
+            self.Socket.close()
+        self.Socket = None
+
+    #SEND THE FRAME, REOPENING FIRST A CONNECTION THE GATEWAY CLOSED WHILE IDLE (OR ONCE WHEN SENDING FAILS)
+    def Write(self, Frame):
+        if self.Socket is None or self.Closed():
+            self.Reconnect()
+        try:
+            self.Socket.sendall(Frame)
+        except OSError:
+            self.Reconnect()
+            self.Socket.sendall(Frame)
+
+    def Reconnect(self):
+        Domoticz.Debug(self.Kind + " on " + self.Port + " was closed by the gateway, reconnecting.")
+        self.Close()
+        self.Connect()
+        self.State = _LINK_OK
+
+    #TRUE WHEN THE GATEWAY HAS CLOSED OR RESET THE CONNECTION (A SEND WOULD STILL SUCCEED)
+    def Closed(self):
+        try:
+            if not select.select([self.Socket], [], [], 0)[0]:
+                return False
+            return self.Socket.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+    def Send(self, Request):
+        if not self.Pipelining:
+            return Request
+        if self.State != _LINK_OK:
+            raise IOError(self.Kind + " on " + self.Port + " is not open")
+        self.Transaction = (self.Transaction + 1) & 0xFFFF
+        Request.Transaction = self.Transaction
+        try:
+            self.Write(struct.pack(">HHHBBHH", Request.Transaction, 0, 6, Request.Slave, 0x04, Request.Address, Request.Count))
+        except Exception as Error:
+            self.Failed(self.Kind + " error on " + self.Port + ": " + str(Error))
+            raise
+        Request.Sent = time.time()
+        self.Pending[Request.Transaction] = Request
+        return Request
+
+    def Receive(self, Request):
+        if not self.Pipelining:
+            return ModbusLink.Receive(self, Request)
+        if self.State != _LINK_OK:
+            raise IOError(self.Kind + " on " + self.Port + " is not open")
+        Deadline = max(time.time(), self.LastArrival) + Request.Timeout
+        try:
+            while Request.Transaction not in self.Arrived:
+                Frame = self.ReadFrame(Deadline)
+                if Frame is None:
+                    self.Pending.pop(Request.Transaction, None)
+                    Request.Elapsed = Request.Timeout
+                    return ErrorResponse("no response from the gateway (timeout)", "Timeouts")
+                self.Accept(Frame)
+        except Exception as Error:
+            self.Failed(self.Kind + " error on " + self.Port + ": " + str(Error))
+            raise
+        return self.Arrived.pop(Request.Transaction)
+
+    #A RESPONSE CAME IN: KEEP IT FOR ITS REQUEST, THE SERVICE TIME IS COUNTED FROM THE PREVIOUS RESPONSE ON
+    def Accept(self, Frame):
+        Transaction, Protocol, Length, Slave = struct.unpack(">HHHB", Frame[:7])
+        Request = self.Pending.pop(Transaction, None)
+        Now = time.time()
+        if Request is None:
+            return
+        Request.Elapsed = Now - max(Request.Sent, self.LastArrival)
+        self.LastArrival = Now
+        self.Arrived[Transaction] = DecodeResponse(Frame[7:], Request.Count)
+
+    #ONE MBAP FRAME FROM THE CONNECTION, OR NONE WHEN THE DEADLINE PASSED
+    def ReadFrame(self, Deadline):
+        if not self.Fill(7, Deadline):
+            return None
+        Length = 6 + struct.unpack(">H", self.Buffer[4:6])[0]
+        if not self.Fill(Length, Deadline):
+            return None
+        Frame, self.Buffer = self.Buffer[:Length], self.Buffer[Length:]
+        return Frame
+
+    #RTU FRAMES OVER TCP: THE LENGTH OF THE RESPONSE IS KNOWN FROM ITS FIRST 3 BYTES
+    def Transfer(self, Address, Count, Slave, Timeout):
+        self.Drain()
+        self.Write(RtuRequest(Slave, Address, Count))
+        Deadline = time.time() + Timeout
+        if not self.Fill(3, Deadline):
+            return ErrorResponse("no response from slave %d (timeout)" % Slave, "Timeouts")
+        Length = 5 if bytearray(self.Buffer)[1] & 0x80 else 5 + bytearray(self.Buffer)[2]
+        if not self.Fill(Length, Deadline):
+            return ErrorResponse("incomplete response from slave %d (timeout)" % Slave, "Timeouts")
+        Frame, self.Buffer = self.Buffer[:Length], self.Buffer[Length:]
+        if Crc16(Frame[:-2]) != Frame[-2:]:
+            return ErrorResponse("invalid response from slave %d: CRC error" % Slave, "CrcErrors")
+        if bytearray(Frame)[0] != Slave:
+            return ErrorResponse("invalid response: slave %d answered for slave %d" % (bytearray(Frame)[0], Slave), "CrcErrors")
+        return DecodeResponse(Frame[1:-2], Count)
+
+    #READ UNTIL THE BUFFER HOLDS COUNT BYTES; FALSE WHEN THE DEADLINE PASSED
+    def Fill(self, Count, Deadline):
+        while len(self.Buffer) < Count:
+            Left = Deadline - time.time()
+            if Left <= 0:
+                return False
+            self.Socket.settimeout(Left)
+            try:
+                Data = self.Socket.recv(4096)
+            except socket.timeout:
+                return False
+            if not Data:
+                raise IOError("connection closed by the gateway")
+            self.Buffer += Data
+        return True
+
+    #DISCARD LATE BYTES OF AN EARLIER RESPONSE; A CONNECTION THE GATEWAY CLOSED IS LEFT FOR WRITE TO REOPEN
+    def Drain(self):
+        self.Buffer = b""
+        if self.Socket is None:
+            return
+        self.Socket.setblocking(False)
+        try:
+            while True:
+                Data = self.Socket.recv(4096)
+                if not Data:
+                    self.Disconnect()
+                    return
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.Disconnect()
+            return
+        self.Socket.setblocking(True)
+
+#ONE READ INPUT REGISTERS REQUEST ON ITS WAY THROUGH A LINK
+class ModbusRequest:
+
+    def __init__(self, Slave, Address, Count, Timeout):
+        self.Slave = Slave
+        self.Address = Address
+        self.Count = Count
+        self.Timeout = Timeout
+        self.Transaction = 0
+        self.Sent = 0
+        self.Elapsed = 0
+
+#RESPONSES OF THE NATIVE TRANSPORTS, WITH THE SAME INTERFACE AS THE PYMODBUS ONES
+class RegistersResponse:
+
+    def __init__(self, Data):
+        self.Data = Data
+
+    @property
+    def registers(self):
+        return list(struct.unpack(">%dH" % (len(self.Data)//2), self.Data))
+
+    def isError(self):
+        return False
+
+class ExceptionResponse:
+
+    def __init__(self, Function, Code):
+        self.function_code = Function
+        self.exception_code = Code
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return "Exception Response(%d, %d, %d)" % (self.function_code, self.function_code & 0x7F, self.exception_code)
+
+class ErrorResponse:
+
+    def __init__(self, Message, Counter, Frame=b""):
+        self.Message = Message
+        self.Counter = Counter          # Poll statistics counter: "Timeouts" or "CrcErrors"
+        self.Frame = Frame              # What was received, if anything (for the trace)
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return self.Message
+
+#RESPONSE OBJECT FROM A FUNCTION 04 PDU (FUNCTION, BYTE COUNT, DATA OR FUNCTION + 0x80, EXCEPTION CODE)
+def DecodeResponse(Pdu, Count):
+    Pdu = bytearray(Pdu)
+    if len(Pdu) >= 2 and Pdu[0] == 0x84:
+        return ExceptionResponse(Pdu[0], Pdu[1])
+    if len(Pdu) != 2 + 2*Count or Pdu[0] != 0x04 or Pdu[1] != 2*Count:
+        return ErrorResponse("invalid response: %d bytes for %d registers" % (len(Pdu), Count), "CrcErrors")
+    return RegistersResponse(bytes(Pdu[2:]))
+
+#RTU FRAME OF A FUNCTION 04 REQUEST
+def RtuRequest(Slave, Address, Count):
+    Frame = struct.pack(">BBHH", Slave, 0x04, Address, Count)
+    return Frame + Crc16(Frame)
+
+#CRC16 (MODBUS) WITH A 256 ENTRY TABLE, LOW BYTE FIRST AS ON THE WIRE
+def Crc16(Data):
+    Crc = 0xFFFF
+    for Byte in bytearray(Data):
+        Crc = (Crc >> 8) ^ _CRC_TABLE[(Crc ^ Byte) & 0xFF]
+    return struct.pack("<H", Crc)
+
+def CrcTable():
+    Table = []
+    for Byte in range(256):
+        Crc = Byte
+        for Bit in range(8):
+            Crc = (Crc >> 1) ^ 0xA001 if Crc & 1 else Crc >> 1
+        Table.append(Crc)
+    return Table
+
+_CRC_TABLE = CrcTable()
+
+#CONNECTION FROM THE SETTINGS: THE GATEWAY IN ADDRESS AND PORT, OR THE SERIAL PORT
+#The built-in RTU client needs pyserial; pymodbus is only imported when it is switched off or pyserial is missing.
+def CreateLink(Settings, StopBits, ByteSize, Parity):
+    if _REPLAY:
+        return ReplayLink(os.path.join(Settings["HomeFolder"], _REPLAY), int(Settings["Mode2"]), StopBits, ByteSize, Parity, _REPLAY_REALTIME)
+    if Settings["Mode3"] in _GATEWAYS:
+        return TcpLink(Settings["Address"], int(Settings["Port"]), int(Settings["Mode2"]), StopBits, ByteSize, Parity, _GATEWAYS[Settings["Mode3"]])
+    if _NATIVE_RTU and serial is not None:
+        return RtuLink(Settings["SerialPort"], int(Settings["Mode2"]), StopBits, ByteSize, Parity)
+    if _NATIVE_RTU:
+        Domoticz.Log("pyserial not found, reading the meters through pymodbus.")
+    return SerialLink(Settings["SerialPort"], int(Settings["Mode2"]), StopBits, ByteSize, Parity)
+
+#PLAN THE MODBUS REQUESTS: MERGE THE VALUES INTO AS FEW BLOCKS AS POSSIBLE
+#Values closer than MaxGap registers are read in one request, as long as the block stays within MaxCount registers.
+#Returns a list of (start address, register count, [addresses of the values in the block]).
+def PlanBlocks(Addresses, MaxGap=_MAX_GAP, MaxCount=_MAX_REGISTERS):
+    Blocks = []
+    for Address in sorted(set(Addresses)):
+        if Blocks:
+            Start, Count, Values = Blocks[-1]
+            End = max(Start + Count, Address + 2)
+            if Address - (Start + Count) <= MaxGap and End - Start <= MaxCount:
+                Values.append(Address)
+                Blocks[-1] = (Start, End - Start, Values)
+                continue
+        Blocks.append((Address, 2, [Address]))
+    return Blocks
+
+#COST OF A PLAN ON THE WIRE: NUMBER OF REQUESTS AND BYTES (REQUESTS AND RESPONSES) PER CYCLE
+def PlanCost(Blocks):
+    Frames = len(Blocks)
+    Bytes = sum(_REQUEST_BYTES + _RESPONSE_BYTES + 2*Count for Start, Count, Addresses in Blocks)
+    return Frames, Bytes
+
+#READ THE MODBUS INFORMATION OF ONE PLANNED BLOCK: RETURNS {ADDRESS: VALUE}, RAISES ON ERRORS
+#The timeout comes from the health of the meter; a failed request is retried once, unless the meter is being probed.
+#Request is the first attempt when it was already sent (pipelined with the requests to the other meters).
+def ReadModbus(Link, Block, Slave, Decoder, Metrics, Health, Request=None):
+    Start, Count, Addresses = Block
+    for Attempt in range(2 if Health.State == _METER_ONLINE else 1):
+        if Attempt:
+            Metrics.Count("Retries")
+        New = Request is None or Attempt
+        if New:
+            Request = ModbusRequest(Slave, Start, Count, Health.Timeout(Count))
+        try:
+            if New:
+                Link.Send(Request)
+            data = Link.Receive(Request)
+        except:
+            Metrics.Count("SerialErrors")
+            if Link.Trace is not None:
+                Link.Trace.Request(Request, None)
+            raise
+        if Link.Trace is not None:
+            Link.Trace.Request(Request, data)
+        Metrics.Request(Slave, Request.Elapsed, data)
+        if not data.isError():
+            Health.Success(Request.Elapsed, Count)
+            if isinstance(data, RegistersResponse):
+                return Decoder.DecodeBytes(data.Data)
+            return Decoder.Decode(data.registers)
+        if hasattr(data, "exception_code"):
+            if data.exception_code in _GATEWAY_EXCEPTIONS:
+                Health.Failure()
+            raise IOError("slave %d answered 0x%04X+%d with exception %s" % (Slave, Start, Count, data.exception_code))
+        if ResponseError(data) == "Timeouts":
+            Health.Expired()
+    Health.Failure()
+    raise IOError("no valid response from slave %d for 0x%04X+%d: %s" % (Slave, Start, Count, data))
+
+#HEALTH OF ONE METER: ADAPTIVE REQUEST TIMEOUT AND CIRCUIT BREAKER
+#After _BREAKER_FAILURES failed requests in a row the meter is taken offline: it is not polled any more, its devices
+#time out at once, and one request probes it again after a backoff. A gateway answering that the meter did not
+#respond (see _GATEWAY_EXCEPTIONS) counts as a failed request.
+#Every timeout doubles the timeout of the next requests (the retry, then the probes) up to _TIMEOUT_MAX, as a
+#meter that got slower would otherwise never get the time to answer; a response brings it back to the estimate.
+class MeterHealth:
+
+    def __init__(self, Slave, CharTime):
+        self.Slave = Slave
+        self.CharTime = CharTime
+        self.Turnaround = _TURNAROUND
+        self.Deviation = _TURNAROUND/2
+        self.Factor = 1
+        self.State = _METER_ONLINE
+        self.Failures = 0
+        self.Backoff = _PROBE_MIN
+        self.NextProbe = 0
+
+    #SECONDS A REQUEST AND ITS RESPONSE OF COUNT REGISTERS TAKE ON THE WIRE
+    def Wire(self, Count):
+        return (_REQUEST_BYTES + _RESPONSE_BYTES + 2*Count)*self.CharTime
+
+    def Timeout(self, Count):
+        return min(self.Factor*max(self.Wire(Count) + self.Turnaround + 4*self.Deviation, _TIMEOUT_MIN), _TIMEOUT_MAX)
+
+    #A REQUEST TIMED OUT: DOUBLE THE TIMEOUT UNTIL THE NEXT RESPONSE
+    def Expired(self):
+        self.Factor = min(self.Factor*2, _TIMEOUT_MAX/_TIMEOUT_MIN)
+
+    #A RESPONSE CAME IN: SMOOTH THE TURNAROUND (LIKE THE TCP RETRANSMISSION TIMER) AND CLOSE THE BREAKER
+    def Success(self, Seconds, Count):
+        Turnaround = max(Seconds - self.Wire(Count), 0)
+        self.Deviation += (abs(Turnaround - self.Turnaround) - self.Deviation)/4
+        self.Turnaround += (Turnaround - self.Turnaround)/8
+        self.Factor = 1
+        if self.State != _METER_ONLINE:
+            Domoticz.Log("Meter " + str(self.Slave) + " responds again, polling resumed.")
+        self.State = _METER_ONLINE
+        self.Failures = 0
+        self.Backoff = _PROBE_MIN
+
+    def Failure(self):
+        self.Failures += 1
+        if self.State == _METER_PROBING or self.Failures >= _BREAKER_FAILURES:
+            if self.State == _METER_ONLINE:
+                Domoticz.Error("Meter " + str(self.Slave) + " does not respond, polling suspended (probe in " + str(self.Backoff) + "s).")
+            self.State = _METER_OFFLINE
+            self.NextProbe = time.time() + self.Backoff
+            self.Backoff = min(self.Backoff*2, _PROBE_MAX)
+
+    #TRUE WHEN THE METER MAY BE POLLED NOW; AN OFFLINE METER IS PROBED ONCE ITS BACKOFF EXPIRED
+    def Allowed(self, Now):
+        if self.State == _METER_OFFLINE and Now >= self.NextProbe:
+            self.State = _METER_PROBING
+        return self.State != _METER_OFFLINE
+
+#DECODER OF A PLANNED BLOCK: ONE PRECOMPILED STRUCT UNPACKS ALL VALUES OF THE BLOCK IN ONE PASS
+#The registers between the values are skipped with pad bytes, so no per-value objects are created.
+class BlockDecoder:
+
+    def __init__(self, Block, Registers):
+        Start, Count, Addresses = Block
+        Format, Position = ">", Start
+        for Address in Addresses:
+            if Address > Position:
+                Format += "%dx" % (2*(Address-Position))
+            Format += Registers[Address].Type
+            Position = Address + struct.calcsize(">" + Registers[Address].Type)//2
+        Format += "%dx" % (2*(Start+Count-Position))
+        self.Addresses = Addresses
+        self.Scales = [Registers[Address].Scale for Address in Addresses]
+        self.Words = struct.Struct(">%dH" % Count)
+        self.Values = struct.Struct(Format)
+
+    #DECODE THE REGISTERS (16 BIT WORDS) OF A RESPONSE: RETURNS {ADDRESS: VALUE}
+    def Decode(self, registers):
+        return self.DecodeBytes(self.Words.pack(*registers))
+
+    #DECODE THE RAW BIG ENDIAN DATA BYTES OF A RESPONSE: RETURNS {ADDRESS: VALUE}
+    def DecodeBytes(self, Data):
+        return dict((Address, round(value*Scale, 4)) for Address, value, Scale in zip(self.Addresses, self.Values.unpack(Data), self.Scales))
+
+#POLL THE METER IN A BACKGROUND THREAD AND QUEUE THE DECODED SNAPSHOTS FOR THE HEARTBEAT
+#A snapshot is {"Time": seconds, "Link": port open, "Due": (tiers read), "Meters": {slave ID: {"Values": {address: value}, "Errors": [addresses not read], "Offline": not polled}}}.
+#The poller never touches Devices: updating them is left to onHeartbeat, on the Domoticz thread.
+#Every snapshot, with its derived values, is also handed to the sinks (Record), which must not block.
+class ModbusPoller(threading.Thread):
+
+    def __init__(self, Link, Registers, Periods, Wanted, Metrics, Sinks=[]):
+        threading.Thread.__init__(self, name="SDM630-Poller")
+        self.daemon = True
+        self.Link = Link
+        self.Metrics = Metrics
+        self.Sinks = list(Sinks)
+        self.Known = {}
+        self.Registers = Registers
+        self.Periods = Periods
+        self.NextDue = dict((Tier, 0) for Tier in Periods)
+        self.Wanted = dict(Wanted)
+        self.Plans = {}
+        self.Lock = threading.Lock()
+        self.Slaves = list(Wanted.keys())
+        self.Health = dict((Slave, MeterHealth(Slave, Link.CharTime)) for Slave in self.Slaves)
+        self.Turn = 0
+        self.Snapshots = collections.deque()
+        self.SnapshotLock = threading.Lock()
+        self.Stopping = threading.Event()
+
+    #READ WHATEVER TIERS ARE DUE, IN ONE COMBINED PLAN PER METER, THEN SLEEP UNTIL THE NEXT TIER IS DUE
+    def run(self):
+        self.Link.Open()
+        while not self.Stopping.is_set():
+            Now = time.time()
+            Due = tuple(Tier for Tier in sorted(self.Periods) if self.NextDue[Tier] <= Now)
+            for Tier in Due:
+                self.NextDue[Tier] += self.Periods[Tier]
+                if self.NextDue[Tier] <= Now:
+                    self.NextDue[Tier] = Now + self.Periods[Tier]
+            if Due:
+                Snapshot = self.Poll(Due)
+                for Sink in self.Sinks:
+                    Sink.Record(Snapshot)
+                self.Publish(Snapshot)
+                self.Metrics.Cycle(time.time() - Now)
+            self.Stopping.wait(max(0, min(self.NextDue.values()) - time.time()))
+        self.Link.Close()
+
+    def Stop(self):
+        self.Stopping.set()
+        if self.is_alive():
+            self.join(_POLLER_JOIN)
+
+    #CHANGE THE REGISTERS TO READ FOR A METER ({TIER: [ADDRESSES]})
+    def Configure(self, Slave, Tiers):
+        with self.Lock:
+            self.Wanted[Slave] = Tiers
+            for Key in [Key for Key in self.Plans if Key[0] == Slave]:
+                del self.Plans[Key]
+
+    #BLOCK PLAN OF A METER FOR A COMBINATION OF TIERS, PLANNED ONCE AND CACHED: [(BLOCK, DECODER)]
+    def Plan(self, Slave, Due):
+        with self.Lock:
+            if (Slave, Due) not in self.Plans:
+                Tiers = self.Wanted[Slave]
+                Blocks = PlanBlocks([Address for Tier in Due for Address in Tiers.get(Tier, [])])
+                self.Plans[(Slave, Due)] = [(Block, BlockDecoder(Block, self.Registers)) for Block in Blocks]
+            return self.Plans[(Slave, Due)]
+
+    #ONE POLL CYCLE OVER ALL METERS, ONE REQUEST AT A TIME ON THE BUS
+    #The meters take turns per request (round-robin), starting with the next meter each cycle,
+    #so a slow or missing meter delays the others by at most one request.
+    #Over a Modbus TCP gateway the requests of one turn are all sent before the responses are read.
+    #Offline meters are skipped, a meter being probed only gets its first request.
+    def Poll(self, Due):
+        Snapshot = {"Time": time.time(), "Link": True, "Due": Due, "Meters": {}}
+        if self.Link.Trace is not None:
+            self.Link.Trace.Cycle(Snapshot["Time"], Due)
+        Slaves = self.Slaves[self.Turn:] + self.Slaves[:self.Turn]
+        self.Turn = (self.Turn + 1) % len(self.Slaves)
+        Plans = {}
+        for Slave in Slaves:
+            Allowed = self.Health[Slave].Allowed(Snapshot["Time"])
+            Snapshot["Meters"][Slave] = {"Values": {}, "Errors": [], "Offline": not Allowed}
+            Plans[Slave] = self.Plan(Slave, Due) if Allowed else []
+            if self.Health[Slave].State == _METER_PROBING:
+                Plans[Slave] = Plans[Slave][:1]
+        Turns = max(len(Plan) for Plan in Plans.values())
+        if Turns == 0:
+            self.Derive(Snapshot)
+            return Snapshot
+        Snapshot["Link"] = self.Link.Ready()
+        if not Snapshot["Link"]:
+            self.Known.clear()
+            return Snapshot
+        for Turn in range(Turns):
+            Requests = {}
+            if self.Link.Pipelining:
+                for Slave in Slaves:
+                    if Turn < len(Plans[Slave]) and self.Health[Slave].State != _METER_OFFLINE:
+                        Block, Decoder = Plans[Slave][Turn]
+                        try:
+                            Requests[Slave] = self.Link.Send(ModbusRequest(Slave, Block[0], Block[1], self.Health[Slave].Timeout(Block[1])))
+                        except:
+                            break
+            for Slave in Slaves:
+                if Turn >= len(Plans[Slave]):
+                    continue
+                Block, Decoder = Plans[Slave][Turn]
+                Meter = Snapshot["Meters"][Slave]
+                if self.Health[Slave].State == _METER_OFFLINE:
+                    Meter["Offline"] = True
+                    continue
+                try:
+                    Meter["Values"].update(ReadModbus(self.Link, Block, Slave, Decoder, self.Metrics, self.Health[Slave], Requests.get(Slave)))
+                except:
+                    Meter["Errors"].extend(Block[2])
+        self.Derive(Snapshot)
+        return Snapshot
+
+    #ADD THE DERIVED VALUES (SEE _DERIVED); SELF.KNOWN KEEPS THE LATEST VALUE OF EVERY REGISTER PER METER
+    def Derive(self, Snapshot):
+        for Slave, Meter in Snapshot["Meters"].items():
+            if Meter["Offline"]:
+                self.Known.pop(Slave, None)
+            elif _DERIVE:
+                DeriveValues(Meter, self.Known.setdefault(Slave, {}))
+
+    #QUEUE A SNAPSHOT; WHEN THE HEARTBEAT FALLS BEHIND THE OLDEST ONE IS FOLDED INTO THE NEXT OLDEST
+    #The queue stays in polling order, so newer values and errors always win over older ones.
+    def Publish(self, Snapshot):
+        with self.SnapshotLock:
+            while len(self.Snapshots) >= max(_SNAPSHOT_QUEUE, 1):
+                Oldest = self.Snapshots.popleft()
+                if self.Snapshots:
+                    self.Snapshots[0] = MergeSnapshots(Oldest, self.Snapshots[0])
+                else:
+                    Snapshot = MergeSnapshots(Oldest, Snapshot)
+            self.Snapshots.append(Snapshot)
+
+    #ALL SNAPSHOTS QUEUED SINCE THE LAST CALL MERGED INTO ONE (OR NONE IF NOTHING WAS POLLED)
+    #Each snapshot only holds the tiers that were due, so the latest value of every register is kept.
+    def Latest(self):
+        with self.SnapshotLock:
+            Queued = list(self.Snapshots)
+            self.Snapshots.clear()
+        Snapshot = None
+        for Newer in Queued:
+            Snapshot = Newer if Snapshot is None else MergeSnapshots(Snapshot, Newer)
+        return Snapshot
+
+#MERGE TWO SNAPSHOTS: THE NEWER VALUES AND ERRORS WIN
+def MergeSnapshots(Older, Newer):
+    Merged = {"Time": Newer["Time"], "Link": Newer["Link"], "Due": tuple(sorted(set(Older["Due"]) | set(Newer["Due"]))), "Meters": {}}
+    for Slave, New in Newer["Meters"].items():
+        Old = Older["Meters"].get(Slave, {"Values": {}, "Errors": [], "Offline": False})
+        Values = dict((Address, value) for Address, value in Old["Values"].items() if Address not in New["Errors"])
+        Values.update(New["Values"])
+        Errors = [Address for Address in Old["Errors"] if Address not in Values and Address not in New["Errors"]] + New["Errors"]
+        Merged["Meters"][Slave] = {"Values": Values, "Errors": Errors, "Offline": New["Offline"]}
+    return Merged
+
+#UPDATE THE DEVICES OF ONE METER (UNITS FROM BASE ON) FROM A SNAPSHOT OF THE POLLER
+#Values within the deadband of the last written value are not written (see WriteFilter), nor values of devices
+#that are not used (read only as a source of a derived value or a statistic).
+def UpdateDevices(Snapshot, Registers, Writes, Base=0, Offsets={}):
+    Now = time.time()
+    if Snapshot["Offline"]:
+        TimeoutMeter(Registers, Writes, Base)
+    for Address, value in Snapshot["Values"].items():
+        Register = Registers[Address]
+        if (Base+Register.Unit not in Devices) or not Devices[Base+Register.Unit].Used:
+            continue
+        value += Offsets.get(Register.Unit, 0)
+        LogDebug('%s: %.4f', Register.StrData, value)
+        if Writes.Due(Base+Register.Unit, value, Register, Now):
+            UpdateDevice(Base+Register.Unit, nValue=value, sValue='%.4f'%(value), AlwaysUpdate=True)
+            Writes.Wrote(Base+Register.Unit, value, Now)
+    for Address in Snapshot["Errors"]:
+        Register = Registers[Address]
+        if (Base+Register.Unit not in Devices) or not Devices[Base+Register.Unit].Used:
+            continue
+        Domoticz.Error("Error reading data (%s)." % (Register.StrData))
+        TimeoutDevice(All=False, Unit=Base+Register.Unit)
+        Writes.Forget(Base+Register.Unit)
+
+#UPDATE THE STATISTIC DEVICES OF ONE METER (UNITS FROM BASE ON) WITH THE AGGREGATED SAMPLES {ADDRESS: (MIN, MAX, MEAN, LAST, COUNT)}
+#They are written once per update interval, and only when they are used.
+def UpdateStatistics(Slave, Aggregates, Registers, Base=0):
+    for Address, (Min, Max, Mean, Last, Count) in sorted(Aggregates.items()):
+        LogDebug("Samples meter %s %s: %d, min %.4f, max %.4f, mean %.4f, last %.4f", Slave, Registers[Address].StrData, Count, Min, Max, Mean, Last)
+    for Item in _STATISTICS:
+        Unit = Base + Item.Unit
+        if (Unit in Devices) and Devices[Unit].Used and Item.Address in Aggregates:
+            value = Aggregates[Item.Address][Item.Aggregate]
+            UpdateDevice(Unit, nValue=value, sValue='%.4f'%(value))
+
+#SET ALL DEVICES OF AN OFFLINE METER ON TIMED-OUT AT ONCE
+def TimeoutMeter(Registers, Writes, Base=0):
+    for Register in Registers.values():
+        Unit = Base + Register.Unit
+        if (Unit in Devices) and Devices[Unit].TimedOut != _TIMEDOUT:
+            TimeoutDevice(All=False, Unit=Unit)
+            Writes.Forget(Unit)
+
+#SHADOW OF THE VALUES LAST WRITTEN TO THE DEVICES
+#Deciding whether a value must be written only looks at this cache, never at the Domoticz devices.
+class WriteFilter:
 
+    def __init__(self):
+        self.Last = {}
+
+    #TRUE WHEN THE VALUE LEFT THE DEADBAND (AND THE MINIMUM INTERVAL PASSED) OR THE MAXIMUM INTERVAL EXPIRED
+    def Due(self, Unit, value, Register, Now):
+        if Unit not in self.Last:
+            return True
+        LastValue, WrittenAt = self.Last[Unit]
+        MinInterval, MaxInterval = _WRITE_INTERVALS[Register.Tier]
+        if Now - WrittenAt >= MaxInterval:
+            return True
+        if Now - WrittenAt < MinInterval:
+            return False
+        return abs(value - LastValue) > max(Register.Deadband, Register.Relative*abs(LastValue))
+
+    def Wrote(self, Unit, value, Now):
+        self.Last[Unit] = (value, Now)
+
+    #THE DEVICE WAS CHANGED OUTSIDE THE FILTER (TIMED OUT): WRITE THE NEXT VALUE WHATEVER IT IS
+    def Forget(self, Unit):
+        self.Last.pop(Unit, None)
+
+    def Clear(self):
+        self.Last.clear()
+
+################################################################################
+# High-rate sampling
+################################################################################
+
+#RING BUFFER OF THE LAST SIZE SAMPLES OF ONE REGISTER, STORED AS 32 BIT FLOATS LIKE IN THE METER
+class SampleBuffer:
+
+    def __init__(self, Size):
+        self.Size = Size
+        self.Samples = array.array(_FLOAT32, bytes(4*Size))
+        self.Clear()
+
+    def Clear(self):
+        self.Next = 0
+        self.Count = 0
+
+    def Add(self, value):
+        self.Samples[self.Next] = value
+        self.Next = (self.Next + 1) % self.Size
+        self.Count = min(self.Count + 1, self.Size)
+
+    #(MIN, MAX, MEAN, LAST, COUNT) OF THE SAMPLES IN THE BUFFER, OR NONE WHEN IT IS EMPTY
+    def Aggregate(self):
+        if not self.Count:
+            return None
+        Window = self.Samples if self.Count == self.Size else self.Samples[:self.Count]
+        return (round(min(Window), 4), round(max(Window), 4), round(sum(Window)/self.Count, 4), round(self.Samples[self.Next-1], 4), self.Count)
+
+#SAMPLE BUFFERS OF ALL METERS: THE POLLER RECORDS EVERY SNAPSHOT, THE HEARTBEAT AGGREGATES ONCE PER UPDATE INTERVAL
+#Only the cycles of the sample tier are recorded, so the samples are evenly spaced and the buffers (sized for one
+#update interval of that tier) never wrap; the sampled registers read in between by the other tiers are left out.
+class SampleStore:
+
+    def __init__(self, Size):
+        self.Size = Size
+        self.Lock = threading.Lock()
+        self.Buffers = {}
+        self.Sampled = set(Register.Address for Register in _REGISTERS if Register.Unit in _SAMPLED_UNITS)
+
+    def Record(self, Snapshot):
+        if _TIER_SAMPLE not in Snapshot["Due"]:
+            return
+        with self.Lock:
+            for Slave, Meter in Snapshot["Meters"].items():
+                for Address, value in Meter["Values"].items():
+                    if Address in self.Sampled:
+                        if (Slave, Address) not in self.Buffers:
+                            self.Buffers[(Slave, Address)] = SampleBuffer(self.Size)
+                        self.Buffers[(Slave, Address)].Add(value)
+
+    #{ADDRESS: (MIN, MAX, MEAN, LAST, COUNT)} OF A METER SINCE THE LAST CALL, THEN START A NEW INTERVAL
+    def Aggregate(self, Slave):
+        Aggregates = {}
+        with self.Lock:
+            for (Owner, Address), Buffer in self.Buffers.items():
+                if Owner == Slave and Buffer.Count:
+                    Aggregates[Address] = Buffer.Aggregate()
+                    Buffer.Clear()
+        return Aggregates
+
+################################################################################
+# History store
+################################################################################
+
+#WRITE THE SNAPSHOTS OF THE POLLER TO THE HISTORY STORE IN A BACKGROUND THREAD
+#One SQLite file per day (sdm630-YYYYMMDD.sqlite) with one table, samples(time in ms, slave, address, value), clustered
+#on time for range queries. The poller only queues its snapshots; the writer commits them in batches every
+#_HISTORY_FLUSH seconds, in WAL mode with synchronous=NORMAL so the card is only synced at checkpoints.
+class HistoryWriter(threading.Thread):
+
+    def __init__(self, Folder):
+        threading.Thread.__init__(self, name="SDM630-History")
+        self.daemon = True
+        self.Folder = Folder
+        self.Snapshots = queue.Queue(maxsize=_HISTORY_QUEUE)
+        self.Stopping = threading.Event()
+        self.Day = None
+        self.Database = None
+        self.Dropped = 0
+        self.NextRotate = 0
+
+    #QUEUE A SNAPSHOT OF THE POLLER, NEVER BLOCKING THE POLL LOOP
+    def Record(self, Snapshot):
+        try:
+            self.Snapshots.put_nowait(Snapshot)
+        except queue.Full:
+            self.Dropped += 1
+
+    def Stop(self):
+        self.Stopping.set()
+        self.join(_POLLER_JOIN)
+
+    def run(self):
+        try:
+            os.makedirs(self.Folder, exist_ok=True)
+        except OSError as Error:
+            Domoticz.Error("History store disabled, cannot create " + self.Folder + ": " + str(Error))
+            return
+        Rows = []
+        NextFlush = time.time() + _HISTORY_FLUSH
+        while not self.Stopping.is_set() or not self.Snapshots.empty():
+            try:
+                Snapshot = self.Snapshots.get(timeout=max(0, min(NextFlush - time.time(), 1)))
+                Time = int(1000*Snapshot["Time"])
+                for Slave, Meter in Snapshot["Meters"].items():
+                    Rows.extend((Time, Slave, Address, value) for Address, value in Meter["Values"].items())
+            except queue.Empty:
+                pass
+            if Rows and (time.time() >= NextFlush or len(Rows) >= _HISTORY_BATCH or self.Stopping.is_set()):
+                self.Flush(Rows)
+                Rows = []
+            if time.time() >= NextFlush:
+                NextFlush = time.time() + _HISTORY_FLUSH
+        if Rows:
+            self.Flush(Rows)
+        self.Close()
+
+    #WRITE A BATCH OF ROWS, EACH TO THE FILE OF ITS DAY, ONE TRANSACTION PER FILE
+    def Flush(self, Rows):
+        try:
+            for Day, Batch in PartitionRows(Rows):
+                if Day != self.Day:
+                    self.Close()
+                    self.Database = OpenHistory(os.path.join(self.Folder, HistoryFile(Day)))
+                    self.Day = Day
+                with self.Database:
+                    self.Database.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)", Batch)
+            LogDebug("History: %d values written, %d snapshots dropped", len(Rows), self.Dropped)
+        except Exception as Error:
+            Domoticz.Error("History store error, %d values lost: %s" % (len(Rows), str(Error)))
+            self.Close()
+        if time.time() >= self.NextRotate:
+            self.NextRotate = time.time() + _HISTORY_ROTATE
+            RotateHistory(self.Folder, self.Day)
+
+    def Close(self):
+        if self.Database is not None:
+            try:
+                self.Database.close()
+            except:
+                pass
+        self.Database = None
+        self.Day = None
+
+#NAME OF THE FILE OF ONE DAY ("YYYYMMDD")
+def HistoryFile(Day):
+    return "sdm630-" + Day + ".sqlite"
+
+#DAY ("YYYYMMDD", LOCAL TIME) OF A TIME IN MILLISECONDS
+def HistoryDay(Time):
+    return time.strftime("%Y%m%d", time.localtime(Time/1000.0))
+
+#SPLIT ROWS (TIME IN MS FIRST) BY DAY: [(DAY, [ROWS])]
+def PartitionRows(Rows):
+    Days = collections.OrderedDict()
+    for Row in Rows:
+        Days.setdefault(HistoryDay(Row[0]), []).append(Row)
+    return list(Days.items())
+
+#OPEN (AND CREATE) THE FILE OF ONE DAY
+def OpenHistory(Path):
+    Database = sqlite3.connect(Path)
+    Database.execute("PRAGMA journal_mode=WAL")
+    Database.execute("PRAGMA synchronous=NORMAL")
+    Database.execute("CREATE TABLE IF NOT EXISTS samples (time INTEGER, slave INTEGER, address INTEGER, value REAL, PRIMARY KEY (time, slave, address)) WITHOUT ROWID")
+    return Database
+
+#DAY FILES IN THE HISTORY FOLDER, OLDEST FIRST: [(DAY, PATH)]
+def HistoryFiles(Folder):
+    Files = []
+    for Name in sorted(os.listdir(Folder)):
+        if Name.startswith("sdm630-") and Name.endswith(".sqlite"):
+            Files.append((Name[7:15], os.path.join(Folder, Name)))
+    return Files
+
+#DELETE THE DAY FILES OLDER THAN _HISTORY_DAYS, THEN THE OLDEST ONES WHILE ALL TOGETHER ARE LARGER THAN _HISTORY_MAX_BYTES
+#The file of the current day is always kept.
+def RotateHistory(Folder, Current):
+    Oldest = time.strftime("%Y%m%d", time.localtime(time.time() - _HISTORY_DAYS*24*3600))
+    Files = [(Day, Path) for Day, Path in HistoryFiles(Folder) if Day != Current]
+    Sizes = dict((Path, sum(os.path.getsize(Path + Suffix) for Suffix in ("", "-wal", "-shm") if os.path.exists(Path + Suffix))) for Day, Path in HistoryFiles(Folder))
+    Total = sum(Sizes.values())
+    for Day, Path in Files:
+        if Day >= Oldest and Total <= _HISTORY_MAX_BYTES:
+            break
+        for Suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(Path + Suffix)
+            except OSError:
+                pass
+        Total -= Sizes[Path]
+        Domoticz.Log("History file " + os.path.basename(Path) + " deleted.")
+
+#VALUES IN THE HISTORY STORE FROM START TO END (SECONDS, END EXCLUDED), OPTIONALLY OF ONE SLAVE AND SOME ADDRESSES
+#Yields (time in seconds, slave, address, value) in time order; only the day files of the range are opened.
+def QueryHistory(Folder, Start, End, Slave=None, Addresses=None):
+    Where, Arguments = "time >= ? AND time < ?", [int(1000*Start), int(1000*End)]
+    if Slave is not None:
+        Where += " AND slave = ?"
+        Arguments.append(Slave)
+    if Addresses:
+        Where += " AND address IN (" + ",".join("?"*len(Addresses)) + ")"
+        Arguments.extend(Addresses)
+    First, Last = HistoryDay(1000*Start), HistoryDay(1000*End)
+    for Day, Path in HistoryFiles(Folder):
+        if Day < First or Day > Last:
+            continue
+        Database = sqlite3.connect(Path)
+        try:
+            for Time, Slave, Address, value in Database.execute("SELECT time, slave, address, value FROM samples WHERE " + Where + " ORDER BY time, slave, address", Arguments):
+                yield Time/1000.0, Slave, Address, value
+        finally:
+            Database.close()
+
+#EXPORT A RANGE OF THE HISTORY STORE TO A CSV FILE, ONE ROW PER POLL CYCLE AND METER, ONE COLUMN PER REGISTER
+#Returns the number of rows written.
+def ExportHistory(Folder, Start, End, File, Slave=None, Addresses=None):
+    Registers = dict((Register.Address, Register) for Register in _REGISTERS)
+    Columns = sorted(Addresses if Addresses else Registers)
+    Count = 0
+    with open(File, "w", newline="") as Output:
+        Writer = csv.writer(Output)
+        Writer.writerow(["Time", "Slave"] + [Registers[Address].StrData if Address in Registers else "0x%04X" % Address for Address in Columns])
+        Key, Row = None, {}
+        for Time, Owner, Address, value in QueryHistory(Folder, Start, End, Slave, Columns):
+            if (Time, Owner) != Key:
+                if Key is not None:
+                    Writer.writerow(ExportRow(Key, Row, Columns))
+                    Count += 1
+                Key, Row = (Time, Owner), {}
+            Row[Address] = value
+        if Key is not None:
+            Writer.writerow(ExportRow(Key, Row, Columns))
+            Count += 1
+    return Count
+
+def ExportRow(Key, Row, Columns):
+    Time, Slave = Key
+    return [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(Time)) + ".%03d" % (int(1000*Time) % 1000), Slave] + ["%.4f" % Row[Address] if Address in Row else "" for Address in Columns]
+
+################################################################################
+# Export
+################################################################################
+
+#SEND THE SNAPSHOTS OF THE POLLER TO A SINK (MQTT OR INFLUXDB) IN A BACKGROUND THREAD
+#The poller only appends its snapshots to a bounded buffer; every _EXPORT_FLUSH seconds (or when _EXPORT_BATCH
+#cycles are waiting) the exporter formats and sends up to _EXPORT_BATCH of them in one go. A snapshot leaves the
+#buffer once it is sent; while the sink is down the buffer fills up and the oldest snapshots are dropped.
+class Exporter(threading.Thread):
+
+    def __init__(self, Sink):
+        threading.Thread.__init__(self, name="SDM630-Exporter")
+        self.daemon = True
+        self.Sink = Sink
+        self.Buffer = collections.deque(maxlen=_EXPORT_BUFFER)
+        self.Lock = threading.Lock()
+        self.Wakeup = threading.Event()
+        self.Stopping = threading.Event()
+        self.Names = dict((Register.Address, Register.StrData) for Register in _REGISTERS)
+        self.Dropped = 0
+        self.Down = False
+
+    #BUFFER A SNAPSHOT OF THE POLLER, NEVER BLOCKING THE POLL LOOP
+    def Record(self, Snapshot):
+        with self.Lock:
+            if len(self.Buffer) == self.Buffer.maxlen:
+                self.Dropped += 1
+            self.Buffer.append(Snapshot)
+            if len(self.Buffer) >= _EXPORT_BATCH:
+                self.Wakeup.set()
+
+    def Stop(self):
+        self.Stopping.set()
+        self.Wakeup.set()
+        self.join(_POLLER_JOIN)
+
+    def run(self):
+        while not self.Stopping.is_set():
+            self.Wakeup.wait(_EXPORT_FLUSH)
+            self.Wakeup.clear()
+            while self.Flush() and len(self.Buffer) >= _EXPORT_BATCH and not self.Stopping.is_set():
+                pass
+        self.Flush()
+        self.Sink.Close()
+
+    #SEND THE OLDEST BATCH: TRUE WHEN IT WAS SENT (OR THERE WAS NOTHING TO SEND)
+    def Flush(self):
+        with self.Lock:
+            Batch = list(self.Buffer)[:_EXPORT_BATCH]
+        Snapshots = [Snapshot for Snapshot in Batch if any(ExportValues(Meter) for Meter in Snapshot["Meters"].values())]
+        if Snapshots:
+            try:
+                self.Sink.Send(Snapshots, self.Names)
+            except ValueError as Error:
+                # The sink is up but refused the batch: sending it again would fail again
+                Domoticz.Error("Export to " + self.Sink.Name + " rejected " + str(len(Snapshots)) + " poll cycles, dropped: " + str(Error))
+            except Exception as Error:
+                if not self.Down:
+                    Domoticz.Error("Export to " + self.Sink.Name + " failed, buffering up to " + str(_EXPORT_BUFFER) + " poll cycles: " + str(Error))
+                self.Down = True
+                self.Sink.Close()
+                return False
+            else:
+                if self.Down:
+                    Domoticz.Log("Export to " + self.Sink.Name + " resumed (" + str(self.Dropped) + " poll cycles dropped).")
+                LogDebug("Export: %d poll cycles sent to %s", len(Snapshots), self.Sink.Name)
+            self.Down = False
+        with self.Lock:
+            for Snapshot in Batch:
+                if self.Buffer and self.Buffer[0] is Snapshot:
+                    self.Buffer.popleft()
+        return True
+
+#SINK FROM THE EXPORT SETTING
+def CreateSink(Kind):
+    if Kind == "mqtt":
+        return MqttSink(_EXPORT_HOST, _EXPORT_PORT, _EXPORT_TOPIC)
+    if Kind == "influx-http":
+        return InfluxHttpSink(_EXPORT_HOST, _EXPORT_PORT, _EXPORT_PATH, _EXPORT_TOKEN)
+    if Kind == "influx-udp":
+        return InfluxUdpSink(_EXPORT_HOST, _EXPORT_PORT)
+    raise ValueError("unknown export '" + Kind + "'")
+
+#VALUES OF A METER TO EXPORT: NAN AND INFINITY (A BAD READING, OR A REGISTER NOT IN A REPLAYED TRACE) ARE LEFT OUT,
+#NEITHER INFLUXDB NOR JSON ACCEPTS THEM
+def ExportValues(Meter):
+    return dict((Address, float(value)) for Address, value in Meter["Values"].items() if math.isfinite(value))
+
+#INFLUXDB LINE PROTOCOL: ONE LINE PER METER AND POLL CYCLE, THE REGISTERS AS FIELDS, THE TIME IN NANOSECONDS
+def InfluxLines(Snapshots, Names):
+    Lines = []
+    for Snapshot in Snapshots:
+        Time = int(round(1000*Snapshot["Time"]))*1000000
+        for Slave, Meter in sorted(Snapshot["Meters"].items()):
+            Values = ExportValues(Meter)
+            if Values:
+                Fields = ",".join("%s=%r" % (Names[Address], value) for Address, value in sorted(Values.items()))
+                Lines.append("%s,slave=%d %s %d" % (_EXPORT_MEASUREMENT, Slave, Fields, Time))
+    return Lines
+
+#MQTT JSON PAYLOAD OF ONE POLL CYCLE: {"time": SECONDS, "meters": {"SLAVE ID": {"REGISTER": VALUE}}}
+def MqttPayload(Snapshot, Names):
+    Meters = {}
+    for Slave, Meter in Snapshot["Meters"].items():
+        Values = ExportValues(Meter)
+        if Values:
+            Meters[str(Slave)] = dict((Names[Address], value) for Address, value in Values.items())
+    return json.dumps({"time": round(Snapshot["Time"], 3), "meters": Meters}, sort_keys=True, allow_nan=False)
+
+#INFLUXDB OVER HTTP: ALL LINES OF A BATCH IN ONE POST ON A KEPT-ALIVE CONNECTION
+class InfluxHttpSink:
+
+    def __init__(self, Host, Port, Path, Token=""):
+        self.Name = "InfluxDB http://" + Host + ":" + str(Port) + Path
+        self.Host = Host
+        self.Port = Port
+        self.Path = Path
+        self.Headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if Token:
+            self.Headers["Authorization"] = "Token " + Token
+        self.Connection = None
+
+    def Send(self, Snapshots, Names):
+        if self.Connection is None:
+            self.Connection = http.client.HTTPConnection(self.Host, self.Port, timeout=_TIMEOUT_MAX)
+        self.Connection.request("POST", self.Path, "\n".join(InfluxLines(Snapshots, Names)).encode("utf-8"), self.Headers)
+        Response = self.Connection.getresponse()
+        Body = Response.read()
+        if Response.status // 100 == 4:
+            raise ValueError("HTTP %d %s" % (Response.status, Body[:200].decode("utf-8", "replace")))
+        if Response.status // 100 != 2:
+            raise IOError("HTTP %d %s" % (Response.status, Body[:200].decode("utf-8", "replace")))
+
+    def Close(self):
+        if self.Connection is not None:
+            self.Connection.close()
+        self.Connection = None
+
+#INFLUXDB OVER UDP: THE LINES OF A BATCH PACKED INTO DATAGRAMS OF AT MOST _UDP_PAYLOAD BYTES
+class InfluxUdpSink:
+
+    def __init__(self, Host, Port):
+        self.Name = "InfluxDB udp://" + Host + ":" + str(Port)
+        self.Address = (Host, Port)
+        self.Socket = None
+
+    def Send(self, Snapshots, Names):
+        if self.Socket is None:
+            self.Socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        Datagram = b""
+        for Line in InfluxLines(Snapshots, Names):
+            Line = Line.encode("utf-8") + b"\n"
+            if Datagram and len(Datagram) + len(Line) > _UDP_PAYLOAD:
+                self.Socket.sendto(Datagram, self.Address)
+                Datagram = b""
+            Datagram += Line
+        if Datagram:
+            self.Socket.sendto(Datagram, self.Address)
+
+    def Close(self):
+        if self.Socket is not None:
+            self.Socket.close()
+        self.Socket = None
+
+#MQTT 3.1.1 PUBLISHER (QOS 0): ONE MESSAGE PER POLL CYCLE, ON A KEPT-OPEN CONNECTION
+#A connection the broker closed (e.g. after the keepalive while the meters were offline) is reopened once.
+class MqttSink:
+
+    def __init__(self, Host, Port, Topic):
+        self.Name = "MQTT " + Host + ":" + str(Port) + " " + Topic
+        self.Host = Host
+        self.Port = Port
+        self.Topic = Topic.encode("utf-8")
+        self.ClientId = ("sdm630-%d" % os.getpid()).encode("utf-8")
+        self.Socket = None
+        self.LastSent = 0
+
+    def Send(self, Snapshots, Names):
+        Packets = b"".join(MqttPacket(0x30, MqttString(self.Topic) + MqttPayload(Snapshot, Names).encode("utf-8")) for Snapshot in Snapshots)
+        try:
+            self.Write(Packets)
+        except OSError:
+            self.Close()
+            self.Write(Packets)
+
+    def Write(self, Data):
+        if self.Socket is None or time.time() - self.LastSent > _MQTT_KEEPALIVE:
+            self.Close()
+            self.Connect()
+        self.Socket.sendall(Data)
+        self.LastSent = time.time()
+
+    def Connect(self):
+        self.Socket = socket.create_connection((self.Host, self.Port), _TIMEOUT_MAX)
+        self.Socket.sendall(MqttPacket(0x10, MqttString(b"MQTT") + struct.pack(">BBH", 4, 0x02, _MQTT_KEEPALIVE) + MqttString(self.ClientId)))
+        Answer = b""
+        while len(Answer) < 4:
+            Data = self.Socket.recv(4 - len(Answer))
+            if not Data:
+                raise IOError("connection closed by the broker")
+            Answer += Data
+        if bytearray(Answer)[0] != 0x20 or bytearray(Answer)[3] != 0:
+            raise IOError("connection refused by the broker (code %d)" % bytearray(Answer)[3])
+
+    def Close(self):
+        if self.Socket is not None:
+            try:
+                self.Socket.sendall(b"\xe0\x00")
+                self.Socket.close()
+            except OSError:
+                pass
+        self.Socket = None
+
+#MQTT PACKET: FIXED HEADER WITH THE VARIABLE LENGTH REMAINING LENGTH, THEN THE BODY
+def MqttPacket(Header, Body):
+    Length, Encoded = len(Body), bytearray()
+    while True:
+        Byte, Length = Length % 128, Length // 128
+        Encoded.append(Byte | (0x80 if Length else 0))
+        if not Length:
+            break
+    return bytes(bytearray([Header])) + bytes(Encoded) + Body
+
+def MqttString(Data):
+    return struct.pack(">H", len(Data)) + Data
+
+################################################################################
+# Record and replay
+################################################################################
+
+#RECORD THE MODBUS TRAFFIC OF THE POLLER TO A TRACE FILE (SEE _TRACE_RECORD)
+#Writes are buffered by the file object; nothing is synced, a trace is a debugging aid.
+class TraceWriter:
+
+    def __init__(self, Path):
+        self.Path = Path
+        self.File = open(Path, "ab")
+        if self.File.tell() == 0:
+            self.File.write(_TRACE_MAGIC)
+        Domoticz.Log("Recording the Modbus traffic to " + Path + ".")
+
+    def Cycle(self, Time, Due):
+        self.Write(Time, 0, _TRACE_CYCLE, bytes(bytearray(Due)))
+
+    #A REQUEST AND ITS RESPONSE (NONE WHEN THE PORT OR CONNECTION FAILED)
+    def Request(self, Request, Response):
+        Status, Frame = TraceResponse(Request.Slave, Response)
+        self.Write(time.time(), Request.Elapsed, Status, RtuRequest(Request.Slave, Request.Address, Request.Count) + Frame)
+
+    def Write(self, Time, Latency, Status, Frames):
+        if self.File is None:
+            return
+        self.File.write(_TRACE_RECORD.pack(Time, Latency, Status, len(Frames)) + Frames)
+        if self.File.tell() >= _TRACE_MAX_BYTES:
+            Domoticz.Error("Trace file " + self.Path + " is full, recording stopped.")
+            self.Close()
+
+    def Close(self):
+        if self.File is not None:
+            self.File.close()
+        self.File = None
+
+#STATUS AND RTU RESPONSE FRAME OF A RESPONSE FOR THE TRACE (BUILT-IN OR PYMODBUS RESPONSES)
+def TraceResponse(Slave, Response):
+    if Response is None:
+        return _TRACE_LINK, b""
+    if not Response.isError():
+        Data = Response.Data if isinstance(Response, RegistersResponse) else struct.pack(">%dH" % len(Response.registers), *Response.registers)
+        Frame = struct.pack(">BBB", Slave, 0x04, len(Data)) + Data
+        return _TRACE_OK, Frame + Crc16(Frame)
+    if hasattr(Response, "exception_code"):
+        Frame = struct.pack(">BBB", Slave, 0x84, Response.exception_code)
+        return _TRACE_EXCEPTION, Frame + Crc16(Frame)
+    Status = _TRACE_CRC if ResponseError(Response) == "CrcErrors" else _TRACE_TIMEOUT
+    return Status, getattr(Response, "Frame", b"")
+
+#ALL RECORDS OF A TRACE FILE: [(TIME, LATENCY, STATUS, FRAMES)]
+def ReadTrace(Path):
+    with open(Path, "rb") as File:
+        Data = File.read()
+    if not Data.startswith(_TRACE_MAGIC):
+        raise IOError(Path + " is not a trace file")
+    Records, Position = [], len(_TRACE_MAGIC)
+    while Position + _TRACE_RECORD.size <= len(Data):
+        Time, Latency, Status, Length = _TRACE_RECORD.unpack_from(Data, Position)
+        Position += _TRACE_RECORD.size
+        Records.append((Time, Latency, Status, Data[Position:Position+Length]))
+        Position += Length
+    return Records
+
+#READ THE METERS FROM A TRACE INSTEAD OF THE BUS
+#The trace is replayed cycle by cycle: tools/replay.py steps through the recorded cycles (NextCycle gives the time and
+#the tiers that were due), in Domoticz every poll cycle takes the next recorded one until the trace ends. A request is
+#answered with the recorded response of the same request in that cycle, or, when the plan changed, from the registers
+#of the recorded responses of the meter (registers never recorded read as NaN). Latencies are the recorded ones; at
+#recorded speed the replay also waits for them and for the start of each cycle.
+class ReplayLink(ModbusLink):
+
+    Kind = "Trace replay"
+
+    def __init__(self, Path, BaudRate, StopBits, ByteSize, Parity, RealTime=False):
+        ModbusLink.__init__(self, Path, BaudRate, StopBits, ByteSize, Parity)
+        self.RealTime = RealTime
+        self.Cycles = []
+        for Time, Latency, Status, Frames in ReadTrace(Path):
+            if Status == _TRACE_CYCLE:
+                self.Cycles.append((Time, tuple(bytearray(Frames)), []))
+            elif self.Cycles:
+                self.Cycles[-1][2].append((Latency, Status, Frames[:8], Frames[8:]))
+        self.Stepping = False
+        self.Rewind()
+
+    def Connect(self):
+        pass
+
+    def Disconnect(self):
+        pass
+
+    #CALLED ONCE PER POLL CYCLE: A FAILED CONNECTION IN THE TRACE DOES NOT STOP THE REPLAY, THE END OF THE TRACE DOES
+    def Ready(self):
+        if not self.Stepping and self.Advance() is None:
+            if self.State != _LINK_CLOSED:
+                Domoticz.Log(self.Kind + " of " + self.Port + " has ended.")
+                self.Close()
+            return False
+        return self.State == _LINK_OK or self.Open()
+
+    #BACK TO THE FIRST CYCLE OF THE TRACE
+    def Rewind(self):
+        self.Next = 0
+        self.Current = []
+        self.Registers = {}
+        self.Origin = None
+
+    #START THE NEXT RECORDED POLL CYCLE: (TIME, DUE TIERS), OR NONE AT THE END OF THE TRACE
+    def NextCycle(self):
+        self.Stepping = True
+        return self.Advance()
+
+    def Advance(self):
+        if self.Next >= len(self.Cycles):
+            return None
+        Time, Due, Records = self.Cycles[self.Next]
+        self.Next += 1
+        self.Current = list(Records)
+        if self.RealTime:
+            if self.Origin is None:
+                self.Origin = time.time() - Time
+            Wait = self.Origin + Time - time.time()
+            if Wait > 0:
+                time.sleep(Wait)
+        return Time, Due
+
+    def Receive(self, Request):
+        if self.State != _LINK_OK:
+            raise IOError(self.Kind + " on " + self.Port + " is not open")
+        Latency, Status, Frame = self.Match(Request)
+        Request.Elapsed = Latency
+        if self.RealTime:
+            time.sleep(Latency)
+        if Status == _TRACE_LINK:
+            self.Failed(self.Kind + " error on " + self.Port + ": recorded connection failure")
+            raise IOError("recorded connection failure")
+        if Status == _TRACE_TIMEOUT:
+            return ErrorResponse("no response from slave %d (timeout, recorded)" % Request.Slave, "Timeouts", Frame)
+        if Status == _TRACE_CRC:
+            return ErrorResponse("invalid response from slave %d: CRC error (recorded)" % Request.Slave, "CrcErrors", Frame)
+        return DecodeResponse(Frame[1:-2], Request.Count)
+
+    #THE RECORDED ANSWER TO A REQUEST IN THE CURRENT CYCLE: (LATENCY, STATUS, RESPONSE FRAME)
+    def Match(self, Request):
+        Frame = RtuRequest(Request.Slave, Request.Address, Request.Count)
+        for Index, Record in enumerate(self.Current):
+            if Record[2] == Frame:
+                del self.Current[Index]
+                self.Remember(Record)
+                return Record[0], Record[1], Record[3]
+        # Another plan: take the registers from the recorded responses that overlap the request
+        Latency, End = 0.0, Request.Address + Request.Count
+        for Record in [Record for Record in self.Current if bytearray(Record[2])[0] == Request.Slave]:
+            Slave, Function, Address, Count = struct.unpack(">BBHH", Record[2][:6])
+            if Address < End and Address + Count > Request.Address:
+                self.Current.remove(Record)
+                self.Remember(Record)
+                Latency += Record[0]
+        Known = self.Registers.get(Request.Slave, {})
+        if any(Address in Known for Address in range(Request.Address, End)):
+            Data = b"".join(Known.get(Address, _TRACE_UNKNOWN[Address % 2]) for Address in range(Request.Address, End))
+            Response = struct.pack(">BBB", Request.Slave, 0x04, len(Data)) + Data
+            return Latency, _TRACE_OK, Response + Crc16(Response)
+        return Request.Timeout, _TRACE_TIMEOUT, b""
+
+    #KEEP THE REGISTERS OF A GOOD RECORDED RESPONSE
+    def Remember(self, Record):
+        Latency, Status, Request, Response = Record
+        if Status != _TRACE_OK:
+            return
+        Slave, Function, Address, Count = struct.unpack(">BBHH", Request[:6])
+        Known = self.Registers.setdefault(Slave, {})
+        for Offset in range(Count):
+            Known[Address + Offset] = Response[3+2*Offset:5+2*Offset]
+
+################################################################################
+# Poll statistics
+################################################################################
+
+#COUNTERS AND TIMINGS OF THE POLLER, COLLECTED ON THE HEARTBEAT
+#The poller thread records, the heartbeat collects; a lock keeps both consistent.
+#The request latency is also kept per meter, so one slow meter (or a long cable to it) stands out.
+class PollMetrics:
+
+    def __init__(self):
+        self.Lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        self.Cycles = 0
+        self.CycleTime = 0.0
+        self.CycleMax = 0.0
+        self.Requests = 0
+        self.Latency = 0.0
+        self.Histogram = [0]*(len(_LATENCY_BUCKETS) + 1)
+        self.Meters = {}
+        self.Counters = {"Timeouts": 0, "CrcErrors": 0, "Exceptions": 0, "Retries": 0, "SerialErrors": 0}
+
+    def Cycle(self, Seconds):
+        with self.Lock:
+            self.Cycles += 1
+            self.CycleTime += Seconds
+            self.CycleMax = max(self.CycleMax, Seconds)
+
+    #ONE REQUEST TO A METER: ITS LATENCY AND, FOR AN ERROR RESPONSE, WHAT WENT WRONG
+    def Request(self, Slave, Seconds, Response):
+        Milliseconds = 1000*Seconds
+        Bucket = 0
+        while Bucket < len(_LATENCY_BUCKETS) and Milliseconds > _LATENCY_BUCKETS[Bucket]:
+            Bucket += 1
+        with self.Lock:
+            self.Requests += 1
+            self.Latency += Seconds
+            self.Histogram[Bucket] += 1
+            if Slave not in self.Meters:
+                self.Meters[Slave] = {"Requests": 0, "Latency": 0.0, "Histogram": [0]*(len(_LATENCY_BUCKETS) + 1)}
+            Meter = self.Meters[Slave]
+            Meter["Requests"] += 1
+            Meter["Latency"] += Seconds
+            Meter["Histogram"][Bucket] += 1
+        if Response.isError():
+            self.Count(ResponseError(Response))
+
+    def Count(self, Counter):
+        with self.Lock:
+            self.Counters[Counter] += 1
+
+    #THE FIGURES OF THE INTERVAL SINCE THE LAST CALL, THEN START A NEW INTERVAL
+    #"Meters" has the requests, mean latency and histogram of every meter: {slave ID: {"Requests", "Latency", "Histogram"}}.
+    def Collect(self):
+        with self.Lock:
+            Figures = {
+                "Cycles": self.Cycles,
+                "CycleTime": 1000*self.CycleTime/self.Cycles if self.Cycles else 0.0,
+                "CycleMax": 1000*self.CycleMax,
+                "Requests": self.Requests,
+                "Latency": 1000*self.Latency/self.Requests if self.Requests else 0.0,
+                "Histogram": list(self.Histogram),
+                "Meters": dict((Slave, {"Requests": Meter["Requests"], "Latency": 1000*Meter["Latency"]/Meter["Requests"], "Histogram": list(Meter["Histogram"])}) for Slave, Meter in self.Meters.items()),
+            }
+            Figures.update(self.Counters)
+            self.Reset()
+        return Figures
+
+#KIND OF ERROR OF A MODBUS ERROR RESPONSE: AN EXCEPTION FROM THE METER, A CORRUPTED FRAME OR NO ANSWER
+#The built-in clients know what went wrong; the pymodbus responses are classified by their message.
+def ResponseError(Response):
+    if hasattr(Response, "exception_code"):
+        return "Exceptions"
+    if isinstance(Response, ErrorResponse):
+        return Response.Counter
+    Text = str(Response).lower()
+    if "crc" in Text or "invalid" in Text:
+        return "CrcErrors"
+    return "Timeouts"
+
+#CREATE THE POLL STATISTICS DEVICES (NOT USED)
+def CreateMetricsDevices():
+    if (_UNIT_POLLCYCLETIME not in Devices):
+        Domoticz.Device(Name="Poll Cycle Time", Unit=_UNIT_POLLCYCLETIME, TypeName="Custom", Options={"Custom": "0;ms"}, Image=Images[_IMAGE].ID, Used=0).Create()
+    if (_UNIT_REQUESTLATENCY not in Devices):
+        Domoticz.Device(Name="Modbus Request Latency", Unit=_UNIT_REQUESTLATENCY, TypeName="Custom", Options={"Custom": "0;ms"}, Image=Images[_IMAGE].ID, Used=0).Create()
+    if (_UNIT_BUSERRORS not in Devices):
+        Domoticz.Device(Name="Modbus Errors", Unit=_UNIT_BUSERRORS, TypeName="Custom", Options={"Custom": "0;errors"}, Image=Images[_IMAGE].ID, Used=0).Create()
+    if (_UNIT_RETRIES not in Devices):
+        Domoticz.Device(Name="Modbus Retries", Unit=_UNIT_RETRIES, TypeName="Custom", Options={"Custom": "0;retries"}, Image=Images[_IMAGE].ID, Used=0).Create()
+
+#DUMP THE POLL STATISTICS OF THE LAST INTERVAL TO THE LOG AND THE STATISTICS DEVICES
+#With several meters the request latency of each meter follows on its own line.
+def UpdateMetrics(Figures):
+    Errors = Figures["Timeouts"] + Figures["CrcErrors"] + Figures["Exceptions"] + Figures["SerialErrors"]
+    Domoticz.Log("Poll statistics: %d cycles (mean %.0f ms, max %.0f ms), %d requests (mean %.0f ms; %s), %d timeouts, %d CRC errors, %d exceptions, %d serial errors, %d retries" % (
+        Figures["Cycles"], Figures["CycleTime"], Figures["CycleMax"], Figures["Requests"], Figures["Latency"], LatencyHistogram(Figures["Histogram"]),
+        Figures["Timeouts"], Figures["CrcErrors"], Figures["Exceptions"], Figures["SerialErrors"], Figures["Retries"]))
+    if len(Figures["Meters"]) > 1:
+        for Slave, Meter in sorted(Figures["Meters"].items()):
+            Domoticz.Log("Poll statistics meter %d: %d requests (mean %.0f ms; %s)" % (Slave, Meter["Requests"], Meter["Latency"], LatencyHistogram(Meter["Histogram"])))
+    for Unit, value in ((_UNIT_POLLCYCLETIME, Figures["CycleTime"]), (_UNIT_REQUESTLATENCY, Figures["Latency"]), (_UNIT_BUSERRORS, Errors), (_UNIT_RETRIES, Figures["Retries"])):
+        if (Unit in Devices) and Devices[Unit].Used:
+            UpdateDevice(Unit, nValue=0, sValue='%.0f' % value)
+
+#A LATENCY HISTOGRAM AS TEXT: "<10:5 <20:1 ... >2000:0"
+def LatencyHistogram(Histogram):
+    return " ".join("<%d:%d" % (Bound, Count) for Bound, Count in zip(_LATENCY_BUCKETS, Histogram)) + " >%d:%d" % (_LATENCY_BUCKETS[-1], Histogram[-1])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Shared by the tests: plugin.py loaded with the Domoticz stand-in (tools/Domoticz.py), in a temporary plugin folder,
+# and simulated meters behind a local TCP gateway (tools/simulator.py), which needs no pyserial.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "tools"))
+import Domoticz
+from simulator import Simulator, Gateway
+
+PLUGIN = os.path.join(_ROOT, "plugin.py")
+
+#LOAD plugin.py WITH ITS FILES (METER BLOCKS, TRACES...) IN HOME, A TEMPORARY FOLDER
+def LoadPlugin(Home, Settings={}):
+    Domoticz.Quiet = True
+    Plugin = Domoticz.Load(PLUGIN, Settings)
+    Domoticz.Parameters["HomeFolder"] = Home + os.sep
+    if not os.path.exists(os.path.join(Home, "SDM630MCT_v2.zip")):
+        shutil.copy(os.path.join(_ROOT, "SDM630MCT_v2.zip"), Home)
+    return Plugin
+
+#SETTINGS OF A HARDWARE ENTRY READING SLAVES THROUGH A GATEWAY ("TCP" OR "RTUTCP") ON PORT
+def GatewaySettings(Slaves, Port, Mode="TCP"):
+    return {"SerialPort": "", "Mode1": ",".join(str(Slave) for Slave in Slaves), "Mode2": "115200", "Mode3": Mode,
+            "Mode4": "0", "Mode5": "0", "Mode6": "Normal", "Address": "127.0.0.1", "Port": str(Port)}
+
+#THE POLLER OF A STARTED PLUGIN, DRIVEN BY THE TEST INSTEAD OF ITS THREAD: A FRESH ONE WITH THE LINK OPEN
+def DrivenPoller(Plugin):
+    Poller = Plugin._plugin.Poller
+    Poller.Stop()
+    Poller = Plugin.ModbusPoller(Poller.Link, Poller.Registers, Poller.Periods, Poller.Wanted, Poller.Metrics, Poller.Sinks)
+    Plugin._plugin.Poller = Poller
+    Poller.Link.Open()
+    return Poller
+
+#SIMULATED METERS BEHIND A GATEWAY AND A STARTED PLUGIN READING THEM, FOR A TEST CASE
+class GatewayMeters:
+
+    def __init__(self, Slaves=[1, 2], Framing="tcp", Noise=0.01):
+        self.Home = tempfile.mkdtemp()
+        self.Simulator = Simulator(Slaves, 115200, Turnaround=0.001, Noise=Noise, Seed=1)
+        self.Gateway = Gateway(self.Simulator, Framing)
+        self.Gateway.start()
+        self.Plugin = LoadPlugin(self.Home, GatewaySettings(Slaves, self.Gateway.Port, {"tcp": "TCP", "rtu": "RTUTCP"}[Framing]))
+        self.Plugin.onStart()
+        self.Poller = DrivenPoller(self.Plugin)
+
+    def Stop(self):
+        self.Plugin.onStop()
+        self.Poller.Link.Close()
+        self.Gateway.Stop()
+        self.Simulator.Stop()
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+#ALL TIERS OF THE POLLER, AS DUE IN THE FIRST CYCLE
+def AllTiers(Poller):
+    return tuple(sorted(Poller.Periods))
+
+#ERRORS OF A SNAPSHOT OVER ALL METERS
+def Errors(Snapshot):
+    return sum(len(Meter["Errors"]) for Meter in Snapshot["Meters"].values())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Values derived from the registers already read (apparent power, power factor, averages).
+#
+
+import shutil
+import tempfile
+import unittest
+
+import support
+
+#ONE METER'S PART OF A SNAPSHOT
+def Meter(Values, Errors=[]):
+    return {"Values": dict(Values), "Errors": list(Errors), "Offline": False}
+
+class DeriveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Known = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def Derive(self, Values, Errors=[]):
+        Item = Meter(Values, Errors)
+        self.Plugin.DeriveValues(Item, self.Known)
+        return Item
+
+    def testSourcesOfADerivedValueAreReadInstead(self):
+        self.assertEqual(self.Plugin.DerivedSources(0x0000), [0x0000])
+        self.assertEqual(self.Plugin.DerivedSources(0x0012), [0x0000, 0x0006])
+        self.assertEqual(self.Plugin.DerivedSources(0x003E), [0x0034, 0x0000, 0x0006, 0x0002, 0x0008, 0x0004, 0x000A])
+
+    def testSourcesFromDifferentTiers(self):
+        Item = self.Derive({0x0000: 230.0, 0x0006: 2.0})
+        self.assertEqual(Item["Values"][0x0012], 460.0)
+        self.assertNotIn(0x0014, Item["Values"])
+
+        # Only the current is read in the next cycle: the voltage of the last cycle is used
+        Item = self.Derive({0x0006: 4.0})
+        self.assertEqual(Item["Values"], {0x0006: 4.0, 0x0012: 920.0})
+
+        # Nothing new, nothing derived
+        self.assertEqual(self.Derive({0x0034: 1000.0})["Values"], {0x0034: 1000.0})
+
+    def testTotalsAndPowerFactors(self):
+        Values = {0x0000: 230.0, 0x0002: 230.0, 0x0004: 230.0, 0x0006: 2.0, 0x0008: 1.0, 0x000A: 1.0,
+                  0x000C: 400.0, 0x000E: -230.0, 0x0010: 0.0, 0x0034: 460.0}
+        Item = self.Derive(Values)["Values"]
+        self.assertEqual(Item[0x0038], 920.0)
+        self.assertEqual((Item[0x001E], Item[0x0020], Item[0x0022]), (0.8696, -1.0, 0.0))
+        self.assertEqual(Item[0x003E], 0.5)
+        self.assertEqual((Item[0x002A], Item[0x002E], Item[0x0030]), (230.0, 1.3333, 4.0))
+        self.assertEqual(self.Plugin.PowerFactor([100.0, 0.0]), 0.0)
+
+    def testErrorsOfASourceCarryOver(self):
+        self.Derive({0x0000: 230.0, 0x0006: 2.0})
+        Item = self.Derive({}, [0x0000])
+        self.assertIn(0x0012, Item["Errors"])
+        self.assertIn(0x002A, Item["Errors"])
+        self.assertNotIn(0x0012, self.Known)
+
+        # The voltage is missing until it is read again
+        self.assertNotIn(0x0012, self.Derive({0x0006: 3.0})["Values"])
+        self.assertEqual(self.Derive({0x0000: 230.0})["Values"][0x0012], 690.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Export encodings and the exporter against the sink stand-ins (tools/sink.py).
+#
+
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import support
+from sink import Sink
+
+#ONE METER'S SNAPSHOT AT TIME
+def Snapshot(Time, Values, Slave=1):
+    return {"Time": Time, "Link": True, "Due": (0,), "Meters": {Slave: {"Values": dict(Values), "Errors": [], "Offline": False}}}
+
+class ExportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Names = dict((Register.Address, Register.StrData) for Register in self.Plugin._REGISTERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testMqttRemainingLength(self):
+        self.assertEqual(self.Plugin.MqttPacket(0x30, b"x"*3), b"\x30\x03xxx")
+        self.assertEqual(self.Plugin.MqttPacket(0x30, b"x"*200)[:3], b"\x30\xc8\x01")
+        self.assertEqual(self.Plugin.MqttPacket(0x30, b"x"*16384)[:4], b"\x30\x80\x80\x01")
+
+    def testNonFiniteValuesAreLeftOut(self):
+        Bad = Snapshot(1.5, {0x0000: 230.0, 0x0034: float("nan"), 0x0006: float("inf")})
+        self.assertEqual(self.Plugin.InfluxLines([Bad], self.Names), ["sdm630,slave=1 Voltage_L1=230.0 1500000000"])
+        self.assertEqual(json.loads(self.Plugin.MqttPayload(Bad, self.Names)), {"time": 1.5, "meters": {"1": {"Voltage_L1": 230.0}}})
+        self.assertEqual(self.Plugin.InfluxLines([Snapshot(2, {0x0034: float("nan")})], self.Names), [])
+
+    def testMqttMessagePerCycle(self):
+        Broker = Sink("mqtt", Quiet=True)
+        Broker.Start()
+        Exporter = self.Plugin.Exporter(self.Plugin.MqttSink("127.0.0.1", Broker.Port, "sdm630"))
+        for Time in (1, 2):
+            Exporter.Record(Snapshot(Time, {0x0000: 230.0 + Time}))
+        self.assertTrue(Exporter.Flush())
+        Exporter.Sink.Close()
+        Deadline = time.time() + 5
+        while len(Broker.Received) < 2 and time.time() < Deadline:
+            time.sleep(0.01)
+        self.assertEqual([(Topic, json.loads(Payload)["meters"]["1"]["Voltage_L1"]) for Kind, Topic, Payload in Broker.Received], [("sdm630", 231.0), ("sdm630", 232.0)])
+
+    def testInfluxBatchesAreKeptWhileDownAndDroppedWhenRefused(self):
+        Database = Sink("influx-http", Fail=1, Quiet=True)
+        Database.Start()
+        Exporter = self.Plugin.Exporter(self.Plugin.InfluxHttpSink("127.0.0.1", Database.Port, "/write"))
+        Exporter.Record(Snapshot(1, {0x0000: 231.0}))
+        self.assertFalse(Exporter.Flush())
+        self.assertEqual(len(Exporter.Buffer), 1)
+        self.assertTrue(Exporter.Flush())
+        self.assertEqual(len(Exporter.Buffer), 0)
+        self.assertEqual(len(Database.Received), 1)
+
+        # A batch the database refuses (4xx) would be refused again: it is dropped, not retried
+        self.Plugin.InfluxLines = lambda Snapshots, Names: ["sdm630,slave=1 Voltage_L1=nan 1"]
+        Exporter.Record(Snapshot(2, {0x0000: 232.0}))
+        self.assertTrue(Exporter.Flush())
+        self.assertEqual(len(Exporter.Buffer), 0)
+        self.assertEqual(len(Database.Received), 1)
+        Exporter.Sink.Close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Meters behind a Modbus TCP or RTU over TCP gateway (the simulator behind a local TCP port).
+#
+
+import time
+import unittest
+
+import support
+
+class GatewayTests(unittest.TestCase):
+
+    def Check(self, Framing):
+        Meters = support.GatewayMeters([1, 2], Framing, Noise=0)
+        try:
+            Snapshot = Meters.Poller.Poll(support.AllTiers(Meters.Poller))
+            self.assertTrue(Snapshot["Link"])
+            self.assertEqual(support.Errors(Snapshot), 0)
+            for Slave in (1, 2):
+                self.assertAlmostEqual(Snapshot["Meters"][Slave]["Values"][0x0000], 231.2, places=3)
+                self.assertAlmostEqual(Snapshot["Meters"][Slave]["Values"][0x0034], 1978.0, places=3)
+
+            # The gateway drops the idle connection: the next cycle reconnects before sending
+            Meters.Gateway.Drop()
+            time.sleep(0.2)
+            Snapshot = Meters.Poller.Poll(support.AllTiers(Meters.Poller))
+            self.assertEqual(support.Errors(Snapshot), 0)
+            self.assertEqual(Meters.Poller.Metrics.Counters["SerialErrors"], 0)
+            self.assertEqual(Meters.Poller.Link.State, Meters.Plugin._LINK_OK)
+        finally:
+            Meters.Stop()
+
+    def testModbusTcp(self):
+        self.Check("tcp")
+
+    def testRtuOverTcp(self):
+        self.Check("rtu")
+
+if __name__ == "__main__":
+    unittest.main()
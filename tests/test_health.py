@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Health of a meter: the adaptive request timeout and the circuit breaker.
+#
+
+import struct
+import shutil
+import tempfile
+import unittest
+
+import support
+
+#A LINK ANSWERING EVERY REQUEST WITH THE NEXT OF RESPONSES, KEEPING THE TIMEOUTS OF THE REQUESTS
+class ScriptedLink:
+
+    Trace = None
+
+    def __init__(self, Responses):
+        self.Responses = list(Responses)
+        self.Timeouts = []
+
+    def Send(self, Request):
+        return Request
+
+    def Receive(self, Request):
+        self.Timeouts.append(Request.Timeout)
+        Request.Elapsed = 0.05
+        return self.Responses.pop(0)
+
+class HealthTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Health = self.Plugin.MeterHealth(1, self.Plugin.ModbusLink("test", 9600, 1, 8, "N").CharTime)
+        self.Block = (0x0000, 2, [0x0000])
+        self.Decoder = self.Plugin.BlockDecoder(self.Block, dict((Register.Address, Register) for Register in self.Plugin._REGISTERS))
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def Read(self, *Responses):
+        Link = ScriptedLink(Responses)
+        try:
+            return self.Plugin.ReadModbus(Link, self.Block, 1, self.Decoder, self.Plugin.PollMetrics(), self.Health)
+        except IOError:
+            return None
+        finally:
+            self.Timeouts = Link.Timeouts
+
+    def Timeout(self):
+        return self.Plugin.ErrorResponse("no response from slave 1 (timeout)", "Timeouts")
+
+    def Value(self, value):
+        return self.Plugin.RegistersResponse(struct.pack(">f", value))
+
+    def testTheBreakerOpensAfterFailuresInARowAndProbes(self):
+        for Failure in range(self.Plugin._BREAKER_FAILURES - 1):
+            self.Health.Failure()
+        self.assertTrue(self.Health.Allowed(0))
+        self.Health.Failure()
+        self.assertEqual(self.Health.State, self.Plugin._METER_OFFLINE)
+        NextProbe = self.Health.NextProbe
+        self.assertFalse(self.Health.Allowed(NextProbe - 1))
+        self.assertTrue(self.Health.Allowed(NextProbe))
+        self.assertEqual(self.Health.State, self.Plugin._METER_PROBING)
+
+        # A failed probe takes the meter offline again for twice as long, a response closes the breaker
+        self.Health.Failure()
+        self.assertEqual(self.Health.State, self.Plugin._METER_OFFLINE)
+        self.assertEqual(self.Health.Backoff, 4*self.Plugin._PROBE_MIN)
+        self.Health.Allowed(self.Health.NextProbe)
+        self.Health.Success(0.05, 2)
+        self.assertEqual((self.Health.State, self.Health.Failures, self.Health.Backoff), (self.Plugin._METER_ONLINE, 0, self.Plugin._PROBE_MIN))
+
+    def testTheTimeoutFollowsTheTurnaround(self):
+        Initial = self.Health.Timeout(2)
+        for Response in range(50):
+            self.Health.Success(self.Health.Wire(2) + 0.01, 2)
+        self.assertLess(self.Health.Timeout(2), Initial)
+        self.assertGreaterEqual(self.Health.Timeout(2), self.Plugin._TIMEOUT_MIN)
+
+    def testATimeoutDoublesTheTimeoutOfTheRetryAndTheProbes(self):
+        Initial = self.Health.Timeout(2)
+        self.assertIsNone(self.Read(self.Timeout(), self.Timeout()))
+        self.assertEqual(self.Timeouts, [Initial, 2*Initial])
+        self.assertIsNone(self.Read(self.Timeout(), self.Timeout()))
+        self.assertEqual(self.Timeouts, [4*Initial, 8*Initial])
+        self.assertIsNone(self.Read(self.Timeout(), self.Timeout()))
+        self.assertEqual(self.Health.State, self.Plugin._METER_OFFLINE)
+        self.assertEqual(self.Timeouts, [min(16*Initial, self.Plugin._TIMEOUT_MAX), self.Plugin._TIMEOUT_MAX])
+
+        # The probe gets the largest timeout, its response brings the timeout back to the estimate
+        self.Health.Allowed(self.Health.NextProbe)
+        self.assertEqual(self.Read(self.Value(230.5)), {0x0000: 230.5})
+        self.assertEqual(self.Timeouts, [self.Plugin._TIMEOUT_MAX])
+        self.assertLess(self.Health.Timeout(2), 2*Initial)
+
+    def testGatewayExceptionsOpenTheBreaker(self):
+        for Read in range(self.Plugin._BREAKER_FAILURES):
+            self.assertIsNone(self.Read(self.Plugin.DecodeResponse(b"\x84\x0b", 2)))
+        self.assertEqual(self.Health.State, self.Plugin._METER_OFFLINE)
+
+    def testMeterExceptionsDoNotOpenTheBreaker(self):
+        for Read in range(self.Plugin._BREAKER_FAILURES):
+            self.assertIsNone(self.Read(self.Plugin.DecodeResponse(b"\x84\x02", 2)))
+        self.assertEqual((self.Health.State, self.Health.Failures), (self.Plugin._METER_ONLINE, 0))
+
+if __name__ == "__main__":
+    unittest.main()
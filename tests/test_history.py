@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# The history store: writing the snapshots to day files, querying and exporting them, and deleting old files.
+#
+
+import os
+import csv
+import time
+import shutil
+import tempfile
+import unittest
+
+import support
+
+#ONE SNAPSHOT OF TWO METERS AT TIME
+def Snapshot(Time, Values):
+    return {"Time": Time, "Link": True, "Due": (0,), "Meters": dict((Slave, {"Values": dict(Values), "Errors": [], "Offline": False}) for Slave in (1, 2))}
+
+class HistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Folder = os.path.join(self.Home, self.Plugin._HISTORY_FOLDER)
+        self.Day = time.mktime((2026, 3, 1, 23, 59, 58, 0, 0, -1))
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def Write(self, Snapshots):
+        Writer = self.Plugin.HistoryWriter(self.Folder)
+        Writer.start()
+        for Item in Snapshots:
+            Writer.Record(Item)
+        Writer.Stop()
+
+    def testSnapshotsAreWrittenToTheFileOfTheirDay(self):
+        self.Write([Snapshot(self.Day + Second, {0x0000: 230.0 + Second, 0x0034: 1000.0}) for Second in (0, 1, 2, 3)])
+        self.assertEqual([Day for Day, Path in self.Plugin.HistoryFiles(self.Folder)], ["20260301", "20260302"])
+        Rows = list(self.Plugin.QueryHistory(self.Folder, self.Day + 1, self.Day + 3, Slave=2, Addresses=[0x0000]))
+        self.assertEqual(Rows, [(self.Day + 1, 2, 0x0000, 231.0), (self.Day + 2, 2, 0x0000, 232.0)])
+        self.assertEqual(len(list(self.Plugin.QueryHistory(self.Folder, self.Day, self.Day + 4))), 16)
+
+    def testExportOneRowPerCycleAndMeter(self):
+        self.Write([Snapshot(self.Day + Second, {0x0000: 230.0, 0x0034: 1000.0 + Second}) for Second in (0, 1)])
+        File = os.path.join(self.Home, "export.csv")
+        self.assertEqual(self.Plugin.ExportHistory(self.Folder, self.Day, self.Day + 2, File, Addresses=[0x0000, 0x0034]), 4)
+        with open(File) as Input:
+            Rows = list(csv.reader(Input))
+        self.assertEqual(Rows[0], ["Time", "Slave", "Voltage_L1", "Total_System_Power"])
+        self.assertEqual(Rows[4][1:], ["2", "230.0000", "1001.0000"])
+
+    def testRotateDeletesOldFilesButNotTheCurrentOne(self):
+        os.makedirs(self.Folder)
+        Today = time.strftime("%Y%m%d")
+        Old = time.strftime("%Y%m%d", time.localtime(time.time() - (self.Plugin._HISTORY_DAYS + 2)*24*3600))
+        Recent = time.strftime("%Y%m%d", time.localtime(time.time() - 24*3600))
+        for Day in (Old, Recent, Today):
+            self.Plugin.OpenHistory(os.path.join(self.Folder, self.Plugin.HistoryFile(Day))).close()
+        self.Plugin.RotateHistory(self.Folder, Today)
+        self.assertEqual([Day for Day, Path in self.Plugin.HistoryFiles(self.Folder)], [Recent, Today])
+
+        # Over the size limit the oldest files go first, the current one stays
+        self.Plugin._HISTORY_MAX_BYTES = 0
+        self.Plugin.RotateHistory(self.Folder, Today)
+        self.assertEqual([Day for Day, Path in self.Plugin.HistoryFiles(self.Folder)], [Today])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Several meters on one hardware entry: the slave IDs, their offsets and the device units of each meter.
+#
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import support
+
+class SettingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testParseSlaves(self):
+        self.assertEqual(self.Plugin.ParseSlaves("1"), [1])
+        self.assertEqual(self.Plugin.ParseSlaves("3, 1;2,3"), [3, 1, 2])
+        self.assertEqual(self.Plugin.ParseSlaves("0,248"), [1])
+        self.assertEqual(self.Plugin.ParseSlaves("1,2,3,4,5,6"), [1, 2, 3, 4, 5])
+
+    def testParseOffsets(self):
+        self.assertEqual(self.Plugin.ParseOffsets("12.5", 2), [12.5, 0.0])
+        self.assertEqual(self.Plugin.ParseOffsets("1;2,3", 2), [1.0, 2.0])
+
+class MeterBlockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Devices = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    #START A HARDWARE ENTRY WITH THE DEVICES OF THE PREVIOUS START: RETURNS {SLAVE ID: BASE UNIT}
+    def Start(self, Slaves):
+        Plugin = support.LoadPlugin(self.Home, {"Mode1": Slaves, "Mode4": "", "Mode6": "Normal"})
+        support.Domoticz.Image("SDM630MCT_v2.zip").Create()
+        support.Domoticz.Devices.update(self.Devices)
+        Bases = dict((Slave, Plugin.MeterBase(Block)) for Slave, Block in Plugin.MeterBlocks(Plugin.ParseSlaves(Slaves)).items())
+        for Slave, Base in Bases.items():
+            Plugin.CreateDevices(Base, Plugin.MeterPrefix(Base, Slave))
+        self.Devices = dict(support.Domoticz.Devices)
+        return Bases
+
+    def testSlaveIdsKeepTheirUnits(self):
+        self.assertEqual(self.Start("1,2,3"), {1: 0, 2: 50, 3: 100})
+        self.assertEqual(self.Start("3,1"), {1: 0, 3: 100})
+        self.assertEqual(self.Start("3,1,4"), {1: 0, 3: 100, 4: 150})
+        with open(os.path.join(self.Home, "meters.json")) as File:
+            self.assertEqual(json.load(File), {"1": {"1": 0, "2": 1, "3": 2, "4": 3}})
+
+    def testUnitsOfARemovedMeterAreFreedWithItsDevices(self):
+        self.Start("1,2")
+        for Unit in range(51, 101):
+            self.Devices.pop(Unit, None)
+        self.assertEqual(self.Start("1,7"), {1: 0, 7: 50})
+
+    def testASingleMeterKeepsItsUnitsWithAnotherSlaveId(self):
+        self.assertEqual(self.Start("1"), {1: 0})
+        self.assertEqual(self.Start("2"), {2: 0})
+        self.assertLessEqual(max(self.Devices), 50)
+        self.assertEqual(self.Start("2,1"), {2: 0, 1: 50})
+
+    def testNoFreeUnitsMeansNotPolled(self):
+        self.Start("1,2,3,4,5")
+        self.assertEqual(sorted(self.Start("1,2,3,4,6")), [1, 2, 3, 4])
+
+if __name__ == "__main__":
+    unittest.main()
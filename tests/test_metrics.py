@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Poll statistics: counters, the request latency per meter and what goes to the log and the devices.
+#
+
+import shutil
+import tempfile
+import unittest
+
+import support
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Metrics = self.Plugin.PollMetrics()
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testLatencyHistogramPerMeter(self):
+        Ok = self.Plugin.RegistersResponse(b"\x00\x00\x00\x00")
+        for Seconds in (0.005, 0.015, 0.015):
+            self.Metrics.Request(1, Seconds, Ok)
+        self.Metrics.Request(2, 0.3, Ok)
+        self.Metrics.Request(2, 5.0, self.Plugin.ErrorResponse("no response", "Timeouts"))
+        self.Metrics.Count("Retries")
+        self.Metrics.Cycle(0.5)
+        Figures = self.Metrics.Collect()
+        self.assertEqual(Figures["Requests"], 5)
+        self.assertEqual(Figures["Histogram"], [1, 2, 0, 0, 0, 1, 0, 0, 1])
+        self.assertEqual(Figures["Meters"][1]["Histogram"], [1, 2, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(Figures["Meters"][2]["Histogram"], [0, 0, 0, 0, 0, 1, 0, 0, 1])
+        self.assertAlmostEqual(Figures["Meters"][1]["Latency"], 35.0/3)
+        self.assertAlmostEqual(Figures["Meters"][2]["Latency"], 2650.0)
+        self.assertEqual((Figures["Timeouts"], Figures["Retries"], Figures["Cycles"]), (1, 1, 1))
+        self.assertAlmostEqual(Figures["CycleMax"], 500.0)
+
+        # Collecting starts a new interval
+        Figures = self.Metrics.Collect()
+        self.assertEqual((Figures["Requests"], Figures["Meters"], Figures["Timeouts"]), (0, {}, 0))
+
+    def testResponseErrors(self):
+        self.assertEqual(self.Plugin.ResponseError(self.Plugin.DecodeResponse(b"\x84\x02", 2)), "Exceptions")
+        self.assertEqual(self.Plugin.ResponseError(self.Plugin.ErrorResponse("bad frame", "CrcErrors")), "CrcErrors")
+
+    def testEveryMeterIsLogged(self):
+        Logged = []
+        Log = support.Domoticz.Log
+        support.Domoticz.Log = Logged.append
+        try:
+            Ok = self.Plugin.RegistersResponse(b"\x00\x00\x00\x00")
+            self.Metrics.Request(1, 0.005, Ok)
+            self.Plugin.UpdateMetrics(self.Metrics.Collect())
+            self.assertEqual(len(Logged), 1)
+            self.Metrics.Request(1, 0.005, Ok)
+            self.Metrics.Request(7, 0.15, Ok)
+            self.Plugin.UpdateMetrics(self.Metrics.Collect())
+            self.assertEqual(Logged[2:], ["Poll statistics meter 1: 1 requests (mean 5 ms; <10:1 <20:0 <50:0 <100:0 <200:0 <500:0 <1000:0 <2000:0 >2000:0)",
+                                          "Poll statistics meter 7: 1 requests (mean 150 ms; <10:0 <20:0 <50:0 <100:0 <200:1 <500:0 <1000:0 <2000:0 >2000:0)"])
+        finally:
+            support.Domoticz.Log = Log
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Planning the register blocks to read and decoding them.
+#
+
+import struct
+import shutil
+import tempfile
+import unittest
+
+import support
+
+class PlanningTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testPlanBlocksReadsThroughSmallGaps(self):
+        self.assertEqual(self.Plugin.PlanBlocks([0x0004, 0x0000, 0x0002]), [(0x0000, 6, [0x0000, 0x0002, 0x0004])])
+        self.assertEqual(self.Plugin.PlanBlocks([0x0000, 0x0010], MaxGap=4), [(0x0000, 2, [0x0000]), (0x0010, 2, [0x0010])])
+        self.assertEqual(self.Plugin.PlanBlocks([0x0000, 0x0010], MaxGap=14), [(0x0000, 0x12, [0x0000, 0x0010])])
+
+    def testPlanBlocksRespectsTheRequestSize(self):
+        Blocks = self.Plugin.PlanBlocks(range(0, 200, 2), MaxGap=0, MaxCount=80)
+        self.assertEqual([Count for Start, Count, Addresses in Blocks], [80, 80, 40])
+
+    def testPlanCost(self):
+        Blocks = self.Plugin.PlanBlocks([0x0000, 0x0002, 0x0100])
+        self.assertEqual(self.Plugin.PlanCost(Blocks), (2, 2*(self.Plugin._REQUEST_BYTES + self.Plugin._RESPONSE_BYTES) + 2*(4 + 2)))
+
+    def testBlockDecoderSkipsTheRegistersBetweenTheValues(self):
+        Registers = dict((Register.Address, Register) for Register in self.Plugin._REGISTERS)
+        Block = self.Plugin.PlanBlocks([0x0000, 0x0006, 0x0010])[0]
+        self.assertEqual(Block, (0x0000, 0x12, [0x0000, 0x0006, 0x0010]))
+        Words = [0]*Block[1]
+        for Address, value in ((0x0000, 230.5), (0x0006, 4.25), (0x0010, 655.0)):
+            Words[Address:Address+2] = struct.unpack(">HH", struct.pack(">f", value))
+        Decoder = self.Plugin.BlockDecoder(Block, Registers)
+        self.assertEqual(Decoder.Decode(Words), {0x0000: 230.5, 0x0006: 4.25, 0x0010: 655.0})
+        self.assertEqual(Decoder.DecodeBytes(struct.pack(">%dH" % Block[1], *Words)), Decoder.Decode(Words))
+
+if __name__ == "__main__":
+    unittest.main()
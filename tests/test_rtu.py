@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# The built-in Modbus RTU client: frames, CRC and the serial link against the simulated meters on a pseudo terminal.
+#
+
+import time
+import struct
+import shutil
+import tempfile
+import unittest
+
+import support
+import simulator
+
+class FrameTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testCrcOfAKnownFrame(self):
+        self.assertEqual(self.Plugin.Crc16(bytes.fromhex("010400000002")), bytes.fromhex("71cb"))
+        self.assertEqual(self.Plugin.RtuRequest(1, 0x0000, 2), bytes.fromhex("01040000000271cb"))
+
+    def testTableCrcMatchesTheBitwiseOne(self):
+        for Frame in (b"", b"\x00", bytes(range(256)), b"\x11\x04\x00\x34\x00\x02"):
+            self.assertEqual(self.Plugin.Crc16(Frame), simulator.Crc16(Frame))
+
+    def testDecodeResponse(self):
+        Response = self.Plugin.DecodeResponse(b"\x04\x04" + struct.pack(">f", 230.5), 2)
+        self.assertFalse(Response.isError())
+        self.assertEqual(Response.Data, struct.pack(">f", 230.5))
+        self.assertEqual(self.Plugin.DecodeResponse(b"\x84\x02", 2).exception_code, 2)
+        self.assertTrue(self.Plugin.DecodeResponse(b"\x04\x02\x00\x00", 2).isError())
+
+class SerialTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        if self.Plugin.serial is None:
+            shutil.rmtree(self.Home, ignore_errors=True)
+            self.skipTest("pyserial is not installed")
+        self.Simulator = None
+        self.Link = None
+
+    def tearDown(self):
+        if self.Link is not None:
+            self.Link.Close()
+        if self.Simulator is not None:
+            self.Simulator.Stop()
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    #THE SIMULATED METERS ON A PSEUDO TERMINAL AND THE LINK TO THEM, OPENED
+    def Open(self, CrcErrors=0.0):
+        self.Simulator = simulator.Simulator([1, 2], 19200, Turnaround=0.005, CrcErrors=CrcErrors, Noise=0, Seed=1)
+        self.Simulator.start()
+        self.Link = self.Plugin.RtuLink(self.Simulator.Port, 19200, 1, 8, "N")
+        self.assertTrue(self.Link.Open())
+
+    def Read(self, Slave, Address, Count, Timeout=0.5):
+        return self.Link.Receive(self.Plugin.ModbusRequest(Slave, Address, Count, Timeout))
+
+    def testReadsTheMeters(self):
+        self.Open()
+        for Slave in (1, 2):
+            Response = self.Read(Slave, 0x0000, 6)
+            self.assertFalse(Response.isError())
+            self.assertEqual([round(value, 2) for value in struct.unpack(">fff", Response.Data)], [231.2, 229.8, 230.5])
+
+    def testAMissingMeterTimesOutAtTheRequestTimeout(self):
+        self.Open()
+        Started = time.time()
+        Response = self.Read(3, 0x0000, 2, Timeout=0.2)
+        Elapsed = time.time() - Started
+        self.assertEqual(Response.Counter, "Timeouts")
+        self.assertGreaterEqual(Elapsed, 0.2)
+        self.assertLess(Elapsed, 0.2 + 0.1)
+        self.assertFalse(self.Read(1, 0x0000, 2).isError())
+
+    def testCorruptedResponses(self):
+        self.Open(CrcErrors=1.0)
+        self.assertEqual(self.Read(1, 0x0000, 2).Counter, "CrcErrors")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# High-rate sampling: the sample buffers, their aggregation per update interval and the registers sampled.
+#
+
+import shutil
+import tempfile
+import unittest
+
+import support
+
+#ONE METER'S SNAPSHOT OF THE TIERS DUE
+def Snapshot(Due, Values, Slave=1):
+    return {"Time": 0, "Link": True, "Due": Due, "Meters": {Slave: {"Values": dict(Values), "Errors": [], "Offline": False}}}
+
+class SamplingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testSampleBufferKeepsTheLastSamples(self):
+        Buffer = self.Plugin.SampleBuffer(3)
+        self.assertIsNone(Buffer.Aggregate())
+        Buffer.Add(2.0)
+        Buffer.Add(4.0)
+        self.assertEqual(Buffer.Aggregate(), (2.0, 4.0, 3.0, 4.0, 2))
+        for value in (8.0, 1.0, 3.0):
+            Buffer.Add(value)
+        self.assertEqual(Buffer.Aggregate(), (1.0, 8.0, 4.0, 3.0, 3))
+        Buffer.Clear()
+        self.assertIsNone(Buffer.Aggregate())
+
+    def testOnlyTheCyclesOfTheSampleTierAreRecorded(self):
+        Plugin = self.Plugin
+        Interval = 60
+        Store = Plugin.SampleStore(int((Interval + Plugin._HEARTBEAT)/Plugin._TIER_PERIODS[Plugin._TIER_SAMPLE]) + 1)
+        # One update interval of cycles as the poller runs them: a power spike in the first sample, then the
+        # fast tier reading the power in between the samples as well
+        for Second in range(Interval):
+            Due = tuple(Tier for Tier in (Plugin._TIER_FAST, Plugin._TIER_SAMPLE) if Second % Plugin._TIER_PERIODS[Tier] == 0)
+            if Due:
+                Store.Record(Snapshot(Due, {0x0034: 9000.0 if Second == 0 else 1000.0, 0x0048: 1.0}))
+        Aggregates = Store.Aggregate(1)
+        self.assertEqual(list(Aggregates), [0x0034])
+        Min, Max, Mean, Last, Count = Aggregates[0x0034]
+        self.assertEqual((Min, Max, Last, Count), (1000.0, 9000.0, 1000.0, Interval//Plugin._TIER_PERIODS[Plugin._TIER_SAMPLE]))
+        self.assertEqual(Store.Aggregate(1), {})
+        self.assertEqual(Store.Aggregate(2), {})
+
+    def testSampledOnlyForStatisticsHistoryOrExport(self):
+        Plugin = self.Plugin
+        support.Domoticz.Image("SDM630MCT_v2.zip").Create()
+        Plugin.CreateDevices()
+        self.assertNotIn(Plugin._TIER_SAMPLE, Plugin.WantedRegisters())
+        self.assertIn(0x0034, Plugin.WantedRegisters(Sampled=True)[Plugin._TIER_SAMPLE])
+        support.Domoticz.Devices[Plugin._UNIT_TOTALSYSTEMPOWER_MAX].Used = 1
+        self.assertEqual(Plugin.WantedRegisters()[Plugin._TIER_SAMPLE], [0x0034])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Settings without a field on the hardware page, from settings.json in the plugin folder.
+#
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import support
+
+class SettingsFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def Write(self, Text):
+        with open(os.path.join(self.Home, "settings.json"), "w") as File:
+            File.write(Text)
+
+    def testWithoutTheFileTheDefaultsStay(self):
+        self.Plugin.LoadSettings()
+        self.assertFalse(self.Plugin._HISTORY)
+
+    def testSettingsOverrideTheirConstants(self):
+        self.Write(json.dumps({"History": True, "HistoryDays": 7}))
+        self.Plugin.LoadSettings()
+        self.assertTrue(self.Plugin._HISTORY)
+        self.assertEqual(self.Plugin._HISTORY_DAYS, 7)
+
+    def testExportSettings(self):
+        self.Write(json.dumps({"Export": "influx-http", "ExportHost": "10.0.0.2", "ExportPort": 8086, "ExportPath": "/write?db=home"}))
+        self.Plugin.LoadSettings()
+        Sink = self.Plugin.CreateSink(self.Plugin._EXPORT)
+        self.assertIsInstance(Sink, self.Plugin.InfluxHttpSink)
+        self.assertEqual((Sink.Host, Sink.Port, Sink.Path), ("10.0.0.2", 8086, "/write?db=home"))
+
+    def testReplaySettings(self):
+        self.Plugin.TraceWriter(os.path.join(self.Home, "sdm630.trace")).Close()
+        self.Write(json.dumps({"Replay": "sdm630.trace", "ReplayRealtime": True}))
+        self.Plugin.LoadSettings()
+        Link = self.Plugin.CreateLink(dict(support.Domoticz.Parameters, **support.GatewaySettings([1], 502)), 1, 8, "N")
+        self.assertIsInstance(Link, self.Plugin.ReplayLink)
+        self.assertEqual((Link.Port, Link.RealTime), (os.path.join(self.Home, "sdm630.trace"), True))
+
+    def testWrongSettingsAreIgnored(self):
+        self.Write(json.dumps({"History": "yes", "HistoryDays": 7, "Histroy": True}))
+        self.Plugin.LoadSettings()
+        self.assertFalse(self.Plugin._HISTORY)
+        self.assertEqual(self.Plugin._HISTORY_DAYS, 7)
+        self.Write("{\"History\": true,")
+        self.Plugin.LoadSettings()
+        self.Write("[]")
+        self.Plugin.LoadSettings()
+        self.assertFalse(self.Plugin._HISTORY)
+
+    def testTheToolsTakeNoSettings(self):
+        self.Write(json.dumps({"History": True}))
+        self.Plugin._SETTINGS = ""
+        self.Plugin.LoadSettings()
+        self.assertFalse(self.Plugin._HISTORY)
+
+if __name__ == "__main__":
+    unittest.main()
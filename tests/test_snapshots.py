@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Snapshots between the poller thread and the heartbeat.
+#
+
+import shutil
+import tempfile
+import unittest
+
+import support
+
+#ONE METER'S SNAPSHOT AT TIME
+def Snapshot(Time, Values, Errors=[], Slave=1):
+    return {"Time": Time, "Link": True, "Due": (0,), "Meters": {Slave: {"Values": dict(Values), "Errors": list(Errors), "Offline": False}}}
+
+class SnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        Registers = dict((Register.Address, Register) for Register in self.Plugin._REGISTERS)
+        Link = self.Plugin.ModbusLink("test", 9600, 1, 8, "N")
+        self.Poller = self.Plugin.ModbusPoller(Link, Registers, {0: 5}, {1: {}}, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testMergeKeepsTheNewerValuesAndErrors(self):
+        Merged = self.Plugin.MergeSnapshots(Snapshot(0, {0x0000: 230.0, 0x0006: 4.0}, [0x0034]), Snapshot(2, {0x0034: 1000.0}, [0x0000]))
+        Meter = Merged["Meters"][1]
+        self.assertEqual(Meter["Values"], {0x0006: 4.0, 0x0034: 1000.0})
+        self.assertEqual(Meter["Errors"], [0x0000])
+        self.assertEqual(Merged["Time"], 2)
+
+    def testLatestMergesInPollingOrder(self):
+        for Time in (0, 2, 4):
+            self.Poller.Publish(Snapshot(Time, {0x0000: 230.0 + Time}))
+        self.assertEqual(self.Poller.Latest()["Meters"][1]["Values"], {0x0000: 234.0})
+        self.assertIsNone(self.Poller.Latest())
+
+    def testAFullQueueDoesNotLetOlderSnapshotsWin(self):
+        # More cycles than _SNAPSHOT_QUEUE between two heartbeats: the oldest is folded into the next oldest
+        self.Poller.Publish(Snapshot(0, {0x0000: 230.0}, [0x0006]))
+        for Time in (2, 4, 6):
+            self.Poller.Publish(Snapshot(Time, {0x0000: 231.0 + Time, 0x0006: 5.0 + Time}))
+        self.Poller.Publish(Snapshot(7, {0x0034: 1000.0}))
+        Latest = self.Poller.Latest()["Meters"][1]
+        self.assertEqual(Latest["Values"], {0x0000: 237.0, 0x0006: 11.0, 0x0034: 1000.0})
+        self.assertEqual(Latest["Errors"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Recording the Modbus traffic to a trace and replaying it through the plugin (tools/replay.py).
+#
+
+import os
+import math
+import struct
+import shutil
+import tempfile
+import unittest
+
+import support
+import replay
+
+#ROWS OF tools/replay.py --values, KEPT IN A LIST
+class Rows(list):
+
+    def writerow(self, Row):
+        self.append(list(Row))
+
+class TraceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Trace = os.path.join(self.Home, "test.trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    #POLL THE SIMULATED METERS THROUGH A GATEWAY, RECORDING THE TRAFFIC: THE VALUES OF EVERY CYCLE AS REPLAY ROWS
+    def Record(self, Cycles):
+        Meters = support.GatewayMeters([1, 2], "tcp")
+        Recorded = Rows()
+        try:
+            Poller = Meters.Poller
+            Poller.Link.Trace = Meters.Plugin.TraceWriter(self.Trace)
+            for Cycle in range(Cycles):
+                Due = support.AllTiers(Poller) if Cycle % 3 == 0 else (Meters.Plugin._TIER_FAST,)
+                Snapshot = Poller.Poll(Due)
+                for Slave, Meter in sorted(Snapshot["Meters"].items()):
+                    for Address, value in sorted(Meter["Values"].items()):
+                        Recorded.writerow([Cycle + 1, "%.3f" % Snapshot["Time"], Slave, "0x%04X" % Address, value])
+        finally:
+            Meters.Stop()
+        return Recorded
+
+    #REPLAY THE TRACE AS tools/replay.py DOES: THE VALUES OF EVERY CYCLE
+    def Replay(self):
+        Plugin = support.LoadPlugin(self.Home, dict(support.GatewaySettings([1, 2], 0), SerialPort=self.Trace))
+        Plugin._REPLAY = self.Trace
+        Plugin.onStart()
+        Replayed = Rows()
+        try:
+            replay.Replay(Plugin, Replayed)
+        finally:
+            Plugin.onStop()
+        return Replayed
+
+    def testReplayGivesTheRecordedValues(self):
+        Recorded = self.Record(6)
+        self.assertTrue(Recorded)
+        self.assertEqual(self.Replay(), Recorded)
+
+    def testMatcherAnswersFromTheRecordedRegisters(self):
+        Plugin = support.LoadPlugin(self.Home)
+        Writer = Plugin.TraceWriter(self.Trace)
+        Writer.Cycle(100.0, (0,))
+        Request = Plugin.ModbusRequest(1, 0x0000, 4, 0.1)
+        Request.Elapsed = 0.02
+        Writer.Request(Request, Plugin.RegistersResponse(struct.pack(">ff", 230.5, 231.5)))
+        Request = Plugin.ModbusRequest(2, 0x0000, 2, 0.1)
+        Writer.Request(Request, Plugin.ErrorResponse("no response", "Timeouts"))
+        Writer.Close()
+
+        Link = Plugin.ReplayLink(self.Trace, 9600, 1, 8, "N")
+        Link.Open()
+        self.assertEqual(Link.NextCycle(), (100.0, (0,)))
+        # The same request as recorded, then another plan over the registers recorded in the cycle
+        Response = Link.Receive(Plugin.ModbusRequest(1, 0x0000, 4, 0.1))
+        self.assertEqual(struct.unpack(">ff", Response.Data), (230.5, 231.5))
+        Response = Link.Receive(Plugin.ModbusRequest(1, 0x0002, 2, 0.1))
+        self.assertEqual(struct.unpack(">f", Response.Data), (231.5,))
+        Known, Unknown = struct.unpack(">ff", Link.Receive(Plugin.ModbusRequest(1, 0x0002, 4, 0.1)).Data)
+        self.assertEqual(Known, 231.5)
+        self.assertTrue(math.isnan(Unknown))
+        self.assertEqual(Link.Receive(Plugin.ModbusRequest(1, 0x0100, 2, 0.1)).Counter, "Timeouts")
+        self.assertEqual(Link.Receive(Plugin.ModbusRequest(2, 0x0000, 2, 0.1)).Counter, "Timeouts")
+        self.assertIsNone(Link.NextCycle())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Device writes: the deadband and the write intervals of each tier.
+#
+
+import shutil
+import tempfile
+import unittest
+
+import support
+
+class WriteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Home = tempfile.mkdtemp()
+        self.Plugin = support.LoadPlugin(self.Home)
+        self.Registers = dict((Register.Address, Register) for Register in self.Plugin._REGISTERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.Home, ignore_errors=True)
+
+    def testWriteFilterDeadbandAndIntervals(self):
+        Register = self.Registers[0x0000]
+        MinInterval, MaxInterval = self.Plugin._WRITE_INTERVALS[Register.Tier]
+        Writes = self.Plugin.WriteFilter()
+        self.assertTrue(Writes.Due(1, 230.0, Register, 1000))
+        Writes.Wrote(1, 230.0, 1000)
+        self.assertFalse(Writes.Due(1, 250.0, Register, 1000 + MinInterval/2.0))
+        self.assertFalse(Writes.Due(1, 230.0, Register, 1000 + MinInterval))
+        self.assertTrue(Writes.Due(1, 250.0, Register, 1000 + MinInterval))
+        self.assertTrue(Writes.Due(1, 230.0, Register, 1000 + MaxInterval))
+        Writes.Forget(1)
+        self.assertTrue(Writes.Due(1, 230.0, Register, 1000))
+
+    def testValuesWithinTheDeadbandAreNotWritten(self):
+        support.Domoticz.Image("SDM630MCT_v2.zip").Create()
+        self.Plugin.CreateDevices()
+        Writes = self.Plugin.WriteFilter()
+        Meter = {"Values": {0x0034: 1000.0}, "Errors": [], "Offline": False}
+        Before = support.Domoticz.Updates
+        self.Plugin.UpdateDevices(Meter, self.Registers, Writes)
+        self.Plugin.UpdateDevices(dict(Meter, Values={0x0034: 1001.0}), self.Registers, Writes)
+        self.assertEqual(support.Domoticz.Updates - Before, 1)
+        self.assertEqual(support.Domoticz.Devices[self.Plugin._UNIT_TOTALSYSTEMPOWER].sValue, "1000.0000")
+        self.Plugin.UpdateDevices(dict(Meter, Values={0x0034: 1100.0}), self.Registers, Writes)
+        self.assertEqual(support.Domoticz.Devices[self.Plugin._UNIT_TOTALSYSTEMPOWER].sValue, "1100.0000")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Stand-in for the Domoticz Python plugin API, to run plugin.py without Domoticz.
+#
+# Only what the plugin uses is provided: logging, Device, Image and the Parameters, Devices and
+# Images dictionaries that Domoticz injects into the plugin module. Load() imports plugin.py the
+# way Domoticz does; device writes are counted in Updates.
+#
+
+import os
+import sys
+import time
+import zipfile
+import importlib.util
+
+#DICTIONARIES SHARED WITH THE LOADED PLUGIN
+Parameters = {}
+Devices = {}
+Images = {}
+
+#NUMBER OF Device.Update() CALLS (DATABASE WRITES IN DOMOTICZ)
+Updates = 0
+
+#LOGGING: DEBUG MESSAGES ARE ONLY SHOWN WHEN THE PLUGIN ENABLES DEBUGGING, EVERYTHING CAN BE SILENCED
+Quiet = False
+_Debugging = 0
+
+def Debugging(Level):
+    global _Debugging
+    _Debugging = Level
+
+def Debug(Message):
+    if _Debugging and not Quiet:
+        print(time.strftime("%H:%M:%S") + " (debug) " + Message)
+
+def Log(Message):
+    if not Quiet:
+        print(time.strftime("%H:%M:%S") + " " + Message)
+
+def Status(Message):
+    Log(Message)
+
+def Error(Message):
+    if not Quiet:
+        print(time.strftime("%H:%M:%S") + " Error: " + Message, file=sys.stderr)
+
+def Heartbeat(Seconds):
+    pass
+
+#DEVICE
+class Device:
+
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0, Options={}, Used=0, DeviceID=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = Options
+        self.Used = Used
+        self.DeviceID = DeviceID
+        self.ID = 0
+        self.nValue = 0
+        self.sValue = ""
+        self.TimedOut = 0
+        self.LastLevel = 0
+        self.LastUpdate = ""
+
+    def __str__(self):
+        return "Unit: " + str(self.Unit) + ", Name: '" + self.Name + "', nValue: " + str(self.nValue) + ", sValue: '" + self.sValue + "'"
+
+    def Create(self):
+        self.ID = 1000 + self.Unit
+        Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, Image=None, TimedOut=0, **Other):
+        global Updates
+        Updates += 1
+        self.nValue = nValue
+        self.sValue = sValue
+        self.TimedOut = TimedOut
+        if Image is not None:
+            self.Image = Image
+        self.LastUpdate = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def Delete(self):
+        Devices.pop(self.Unit, None)
+
+#IMAGE (ICON PACK): THE KEYS ARE READ FROM icons.txt IN THE ZIP, AS DOMOTICZ DOES
+class _Image:
+
+    def __init__(self, ID, Name):
+        self.ID = ID
+        self.Name = Name
+        self.Base = Name
+
+class Image:
+
+    def __init__(self, Filename):
+        self.Filename = Filename
+
+    def Create(self):
+        with zipfile.ZipFile(os.path.join(Parameters.get("HomeFolder", ""), self.Filename)) as Pack:
+            for Line in Pack.read("icons.txt").decode("utf-8").splitlines():
+                if Line.strip() != "":
+                    Key = Line.split(";")[0]
+                    Images[Key] = _Image(100 + len(Images), Key)
+
+#IMPORT plugin.py AS DOMOTICZ DOES: A FRESH MODULE WITH Parameters, Devices AND Images INJECTED
+#Settings are the hardware parameters (SerialPort, Mode1...Mode6, HardwareID).
+def Load(PluginPath, Settings):
+    global Updates
+    Parameters.clear()
+    Devices.clear()
+    Images.clear()
+    Updates = 0
+    Parameters["HomeFolder"] = os.path.dirname(os.path.abspath(PluginPath)) + os.sep
+    Parameters["HardwareID"] = 1
+    Parameters.update(Settings)
+    sys.modules["Domoticz"] = sys.modules[__name__]
+    Spec = importlib.util.spec_from_file_location("plugin", PluginPath)
+    Plugin = importlib.util.module_from_spec(Spec)
+    Plugin.Parameters = Parameters
+    Plugin.Devices = Devices
+    Plugin.Images = Images
+    Spec.loader.exec_module(Plugin)
+    return Plugin
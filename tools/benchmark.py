@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Poll-cycle benchmark of plugin.py against the simulated SDM630 (tools/simulator.py),
+# with the Domoticz stand-in (tools/Domoticz.py) instead of a running Domoticz.
+#
+# For every baudrate of the plugin settings it runs full cycles (all polling tiers due) and fast
+# cycles (power and current only), and reports per cycle: the poll latency, the Modbus requests and
+# bytes on the wire, the device updates (Domoticz database writes) and the values that failed.
+# With --gateway the simulated bus is reached through a local TCP gateway (Modbus TCP or RTU over TCP).
+# With --trace the Modbus traffic is recorded to a trace file for tools/replay.py.
+# Needs the plugin's own dependency (pyserial).
+#
+#   python3 tools/benchmark.py --cycles 10 --slaves 1,2 --timeouts 0.05
+#   python3 tools/benchmark.py --cycles 10 --slaves 1,2,3 --gateway tcp
+#   python3 tools/benchmark.py --cycles 20 --slaves 1,2 --baudrates 9600 --trace /tmp/sdm630.trace
+#
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Domoticz
+from simulator import Simulator, Gateway
+
+_PLUGIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugin.py")
+
+#BAUDRATES OFFERED IN THE PLUGIN SETTINGS (Mode2)
+def BaudRates(Plugin):
+    Options = re.search(r'field="Mode2".*?</param>', Plugin.__doc__, re.S).group(0)
+    return [int(value) for value in re.findall(r'value="(\d+)"', Options)]
+
+#RUN THE CYCLES AT ONE BAUDRATE: RETURNS {CASE: [(LATENCY, FRAMES, BYTES, UPDATES, ERRORS) PER CYCLE]}
+def Run(BaudRate, Slaves, Cycles, Timeouts, CrcErrors, Framing=None, Trace=""):
+    Sim = Simulator(Slaves, BaudRate, Timeouts=Timeouts, CrcErrors=CrcErrors, Seed=BaudRate)
+    Settings = {"SerialPort": Sim.Port, "Mode1": ",".join(str(Slave) for Slave in Slaves), "Mode2": str(BaudRate),
+                "Mode3": "S1B8PN", "Mode4": "0", "Mode5": "0", "Mode6": "Normal"}
+    if Framing:
+        Server = Gateway(Sim, Framing)
+        Server.start()
+        Settings.update({"Mode3": {"tcp": "TCP", "rtu": "RTUTCP"}[Framing], "Address": "127.0.0.1", "Port": str(Server.Port)})
+    else:
+        Sim.start()
+    Plugin = Domoticz.Load(_PLUGIN, Settings)
+    Plugin._SETTINGS = ""
+    Plugin._TRACE = Trace
+    Plugin.onStart()
+
+    # The benchmark drives the poll cycles itself instead of the background thread
+    Poller = Plugin._plugin.Poller
+    Poller.Stop()
+    if not Poller.Link.Open():
+        Failure = Poller.Link.Kind + " on " + Poller.Link.Port + " could not be opened" + ("" if Framing else " (is pyserial installed?)")
+    else:
+        Failure = None
+    Cases = [("all tiers", tuple(sorted(Poller.Periods))), ("fast tier", (Plugin._TIER_FAST,))]
+    Results = {}
+    for Case, Due in Cases:
+        Results[Case] = []
+        for Cycle in range(Cycles if Failure is None else 0):
+            Sim.ResetCounters()
+            Updates = Domoticz.Updates
+            Started = time.time()
+            Snapshot = Poller.Poll(Due)
+            Latency = time.time() - Started
+            if not Snapshot["Link"]:
+                Failure = Poller.Link.Kind + " on " + Poller.Link.Port + " failed during the benchmark"
+                break
+            Poller.Publish(Snapshot)
+            Plugin.onHeartbeat()
+            Errors = sum(len(Meter["Errors"]) for Meter in Snapshot["Meters"].values())
+            Results[Case].append((Latency, Sim.Frames, Sim.BytesIn + Sim.BytesOut, Domoticz.Updates - Updates, Errors))
+    Plugin.onStop()
+    Poller.Link.Close()
+    if Framing:
+        Server.Stop()
+    Sim.Stop()
+    if Failure is not None:
+        raise IOError(Failure)
+    return Results
+
+def Main():
+    Parser = argparse.ArgumentParser(description="Poll-cycle benchmark of the SDM630 plugin against a simulated meter.")
+    Parser.add_argument("--cycles", type=int, default=5, help="cycles per baudrate and case")
+    Parser.add_argument("--slaves", default="1", help="comma separated slave IDs of the simulated meters")
+    Parser.add_argument("--baudrates", default="", help="comma separated baudrates (default: all of the plugin settings)")
+    Parser.add_argument("--timeouts", type=float, default=0.0, help="probability that a request is not answered")
+    Parser.add_argument("--crc-errors", type=float, default=0.0, help="probability that a response has a bad CRC")
+    Parser.add_argument("--gateway", choices=["tcp", "rtu"], default=None, help="reach the meters through a TCP gateway: Modbus TCP or RTU over TCP")
+    Parser.add_argument("--trace", default="", help="record the Modbus traffic to this trace file (appended per baudrate)")
+    Arguments = Parser.parse_args()
+
+    Domoticz.Quiet = True
+    Slaves = [int(Slave) for Slave in Arguments.slaves.split(",")]
+    if Arguments.baudrates:
+        Rates = [int(Rate) for Rate in Arguments.baudrates.split(",")]
+    else:
+        Rates = BaudRates(Domoticz.Load(_PLUGIN, {}))
+
+    print("%-8s %-10s %12s %12s %10s %10s %10s %8s" % ("Baud", "Cycle", "Mean (ms)", "Max (ms)", "Requests", "Bytes", "Updates", "Errors"))
+    for Rate in Rates:
+        try:
+            Results = Run(Rate, Slaves, Arguments.cycles, Arguments.timeouts, Arguments.crc_errors, Arguments.gateway,
+                          os.path.abspath(Arguments.trace) if Arguments.trace else "")
+        except IOError as Error:
+            sys.exit("Benchmark at %d baud stopped: %s" % (Rate, Error))
+        for Case, Cycles in sorted(Results.items()):
+            Count = float(len(Cycles))
+            print("%-8d %-10s %12.1f %12.1f %10.1f %10.1f %10.1f %8.1f" % (Rate, Case,
+                1000*sum(Cycle[0] for Cycle in Cycles)/Count, 1000*max(Cycle[0] for Cycle in Cycles),
+                sum(Cycle[1] for Cycle in Cycles)/Count, sum(Cycle[2] for Cycle in Cycles)/Count,
+                sum(Cycle[3] for Cycle in Cycles)/Count, sum(Cycle[4] for Cycle in Cycles)/Count))
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Query and export the history store of plugin.py (_HISTORY = True), without Domoticz.
+#
+# Prints the day files with their size, or exports a time range to CSV: one row per poll cycle and
+# meter, one column per register. The store is read with the functions of plugin.py.
+#
+#   python3 tools/history.py --list
+#   python3 tools/history.py --from "2026-10-18 08:00" --to "2026-10-18 09:00" --slave 1 --csv morning.csv
+#
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Domoticz
+
+_PLUGIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugin.py")
+
+#"YYYY-MM-DD" OR "YYYY-MM-DD HH:MM[:SS]" (LOCAL TIME) TO SECONDS
+def ParseTime(Text):
+    for Format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(Text, Format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("invalid time '" + Text + "'")
+
+def Main():
+    Parser = argparse.ArgumentParser(description="Query and export the history store of the SDM630 plugin.")
+    Parser.add_argument("--folder", default=None, help="history folder (default: the one of the plugin)")
+    Parser.add_argument("--list", action="store_true", help="list the day files")
+    Parser.add_argument("--from", dest="start", type=ParseTime, help="start of the range (local time)")
+    Parser.add_argument("--to", dest="end", type=ParseTime, help="end of the range (local time, default now)")
+    Parser.add_argument("--slave", type=int, default=None, help="only this slave ID")
+    Parser.add_argument("--registers", default="", help="comma separated register addresses (e.g. 0x0034,0x0006)")
+    Parser.add_argument("--csv", default="-", help="output file (default: standard output)")
+    Arguments = Parser.parse_args()
+
+    Domoticz.Quiet = True
+    Plugin = Domoticz.Load(_PLUGIN, {})
+    Folder = Arguments.folder or os.path.join(os.path.dirname(_PLUGIN), Plugin._HISTORY_FOLDER)
+    if not os.path.isdir(Folder):
+        Parser.error("no history folder " + Folder)
+
+    if Arguments.list or Arguments.start is None:
+        for Day, Path in Plugin.HistoryFiles(Folder):
+            print("%s %10.1f MB  %s" % (Day, os.path.getsize(Path)/1048576.0, Path))
+        return
+
+    End = Arguments.end if Arguments.end is not None else time.time()
+    Addresses = [int(Address, 0) for Address in Arguments.registers.split(",") if Address.strip() != ""]
+    Count = Plugin.ExportHistory(Folder, Arguments.start, End, "/dev/stdout" if Arguments.csv == "-" else Arguments.csv, Arguments.slave, Addresses)
+    print("%d rows exported." % Count, file=sys.stderr)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Replay a trace of plugin.py through the plugin, with the Domoticz stand-in (tools/Domoticz.py)
+# instead of a running Domoticz and the trace instead of the meters.
+#
+# Every recorded poll cycle is polled, decoded, derived and written to the devices again, so a change to the
+# plugin can be checked against real traffic: --values writes the values of every cycle to CSV to compare two
+# versions, --profile shows where the time goes. By default the replay runs as fast as possible and reports the
+# processing time per cycle; --realtime replays with the recorded timing. Records a trace with
+# tools/benchmark.py --trace, or on a real bus by setting Trace in settings.json in the plugin folder.
+#
+#   python3 tools/replay.py /tmp/sdm630.trace
+#   python3 tools/replay.py /tmp/sdm630.trace --values before.csv
+#   python3 tools/replay.py /tmp/sdm630.trace --profile 20
+#
+
+import os
+import sys
+import csv
+import time
+import argparse
+import cProfile
+import pstats
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Domoticz
+
+_PLUGIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugin.py")
+
+#SLAVE IDS OF THE REQUESTS IN A TRACE
+def TraceSlaves(Plugin, Path):
+    return sorted(set(bytearray(Record[3])[0] for Record in Plugin.ReadTrace(Path) if Record[2] != Plugin._TRACE_CYCLE and Record[3]))
+
+#REPLAY ALL CYCLES: RETURNS [(CPU SECONDS, REQUESTS, UPDATES, ERRORS) PER CYCLE]
+def Replay(Plugin, Writer=None):
+    # The replay drives the poll cycles itself, from the start of the trace and with a fresh poller
+    Poller = Plugin._plugin.Poller
+    Poller.Stop()
+    Poller = Plugin.ModbusPoller(Poller.Link, Poller.Registers, Poller.Periods, Poller.Wanted, Poller.Metrics, Poller.Sinks)
+    Plugin._plugin.Poller = Poller
+    Poller.Link.Rewind()
+    Poller.Link.Open()
+    Results = []
+    while True:
+        Cycle = Poller.Link.NextCycle()
+        if Cycle is None:
+            break
+        Time, Due = Cycle
+        Requests, Updates = Poller.Metrics.Requests, Domoticz.Updates
+        Started = time.process_time()
+        Snapshot = Poller.Poll(Due)
+        for Sink in Poller.Sinks:
+            Sink.Record(Snapshot)
+        Poller.Publish(Snapshot)
+        Plugin.onHeartbeat()
+        Results.append((time.process_time() - Started, Poller.Metrics.Requests - Requests, Domoticz.Updates - Updates,
+                        sum(len(Meter["Errors"]) for Meter in Snapshot["Meters"].values())))
+        if Writer is not None:
+            for Slave, Meter in sorted(Snapshot["Meters"].items()):
+                for Address, value in sorted(Meter["Values"].items()):
+                    Writer.writerow([len(Results), "%.3f" % Time, Slave, "0x%04X" % Address, value])
+    Poller.Link.Close()
+    return Results
+
+def Main():
+    Parser = argparse.ArgumentParser(description="Replay a Modbus trace through the SDM630 plugin.")
+    Parser.add_argument("trace", help="trace file recorded with the Trace setting or tools/benchmark.py --trace")
+    Parser.add_argument("--realtime", action="store_true", help="replay with the recorded timing")
+    Parser.add_argument("--values", default="", help="write the values of every cycle to this CSV file")
+    Parser.add_argument("--profile", type=int, default=0, help="profile the replay and print this many functions")
+    Arguments = Parser.parse_args()
+
+    Domoticz.Quiet = True
+    Path = os.path.abspath(Arguments.trace)
+    Slaves = TraceSlaves(Domoticz.Load(_PLUGIN, {}), Path)
+    if not Slaves:
+        sys.exit(Path + " holds no requests")
+    Settings = {"SerialPort": Path, "Mode1": ",".join(str(Slave) for Slave in Slaves), "Mode2": "9600",
+                "Mode3": "S1B8PN", "Mode4": "0", "Mode5": "0", "Mode6": "Normal"}
+    Plugin = Domoticz.Load(_PLUGIN, Settings)
+    Plugin._SETTINGS = ""
+    Plugin._REPLAY = Path
+    Plugin._REPLAY_REALTIME = Arguments.realtime
+    Plugin.onStart()
+
+    Output = open(Arguments.values, "w", newline="") if Arguments.values else None
+    Writer = csv.writer(Output) if Output else None
+    if Writer is not None:
+        Writer.writerow(["Cycle", "Time", "Slave", "Register", "Value"])
+    Profile = cProfile.Profile() if Arguments.profile else None
+    Started = time.time()
+    if Profile is not None:
+        Profile.enable()
+    Results = Replay(Plugin, Writer)
+    if Profile is not None:
+        Profile.disable()
+    Elapsed = time.time() - Started
+    Plugin.onStop()
+    if Output is not None:
+        Output.close()
+
+    Count = float(max(len(Results), 1))
+    print("%d cycles of slaves %s in %.2f s" % (len(Results), Settings["Mode1"], Elapsed))
+    print("%-14s %12s %12s %10s %10s %8s" % ("", "Mean (ms)", "Max (ms)", "Requests", "Updates", "Errors"))
+    print("%-14s %12.2f %12.2f %10.1f %10.1f %8.1f" % ("CPU per cycle",
+        1000*sum(Cycle[0] for Cycle in Results)/Count, 1000*max([Cycle[0] for Cycle in Results] or [0]),
+        sum(Cycle[1] for Cycle in Results)/Count, sum(Cycle[2] for Cycle in Results)/Count, sum(Cycle[3] for Cycle in Results)/Count))
+    if Profile is not None:
+        pstats.Stats(Profile).sort_stats("cumulative").print_stats(Arguments.profile)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Simulated Eastron SDM630-MCT Modbus RTU slave(s) on a pseudo terminal.
+#
+# The plugin opens Simulator.Port as if it was the USB-RS485 dongle. The simulator answers function 04
+# (read input registers) for its slave IDs with realistic SDM630 values, and waits as long as the
+# request and the response would take on the wire at the configured baudrate, plus the turnaround
+# time of the meter. Timeouts (no answer) and CRC errors can be injected with a probability.
+#
+# Gateway puts the simulated bus behind a TCP port, as an RS485 gateway does: Modbus TCP (MBAP frames, several
+# requests may be in flight, answered one after the other) or RTU frames over TCP.
+#
+# Run standalone to get a serial port (or a gateway port) for a plugin running in Domoticz:
+#   python3 tools/simulator.py --baudrate 9600 --slaves 1,2
+#   python3 tools/simulator.py --baudrate 9600 --slaves 1,2 --gateway tcp --port 5020
+#
+
+import os
+import sys
+import tty
+import time
+import struct
+import random
+import select
+import socket
+import argparse
+import threading
+
+#SDM630 INPUT REGISTERS WITH A VALUE (32 BIT FLOATS); ALL OTHER REGISTERS UP TO _REGISTERS READ AS 0
+_REGISTERS = 0x0600
+_VALUES = {
+    0x0000: 231.2, 0x0002: 229.8, 0x0004: 230.5,        # Voltage L1-L3 (V)
+    0x0006: 4.21, 0x0008: 1.73, 0x000A: 2.96,           # Current L1-L3 (A)
+    0x000C: 952.0, 0x000E: 371.0, 0x0010: 655.0,        # Active power L1-L3 (W)
+    0x0012: 973.4, 0x0014: 397.5, 0x0016: 682.3,        # Apparent power L1-L3 (VA)
+    0x0018: 203.1, 0x001A: -142.6, 0x001C: 191.9,       # Reactive power L1-L3 (VAr)
+    0x001E: 0.978, 0x0020: 0.933, 0x0022: 0.960,        # Power factor L1-L3
+    0x002A: 230.5, 0x002E: 2.97, 0x0030: 8.90,          # Average volts, average current, sum of currents
+    0x0034: 1978.0, 0x0038: 2053.2, 0x003C: 252.4,      # Total power (W), VA, VAr
+    0x003E: 0.963, 0x0046: 50.01,                       # Total power factor, frequency (Hz)
+    0x0048: 10234.56, 0x004A: 1523.11,                  # Import, export energy (kWh)
+    0x00C8: 399.1, 0x00CA: 398.2, 0x00CC: 399.9,        # Line to line volts (V)
+    0x00CE: 399.1, 0x00E0: 1.12,                        # Average line to line volts, neutral current
+    0x0156: 11757.67, 0x0158: 2210.45,                  # Total active (kWh), reactive energy (kVArh)
+    0x0180: 311.02, 0x0184: 270.44, 0x0186: 40.58,      # Resettable energy (kWh)
+    0x018C: 8711.45,                                    # Net kWh
+    0x0500: 10234.56, 0x0502: 1523.11,                  # Total import, export active energy (kWh)
+}
+_COUNTERS = (0x0048, 0x004A, 0x0156, 0x0158, 0x0180, 0x0184, 0x0186, 0x018C, 0x0500, 0x0502)
+
+#PROTOCOL
+_MAX_REGISTERS = 80
+_TURNAROUND = 0.020     # Seconds between the end of the request and the start of the response
+
+#CRC16 (MODBUS)
+def Crc16(Data):
+    Crc = 0xFFFF
+    for Byte in bytearray(Data):
+        Crc ^= Byte
+        for Bit in range(8):
+            Crc = (Crc >> 1) ^ 0xA001 if Crc & 1 else Crc >> 1
+    return struct.pack("<H", Crc)
+
+#SECONDS TO SEND ONE CHARACTER: START BIT, DATA BITS, PARITY BIT, STOP BITS
+def CharTime(BaudRate, ByteSize=8, Parity="N", StopBits=1):
+    return (1 + ByteSize + (0 if Parity == "N" else 1) + StopBits) / float(BaudRate)
+
+class Simulator(threading.Thread):
+
+    def __init__(self, Slaves=[1], BaudRate=9600, Parity="N", StopBits=1, Turnaround=_TURNAROUND, Timeouts=0.0, CrcErrors=0.0, Noise=0.01, Seed=None):
+        threading.Thread.__init__(self, name="SDM630-Simulator")
+        self.daemon = True
+        self.Slaves = list(Slaves)
+        self.CharTime = CharTime(BaudRate, 8, Parity, StopBits)
+        self.Turnaround = Turnaround
+        self.Timeouts = Timeouts
+        self.CrcErrors = CrcErrors
+        self.Noise = Noise
+        self.Random = random.Random(Seed)
+        self.Memory = dict((Slave, bytearray(2*_REGISTERS)) for Slave in self.Slaves)
+        for Slave in self.Slaves:
+            for Address, value in _VALUES.items():
+                self.SetValue(Slave, Address, value)
+        self.Master, self.Slave = os.openpty()
+        tty.setraw(self.Master)
+        tty.setraw(self.Slave)
+        self.Port = os.ttyname(self.Slave)
+        self.Stopping = threading.Event()
+        self.ResetCounters()
+
+    def ResetCounters(self):
+        self.Frames = 0         # Requests received
+        self.BytesIn = 0        # Request bytes received
+        self.BytesOut = 0       # Response bytes sent
+        self.Dropped = 0        # Requests not answered (injected timeouts, other slave IDs, bad requests)
+        self.Corrupted = 0      # Responses sent with a bad CRC
+
+    def SetValue(self, Slave, Address, value):
+        struct.pack_into(">f", self.Memory[Slave], 2*Address, value)
+
+    def GetValue(self, Slave, Address):
+        return struct.unpack_from(">f", self.Memory[Slave], 2*Address)[0]
+
+    def Stop(self):
+        self.Stopping.set()
+        if self.is_alive():
+            self.join(2)
+        for Fd in (self.Master, self.Slave):
+            try:
+                os.close(Fd)
+            except OSError:
+                pass
+
+    #READ REQUESTS FROM THE BUS; AN RTU FRAME ENDS WITH 3.5 CHARACTERS OF SILENCE
+    def run(self):
+        Frame = b""
+        Silence = max(3.5*self.CharTime, 0.002)
+        while not self.Stopping.is_set():
+            Ready = select.select([self.Master], [], [], Silence if Frame else 0.1)[0]
+            if Ready:
+                try:
+                    Frame += os.read(self.Master, 256)
+                except OSError:
+                    return
+            elif Frame:
+                self.Answer(Frame)
+                Frame = b""
+
+    def Answer(self, Request):
+        Response = self.Serve(Request)
+        if Response is not None:
+            os.write(self.Master, Response)
+
+    #ONE RTU REQUEST ON THE BUS: THE RESPONSE FRAME WHEN IT WOULD HAVE BEEN RECEIVED, OR NONE
+    def Serve(self, Request):
+        self.Frames += 1
+        self.BytesIn += len(Request)
+        Started = time.time()
+        Response = self.Respond(Request)
+        if Response is None or self.Random.random() < self.Timeouts:
+            self.Dropped += 1
+            time.sleep(len(Request)*self.CharTime)
+            return None
+        if self.Random.random() < self.CrcErrors:
+            Response = Response[:-2] + bytes(bytearray([Response[-2] ^ 0xFF, Response[-1]]))
+            self.Corrupted += 1
+        # The request was on the wire for len(Request) characters, the response takes len(Response)
+        Delay = (len(Request) + len(Response))*self.CharTime + self.Turnaround - (time.time() - Started)
+        if Delay > 0:
+            time.sleep(Delay)
+        self.BytesOut += len(Response)
+        return Response
+
+    #MODBUS RESPONSE TO A REQUEST, OR NONE WHEN A REAL METER WOULD STAY SILENT
+    def Respond(self, Request):
+        if len(Request) != 8 or Crc16(Request[:-2]) != Request[-2:]:
+            return None
+        Slave, Function, Address, Count = struct.unpack(">BBHH", Request[:6])
+        if Slave not in self.Slaves:
+            return None
+        if Function != 0x04:
+            return self.Exception(Slave, Function, 0x01)
+        if Count < 1 or Count > _MAX_REGISTERS:
+            return self.Exception(Slave, Function, 0x03)
+        if Address + Count > _REGISTERS:
+            return self.Exception(Slave, Function, 0x02)
+        self.Drift(Slave)
+        Data = bytes(self.Memory[Slave][2*Address:2*(Address+Count)])
+        Response = struct.pack(">BBB", Slave, Function, len(Data)) + Data
+        return Response + Crc16(Response)
+
+    def Exception(self, Slave, Function, Code):
+        Response = struct.pack(">BBB", Slave, Function | 0x80, Code)
+        return Response + Crc16(Response)
+
+    #MOVE THE INSTANTANEOUS VALUES AROUND THEIR NOMINAL VALUE AND MAKE THE COUNTERS GROW
+    def Drift(self, Slave):
+        if not self.Noise:
+            return
+        for Address, value in _VALUES.items():
+            if Address in _COUNTERS:
+                self.SetValue(Slave, Address, self.GetValue(Slave, Address) + self.Random.random()*0.001)
+            else:
+                self.SetValue(Slave, Address, value*(1 + self.Random.uniform(-self.Noise, self.Noise)))
+
+#TCP GATEWAY IN FRONT OF A SIMULATOR: "tcp" (MODBUS TCP) OR "rtu" (RTU FRAMES OVER TCP)
+#The bus is shared by all connections and serves one request at a time, like the RS485 side of a gateway.
+#An unanswered Modbus TCP request gets no response either (no gateway exception), like most cheap gateways.
+class Gateway(threading.Thread):
+
+    def __init__(self, Simulator, Framing="tcp", Port=0):
+        threading.Thread.__init__(self, name="SDM630-Gateway")
+        self.daemon = True
+        self.Simulator = Simulator
+        self.Framing = Framing
+        self.Bus = threading.Lock()
+        self.Server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.Server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Server.bind(("127.0.0.1", Port))
+        self.Server.listen(4)
+        self.Port = self.Server.getsockname()[1]
+        self.Connections = 0
+        self.Clients = set()
+        self.Stopping = threading.Event()
+
+    def Stop(self):
+        self.Stopping.set()
+        self.Server.close()
+        self.join(2)
+
+    #CLOSE THE OPEN CONNECTIONS FROM THE GATEWAY SIDE, AS A GATEWAY DROPPING IDLE CLIENTS DOES
+    def Drop(self):
+        for Connection in list(self.Clients):
+            try:
+                Connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self):
+        while not self.Stopping.is_set():
+            try:
+                Connection = self.Server.accept()[0]
+            except OSError:
+                return
+            self.Connections += 1
+            threading.Thread(target=self.Handle, args=(Connection,), daemon=True).start()
+
+    #SERVE ONE CONNECTION UNTIL THE CLIENT CLOSES IT
+    def Handle(self, Connection):
+        self.Clients.add(Connection)
+        Buffer = b""
+        try:
+            while not self.Stopping.is_set():
+                Data = Connection.recv(4096)
+                if not Data:
+                    return
+                Buffer += Data
+                while True:
+                    Length = self.FrameLength(Buffer)
+                    if Length is None or len(Buffer) < Length:
+                        break
+                    Frame, Buffer = Buffer[:Length], Buffer[Length:]
+                    Response = self.Forward(Frame)
+                    if Response is not None:
+                        Connection.sendall(Response)
+        except OSError:
+            pass
+        finally:
+            self.Clients.discard(Connection)
+            Connection.close()
+
+    #LENGTH OF THE REQUEST AT THE START OF THE BUFFER, NONE WHEN NOT KNOWN YET
+    def FrameLength(self, Buffer):
+        if self.Framing == "rtu":
+            return 8
+        if len(Buffer) < 6:
+            return None
+        return 6 + struct.unpack(">H", Buffer[4:6])[0]
+
+    #PASS A REQUEST TO THE BUS AND THE ANSWER BACK IN THE FRAMING OF THE CONNECTION
+    def Forward(self, Frame):
+        if self.Framing == "rtu":
+            with self.Bus:
+                return self.Simulator.Serve(Frame)
+        Transaction, Protocol, Length, Slave = struct.unpack(">HHHB", Frame[:7])
+        Request = Frame[6:]
+        with self.Bus:
+            Response = self.Simulator.Serve(Request + Crc16(Request))
+        if Response is None or Crc16(Response[:-2]) != Response[-2:]:
+            return None
+        Pdu = Response[:-2]
+        return struct.pack(">HHH", Transaction, Protocol, len(Pdu)) + Pdu
+
+def Main():
+    Parser = argparse.ArgumentParser(description="Simulated SDM630-MCT Modbus RTU meter(s) on a pseudo terminal.")
+    Parser.add_argument("--baudrate", type=int, default=9600)
+    Parser.add_argument("--slaves", default="1", help="comma separated slave IDs")
+    Parser.add_argument("--timeouts", type=float, default=0.0, help="probability that a request is not answered")
+    Parser.add_argument("--crc-errors", type=float, default=0.0, help="probability that a response has a bad CRC")
+    Parser.add_argument("--gateway", choices=["tcp", "rtu"], default=None, help="serve the bus on a TCP port: Modbus TCP or RTU over TCP")
+    Parser.add_argument("--port", type=int, default=5020, help="TCP port of the gateway")
+    Arguments = Parser.parse_args()
+    Sim = Simulator([int(Slave) for Slave in Arguments.slaves.split(",")], Arguments.baudrate, Timeouts=Arguments.timeouts, CrcErrors=Arguments.crc_errors)
+    if Arguments.gateway:
+        Server = Gateway(Sim, Arguments.gateway, Arguments.port)
+        Server.start()
+        print("SDM630 simulator behind a " + Arguments.gateway + " gateway on 127.0.0.1:" + str(Server.Port) + " (" + str(Arguments.baudrate) + " baud, slaves " + Arguments.slaves + "), Ctrl-C to stop.")
+    else:
+        Sim.start()
+        print("SDM630 simulator on " + Sim.Port + " (" + str(Arguments.baudrate) + " baud, slaves " + Arguments.slaves + "), Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(10)
+            print("%d requests, %d bytes in, %d bytes out, %d dropped, %d corrupted" % (Sim.Frames, Sim.BytesIn, Sim.BytesOut, Sim.Dropped, Sim.Corrupted))
+    except KeyboardInterrupt:
+        if Arguments.gateway:
+            Server.Stop()
+        Sim.Stop()
+
+if __name__ == "__main__":
+    Main()
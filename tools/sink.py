@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Stand-in for the export sinks of plugin.py (_EXPORT): prints what the plugin sends.
+#
+#   mqtt         a minimal MQTT broker: accepts the connection and prints topic and payload of every PUBLISH
+#   influx-http  an InfluxDB write endpoint: answers 204 and prints the lines of every POST (400 for a nan or inf field,
+#                as InfluxDB does)
+#   influx-udp   an InfluxDB UDP listener: prints the lines of every datagram
+#
+#   python3 tools/sink.py mqtt --port 1883
+#   python3 tools/sink.py influx-http --port 8086 --fail 3     # answer the first 3 writes with 503
+#
+
+import re
+import sys
+import socket
+import struct
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+#WHAT CAME IN: [(KIND, TOPIC OR PATH, PAYLOAD)], FOR TESTS THAT RUN THE SINK IN A THREAD
+class Sink:
+
+    def __init__(self, Kind, Port=0, Fail=0, Quiet=False):
+        self.Kind = Kind
+        self.Fail = Fail
+        self.Quiet = Quiet
+        self.Received = []
+        self.Lock = threading.Lock()
+        if Kind == "influx-http":
+            Owner = self
+            class Handler(BaseHTTPRequestHandler):
+                protocol_version = "HTTP/1.1"
+                def do_POST(self):
+                    Body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    Status = 503 if Owner.Failing() else 400 if re.search(rb"=-?(nan|inf)\b", Body) else 204
+                    if Status == 204:
+                        Owner.Add(self.path, Body)
+                    self.send_response(Status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                def log_message(self, *Arguments):
+                    pass
+            self.Server = HTTPServer(("127.0.0.1", Port), Handler)
+            self.Port = self.Server.server_address[1]
+        else:
+            self.Server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if Kind == "influx-udp" else socket.SOCK_STREAM)
+            self.Server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.Server.bind(("127.0.0.1", Port))
+            if Kind == "mqtt":
+                self.Server.listen(4)
+            self.Port = self.Server.getsockname()[1]
+
+    def Failing(self):
+        with self.Lock:
+            if self.Fail > 0:
+                self.Fail -= 1
+                return True
+            return False
+
+    def Add(self, Where, Payload):
+        with self.Lock:
+            self.Received.append((self.Kind, Where, Payload))
+        if not self.Quiet:
+            print(Where + ": " + Payload.decode("utf-8", "replace"))
+
+    def Start(self):
+        threading.Thread(target=self.Serve, daemon=True).start()
+
+    def Serve(self):
+        if self.Kind == "influx-http":
+            self.Server.serve_forever()
+        elif self.Kind == "influx-udp":
+            while True:
+                Data, Peer = self.Server.recvfrom(65536)
+                self.Add("udp", Data)
+        else:
+            while True:
+                Connection = self.Server.accept()[0]
+                threading.Thread(target=self.Mqtt, args=(Connection,), daemon=True).start()
+
+    #ONE MQTT CLIENT: CONNACK FOR CONNECT, PINGRESP FOR PINGREQ, PRINT PUBLISH, STOP AT DISCONNECT
+    def Mqtt(self, Connection):
+        try:
+            while True:
+                Header = self.Receive(Connection, 1)
+                Length, Shift = 0, 0
+                while True:
+                    Byte = bytearray(self.Receive(Connection, 1))[0]
+                    Length += (Byte & 0x7F) << Shift
+                    Shift += 7
+                    if not Byte & 0x80:
+                        break
+                Body = self.Receive(Connection, Length)
+                Type = bytearray(Header)[0] >> 4
+                if Type == 1:
+                    Code = 5 if self.Failing() else 0
+                    Connection.sendall(bytes(bytearray([0x20, 2, 0, Code])))
+                elif Type == 3:
+                    Size = struct.unpack(">H", Body[:2])[0]
+                    self.Add(Body[2:2+Size].decode("utf-8"), Body[2+Size:])
+                elif Type == 12:
+                    Connection.sendall(b"\xd0\x00")
+                elif Type == 14:
+                    return
+        except (OSError, IOError):
+            pass
+        finally:
+            Connection.close()
+
+    def Receive(self, Connection, Count):
+        Data = b""
+        while len(Data) < Count:
+            More = Connection.recv(Count - len(Data))
+            if not More:
+                raise IOError("closed")
+            Data += More
+        return Data
+
+def Main():
+    Parser = argparse.ArgumentParser(description="Print what the SDM630 plugin exports.")
+    Parser.add_argument("kind", choices=["mqtt", "influx-http", "influx-udp"])
+    Parser.add_argument("--port", type=int, default=0, help="port to listen on (default: 1883 for MQTT, 8086 for InfluxDB)")
+    Parser.add_argument("--fail", type=int, default=0, help="refuse this many connections or writes first")
+    Arguments = Parser.parse_args()
+    Port = Arguments.port or (1883 if Arguments.kind == "mqtt" else 8086)
+    Server = Sink(Arguments.kind, Port, Arguments.fail)
+    print("Listening for " + Arguments.kind + " on 127.0.0.1:" + str(Server.Port) + ", Ctrl-C to stop.")
+    try:
+        Server.Serve()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    Main()